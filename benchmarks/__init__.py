@@ -0,0 +1 @@
+"""Benchmarks of extrude, running on localhost. See ``python -m benchmarks.run -h``."""
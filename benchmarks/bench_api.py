@@ -0,0 +1,119 @@
+"""Latency and throughput of an API made by ``mk_api`` serving the example functions of
+``extrude.tests.POC``, and cost of browsing the keys of large stores through it.
+
+Run with ``python -m benchmarks.bench_api``.
+"""
+
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from extrude.base import mk_api
+from extrude.client import Transport
+from extrude.tests.POC import funcs as example_funcs
+from benchmarks.bench_util import (
+    latency_summary,
+    serve_wsgi_in_thread,
+    server_url,
+    time_calls,
+)
+
+EXAMPLE_CALLS = {
+    'foo': dict(a=2, b=3, c=1),
+    'bar': dict(x='world'),
+    'confuser': dict(a=3, x=1.5),
+}
+DFLT_STORE_SIZES = (10_000, 100_000, 1_000_000)
+
+
+def serve_api(funcs, mall=None, **api_kwargs):
+    """Serves ``mk_api(funcs, mall, **api_kwargs)`` on a free localhost port, in a
+    daemon thread. Returns the server (see ``bench_util.server_url``)."""
+    server = serve_wsgi_in_thread()
+    host, port = server.server_address[:2]
+    server.set_app(mk_api(funcs, mall, host=host, port=str(port), **api_kwargs))
+    return server
+
+
+def bench_api(n_calls: int = 500, concurrency: int = 8) -> dict:
+    """The latency of sequential calls of each example function, and the throughput of
+    ``concurrency`` clients calling them all in turn."""
+    server = serve_api(example_funcs)
+    url = server_url(server)
+    results = {}
+    try:
+        transport = Transport(url, pool_size=concurrency)
+        for name, kwargs in EXAMPLE_CALLS.items():
+            transport.call(name, kwargs)  # warm up the connection
+            results[name] = latency_summary(
+                time_calls(lambda: transport.call(name, kwargs), n_calls)
+            )
+        calls = list(EXAMPLE_CALLS.items()) * (n_calls // len(EXAMPLE_CALLS))
+        tic = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor:
+            list(executor.map(lambda call: transport.call(*call), calls))
+        elapsed = time.perf_counter() - tic
+        results['throughput'] = dict(
+            concurrency=concurrency,
+            n_calls=len(calls),
+            calls_per_s=round(len(calls) / elapsed, 1),
+        )
+        transport.close()
+    finally:
+        server.shutdown()
+    return results
+
+
+def bench_store_keys(
+    store_sizes=DFLT_STORE_SIZES, n_calls: int = 20, page_size: int = 100
+) -> dict:
+    """The latency of the store key endpoints of ``mk_api`` over stores of
+    ``store_sizes`` keys: the first page, a page at the end of the store, a filtered
+    count, and the batched summary of all stores (``get_many_store_keys``)."""
+    mall = {
+        f'store_{size}': dict.fromkeys(f'key_{i:08d}' for i in range(size))
+        for size in store_sizes
+    }
+    server = serve_api(example_funcs, mall)
+    transport = Transport(server_url(server))
+    results = {}
+    try:
+        for size in store_sizes:
+            store_name = f'store_{size}'
+            calls = dict(
+                first_page=dict(store_name_=store_name, limit=page_size),
+                last_page=dict(
+                    store_name_=store_name,
+                    limit=page_size,
+                    cursor=str(size - page_size),
+                ),
+                count_prefix=dict(store_name_=store_name, prefix='key_0000'),
+            )
+            results[size] = {
+                name: latency_summary(
+                    time_calls(
+                        lambda: transport.call(
+                            'count_store_keys'
+                            if name.startswith('count')
+                            else 'get_store_keys',
+                            kwargs,
+                        ),
+                        n_calls,
+                    )
+                )
+                for name, kwargs in calls.items()
+            }
+        results['get_many_store_keys'] = latency_summary(
+            time_calls(
+                lambda: transport.call('get_many_store_keys', dict(max_keys=1000)),
+                n_calls,
+            )
+        )
+    finally:
+        transport.close()
+        server.shutdown()
+    return results
+
+
+if __name__ == '__main__':
+    print(json.dumps(dict(api=bench_api(), store_keys=bench_store_keys()), indent=2))
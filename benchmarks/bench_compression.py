@@ -0,0 +1,124 @@
+"""Bandwidth and latency trade-off of compressing responses (see
+``extrude.compression``), at different payload sizes.
+
+For each encoding, measures the compressed size and the time spent compressing and
+decompressing a json listing of store keys, and estimates the time to send it over
+links of different bandwidths. Also measures the latency of localhost round trips
+through the compression middleware, where compressing only costs.
+
+Run with ``python -m benchmarks.bench_compression`` (zstd needs ``zstandard``).
+"""
+
+import json
+import urllib.request
+
+from extrude.compression import (
+    available_encodings,
+    compress,
+    decompress,
+    mk_compression_middleware,
+)
+from extrude.middleware import json_response
+from benchmarks.bench_util import (
+    latency_summary,
+    serve_wsgi_in_thread,
+    server_url,
+    time_calls,
+    timed,
+)
+
+IDENTITY = 'identity'
+DFLT_PAYLOAD_SIZES = (1_000, 100_000, 10_000_000)
+DFLT_BANDWIDTHS_MBPS = (10, 100, 1000)
+
+
+def keys_listing(size: int) -> bytes:
+    """The json of a ``get_store_keys`` listing of about ``size`` bytes."""
+    n_keys = max(size // 24, 1)
+    keys = [f'sensors/run_{i:07d}.wav' for i in range(n_keys)]
+    return json.dumps({'sensors': keys}).encode()
+
+
+def bench_encodings(
+    payload_sizes=DFLT_PAYLOAD_SIZES,
+    bandwidths_mbps=DFLT_BANDWIDTHS_MBPS,
+    n_repeats: int = 5,
+) -> dict:
+    """The size, compression and decompression times of listings of ``payload_sizes``
+    bytes with each encoding, and the estimated time to serve them (compress, send,
+    decompress) over links of ``bandwidths_mbps``."""
+    results = {}
+    for size in payload_sizes:
+        data = keys_listing(size)
+        results[size] = {}
+        for encoding in [IDENTITY] + available_encodings():
+            if encoding == IDENTITY:
+                body, compress_s, decompress_s = data, 0, 0
+            else:
+                body, compress_s = timed(lambda: compress(data, encoding), n_repeats)
+                _, decompress_s = timed(lambda: decompress(body, encoding), n_repeats)
+            cpu_ms = (compress_s + decompress_s) * 1e3
+            results[size][encoding] = dict(
+                bytes=len(body),
+                ratio=round(len(data) / len(body), 2),
+                compress_ms=round(compress_s * 1e3, 4),
+                decompress_ms=round(decompress_s * 1e3, 4),
+                **{
+                    f'total_at_{mbps}mbps_ms': round(
+                        cpu_ms + len(body) * 8 / (mbps * 1e6) * 1e3, 4
+                    )
+                    for mbps in bandwidths_mbps
+                },
+            )
+    return results
+
+
+def bench_round_trips(payload_sizes=DFLT_PAYLOAD_SIZES, n_calls: int = 20) -> dict:
+    """The latency of localhost requests getting listings of ``payload_sizes`` bytes,
+    through the compression middleware, with each encoding."""
+    bodies = {size: keys_listing(size) for size in payload_sizes}
+
+    def app(environ, start_response):
+        size = int(environ['PATH_INFO'].strip('/'))
+        return json_response(start_response, json.loads(bodies[size]))
+
+    server = serve_wsgi_in_thread(mk_compression_middleware()(app))
+    url = server_url(server)
+    results = {}
+    try:
+        for size in payload_sizes:
+            results[size] = {}
+            for encoding in [IDENTITY] + available_encodings():
+                request = urllib.request.Request(
+                    f'{url}/{size}', headers={'Accept-Encoding': encoding}
+                )
+
+                def call():
+                    with urllib.request.urlopen(request) as response:
+                        body = response.read()
+                        content_encoding = response.headers.get('Content-Encoding')
+                    if content_encoding:
+                        body = decompress(body, content_encoding)
+                    return body
+
+                call()  # warm up
+                results[size][encoding] = latency_summary(time_calls(call, n_calls))
+    finally:
+        server.shutdown()
+    return results
+
+
+def bench_compression(
+    payload_sizes=DFLT_PAYLOAD_SIZES,
+    bandwidths_mbps=DFLT_BANDWIDTHS_MBPS,
+    n_repeats: int = 5,
+    n_calls: int = 20,
+) -> dict:
+    return dict(
+        encodings=bench_encodings(payload_sizes, bandwidths_mbps, n_repeats),
+        round_trips=bench_round_trips(payload_sizes, n_calls),
+    )
+
+
+if __name__ == '__main__':
+    print(json.dumps(bench_compression(), indent=2))
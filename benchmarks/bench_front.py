@@ -0,0 +1,113 @@
+"""Cost of building the front apps: ``mk_web_app`` construction, cold (no cached spec
+or client) and warm, and the reruns of ``multi_app.dispatch_child_apps``.
+
+Run with ``python -m benchmarks.bench_front``. Streamlit runs in bare mode (without
+``streamlit run``), which only renders to nowhere.
+"""
+
+import json
+import os
+import tempfile
+
+import streamlit as st
+
+from extrude import client
+from extrude.base import mk_web_app
+from extrude.multi_app import (
+    ROOT_APP,
+    ModuleRegistry,
+    dispatch_child_apps,
+    get_module_spec_from_pathname,
+)
+from extrude.tests.POC import funcs as example_funcs
+from benchmarks.bench_api import serve_api
+from benchmarks.bench_util import latency_summary, server_url, time_calls
+
+
+def bench_mk_web_app(n_builds: int = 20) -> dict:
+    """The time to make the front app of the example functions, with a fresh spec cache
+    and client (``cold``), and with the ones kept across builds (``warm``)."""
+    server = serve_api(example_funcs)
+    url = server_url(server)
+
+    def cold_build():
+        client._api_clients.clear()
+        spec_cache = client.OpenApiSpecCache(cache_dir=None)
+        return mk_web_app(example_funcs, api_url=url, openapi_spec_cache=spec_cache)
+
+    try:
+        return dict(
+            cold=latency_summary(time_calls(cold_build, n_builds)),
+            warm=latency_summary(
+                time_calls(lambda: mk_web_app(example_funcs, api_url=url), n_builds)
+            ),
+        )
+    finally:
+        server.shutdown()
+
+
+CHILD_APP_SOURCE = '''
+from streamlitfront import dispatch_funcs
+
+
+def foo(a: int = 0, b: int = 0, c=0):
+    return (a * b) + c
+
+
+def bar(x, greeting='hello'):
+    return f'{greeting} {x}'
+
+
+app = dispatch_funcs([foo, bar])
+'''
+
+
+def mk_child_apps(n_children: int = 3):
+    """Writes the modules of ``n_children`` child apps in a temporary directory, and
+    returns their paths and the configs telling ``dispatch_child_apps`` to get their
+    app from their ``app`` attribute (so that the registry keeps them across reruns).
+    """
+    root_dir = tempfile.mkdtemp(prefix='extrude-bench-children-')
+    pathnames = []
+    for i in range(n_children):
+        pathname = os.path.join(root_dir, f'child_app_{i}.py')
+        with open(pathname, 'w') as fp:
+            fp.write(CHILD_APP_SOURCE)
+        pathnames.append(pathname)
+    configs = {
+        get_module_spec_from_pathname(pathname).name: dict(app='app')
+        for pathname in pathnames
+    }
+    return pathnames, configs
+
+
+def bench_dispatch_reruns(n_reruns: int = 20) -> dict:
+    """The time of the reruns of a multi app (see ``mk_child_apps``) showing its root
+    page, and showing a child app with the modules kept across reruns (``warm``) or not
+    (``cold``)."""
+    pathnames, configs = mk_child_apps()
+    child_name = next(iter(configs))
+    registry = ModuleRegistry()
+
+    def rerun(current_app, registry):
+        st.session_state['current_app'] = current_app
+        dispatch_child_apps(pathnames, configs, registry=registry)
+
+    return dict(
+        root=latency_summary(time_calls(lambda: rerun(ROOT_APP, registry), n_reruns)),
+        child_cold=latency_summary(
+            time_calls(lambda: rerun(child_name, ModuleRegistry()), n_reruns)
+        ),
+        child_warm=latency_summary(
+            time_calls(lambda: rerun(child_name, registry), n_reruns)
+        ),
+    )
+
+
+if __name__ == '__main__':
+    print(
+        json.dumps(
+            dict(mk_web_app=bench_mk_web_app(), dispatch=bench_dispatch_reruns()),
+            indent=2,
+        )
+    )
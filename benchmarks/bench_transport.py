@@ -0,0 +1,40 @@
+"""Per-call overhead of opening a connection per call, as plain ``requests`` calls do,
+versus the pooled keep-alive ``extrude.client.Transport``.
+
+Run with ``python -m benchmarks.bench_transport``.
+"""
+
+import json
+
+import requests
+
+from extrude.client import Transport
+from benchmarks.bench_util import (
+    latency_summary,
+    serve_in_thread,
+    server_url,
+    time_calls,
+)
+
+
+def bench_transport(n_calls: int = 500) -> dict:
+    server = serve_in_thread()
+    url = server_url(server)
+    kwargs = dict(a=1, b=2, c=3)
+    try:
+        connection_per_call = time_calls(
+            lambda: requests.post(f'{url}/foo', json=kwargs).json(), n_calls
+        )
+        transport = Transport(url)
+        pooled = time_calls(lambda: transport.call('foo', kwargs), n_calls)
+        transport.close()
+    finally:
+        server.shutdown()
+    return dict(
+        connection_per_call=latency_summary(connection_per_call),
+        pooled_transport=latency_summary(pooled),
+    )
+
+
+if __name__ == '__main__':
+    print(json.dumps(bench_transport(), indent=2))
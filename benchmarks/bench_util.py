@@ -0,0 +1,94 @@
+"""Utils shared by the benchmarks."""
+
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Iterable
+from wsgiref.simple_server import make_server
+
+from extrude.serving import QuietWSGIRequestHandler, ThreadingWSGIServer
+
+
+def latency_summary(durations: Iterable[float]) -> dict:
+    """Summarizes durations, in seconds, as milliseconds statistics.
+
+    >>> latency_summary([0.001, 0.002, 0.003])
+    {'n': 3, 'mean_ms': 2.0, 'p50_ms': 2.0, 'p99_ms': 3.0}
+    """
+    durations = sorted(durations)
+    n = len(durations)
+
+    def percentile(q):
+        return durations[min(n - 1, int(q * n))]
+
+    return dict(
+        n=n,
+        mean_ms=round(statistics.mean(durations) * 1e3, 4),
+        p50_ms=round(percentile(0.5) * 1e3, 4),
+        p99_ms=round(percentile(0.99) * 1e3, 4),
+    )
+
+
+def time_calls(func: Callable, n_calls: int) -> list:
+    """Calls ``func()`` ``n_calls`` times and returns the duration of each call."""
+    durations = []
+    for _ in range(n_calls):
+        tic = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - tic)
+    return durations
+
+
+def timed(func: Callable, n_repeats: int):
+    """Calls ``func()`` ``n_repeats`` times and returns its last output and the mean
+    duration of the calls, in seconds."""
+    tic = time.perf_counter()
+    for _ in range(n_repeats):
+        result = func()
+    return result, (time.perf_counter() - tic) / n_repeats
+
+
+class EchoHandler(BaseHTTPRequestHandler):
+    """Answers POST requests with their own body, over keep-alive connections."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve_in_thread(handler=EchoHandler):
+    """Starts a localhost http server on a free port, in a daemon thread.
+    Returns the server, whose base url is ``server_url(server)``."""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def serve_wsgi_in_thread(app=None):
+    """Starts a localhost WSGI server, with a thread per request, on a free port, in a
+    daemon thread. The app can be set afterwards, with ``server.set_app(app)``, to make
+    it knowing the port."""
+    server = make_server(
+        '127.0.0.1',
+        0,
+        app,
+        server_class=ThreadingWSGIServer,
+        handler_class=QuietWSGIRequestHandler,
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def server_url(server) -> str:
+    host, port = server.server_address[:2]
+    return f'http://{host}:{port}'
@@ -0,0 +1,50 @@
+"""Encoding and decoding cost, and size, of numeric arrays in json versus the msgpack
+wire format of ``extrude.wire``.
+
+Run with ``python -m benchmarks.bench_wire`` (needs numpy and msgpack).
+"""
+
+import json
+
+import numpy as np
+
+from extrude.wire import JSON_CONTENT_TYPE, MSGPACK_CONTENT_TYPE, decode, encode
+from benchmarks.bench_util import timed
+
+DFLT_ARRAY_SIZES = (1_000, 100_000, 1_000_000)
+
+
+def bench_wire_format(array_sizes=DFLT_ARRAY_SIZES, n_repeats: int = 5) -> dict:
+    results = {}
+    for size in array_sizes:
+        array = np.random.default_rng(0).random(size)
+        json_payload = {'x': array.tolist()}
+        json_body, json_encode_s = timed(
+            lambda: encode(json_payload, JSON_CONTENT_TYPE), n_repeats
+        )
+        _, json_decode_s = timed(
+            lambda: np.array(decode(json_body, JSON_CONTENT_TYPE)['x']), n_repeats
+        )
+        msgpack_body, msgpack_encode_s = timed(
+            lambda: encode({'x': array}, MSGPACK_CONTENT_TYPE), n_repeats
+        )
+        _, msgpack_decode_s = timed(
+            lambda: decode(msgpack_body, MSGPACK_CONTENT_TYPE)['x'], n_repeats
+        )
+        results[size] = dict(
+            json=dict(
+                bytes=len(json_body),
+                encode_ms=round(json_encode_s * 1e3, 4),
+                decode_ms=round(json_decode_s * 1e3, 4),
+            ),
+            msgpack=dict(
+                bytes=len(msgpack_body),
+                encode_ms=round(msgpack_encode_s * 1e3, 4),
+                decode_ms=round(msgpack_decode_s * 1e3, 4),
+            ),
+        )
+    return results
+
+
+if __name__ == '__main__':
+    print(json.dumps(bench_wire_format(), indent=2))
@@ -0,0 +1,150 @@
+"""Runs the benchmarks of extrude and writes their results, along with the versions
+they ran with, to a json file, to compare them across versions.
+
+    python -m benchmarks.run -o results.json
+    python -m benchmarks.run --quick --only api store_keys
+    python -m benchmarks.run -o new.json --compare old.json
+
+A benchmark that can't run (a missing optional dependency, say) gets an ``error``
+instead of results, and doesn't stop the others.
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import traceback
+from importlib import import_module
+from importlib.metadata import PackageNotFoundError, version
+
+PACKAGES = ('extrude', 'py2http', 'http2py', 'streamlitfront', 'front', 'i2', 'dol')
+
+# name: (module, function, kwargs, quick kwargs)
+BENCHMARKS = {
+    'api': ('bench_api', 'bench_api', {}, dict(n_calls=100)),
+    'store_keys': (
+        'bench_api',
+        'bench_store_keys',
+        {},
+        dict(store_sizes=(10_000, 100_000), n_calls=5),
+    ),
+    'mk_web_app': ('bench_front', 'bench_mk_web_app', {}, dict(n_builds=5)),
+    'dispatch': ('bench_front', 'bench_dispatch_reruns', {}, dict(n_reruns=5)),
+    'transport': ('bench_transport', 'bench_transport', {}, dict(n_calls=100)),
+    'wire': (
+        'bench_wire',
+        'bench_wire_format',
+        {},
+        dict(array_sizes=(1_000, 100_000), n_repeats=2),
+    ),
+    'compression': (
+        'bench_compression',
+        'bench_compression',
+        {},
+        dict(payload_sizes=(1_000, 100_000), n_repeats=2, n_calls=5),
+    ),
+}
+
+
+def _package_version(package):
+    try:
+        return version(package)
+    except PackageNotFoundError:
+        return None
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment_info() -> dict:
+    return dict(
+        time=time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        python=sys.version.split()[0],
+        platform=platform.platform(),
+        git_commit=_git_commit(),
+        versions={package: _package_version(package) for package in PACKAGES},
+    )
+
+
+def run_benchmarks(names=None, quick: bool = False) -> dict:
+    """Runs the benchmarks of ``names`` (all by default) and returns their results."""
+    results = {}
+    for name in names or BENCHMARKS:
+        module_name, func_name, kwargs, quick_kwargs = BENCHMARKS[name]
+        print(f'Running {name}...', file=sys.stderr)
+        try:
+            module = import_module(f'benchmarks.{module_name}')
+            results[name] = getattr(module, func_name)(
+                **(quick_kwargs if quick else kwargs)
+            )
+        except Exception as error:
+            traceback.print_exc()
+            results[name] = dict(error=f'{type(error).__name__}: {error}')
+    return results
+
+
+def _flatten(results, prefix=''):
+    for key, value in results.items():
+        path = f'{prefix}{key}'
+        if isinstance(value, dict):
+            yield from _flatten(value, f'{path}.')
+        elif isinstance(value, (int, float)):
+            yield path, value
+
+
+def compare(old: dict, new: dict) -> dict:
+    """The ratios (new / old) of the latencies and throughputs of two runs: below 1 is
+    better for latencies (``_ms``), above 1 for throughputs (``_per_s``).
+
+    >>> compare({'api': {'foo': {'p50_ms': 2.0}}}, {'api': {'foo': {'p50_ms': 1.0}}})
+    {'api.foo.p50_ms': 0.5}
+    """
+    old_values = dict(_flatten(old))
+    return {
+        path: round(value / old_values[path], 3)
+        for path, value in _flatten(new)
+        if path.endswith(('_ms', '_per_s')) and old_values.get(path)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-o', '--output', help='The json file to write results to.')
+    parser.add_argument(
+        '--only', nargs='+', choices=list(BENCHMARKS), help='The benchmarks to run.'
+    )
+    parser.add_argument(
+        '--quick', action='store_true', help='Run fewer and smaller iterations.'
+    )
+    parser.add_argument(
+        '--compare', help='The json file of an earlier run, to compare results with.'
+    )
+    args = parser.parse_args(argv)
+
+    report = dict(
+        environment=environment_info(),
+        quick=args.quick,
+        results=run_benchmarks(args.only, args.quick),
+    )
+    if args.compare:
+        with open(args.compare) as fp:
+            report['ratios_to_baseline'] = compare(
+                json.load(fp)['results'], report['results']
+            )
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as fp:
+            fp.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
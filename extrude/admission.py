@@ -0,0 +1,312 @@
+"""Admission control of the calls of the functions exposed by ``mk_api``.
+
+Each function can be given a limit on the number of its calls running at once, and on
+the number of calls waiting for their turn. Calls beyond that, and calls that waited
+longer than the time their client gave them, are rejected right away with a ``503``
+response, instead of piling up and making every call slower. Rejected responses have a
+``Retry-After`` header, telling when the function is expected to have room again, and
+an ``X-Extrude-Shed`` header, telling clients that the call was not run, so that it can
+safely be sent again (see ``extrude.client.Transport``).
+
+Clients tell how long they will wait for a response with an ``X-Extrude-Timeout``
+header, in seconds.
+
+The calls of a batch (see ``extrude.batch``) are admitted one by one, within the
+limits of their functions (see ``limit_calls``): the ones not admitted fail on their
+own, in the outcomes of the batch.
+"""
+
+import math
+import threading
+import time
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, Mapping, Optional, Union
+
+from extrude.metrics import MetricsRegistry
+from extrude.middleware import json_response
+
+TIMEOUT_HEADER = 'X-Extrude-Timeout'
+SHED_HEADER = 'X-Extrude-Shed'
+SERVICE_UNAVAILABLE = '503 Service Unavailable'
+QUEUE_FULL, DEADLINE = 'queue_full', 'deadline'
+DFLT_RETRY_AFTER = 1
+SERVICE_TIME_EWMA_WEIGHT = 0.2
+
+_request_deadline = ContextVar('extrude_request_deadline', default=None)
+
+
+class Overloaded(RuntimeError):
+    """Raised when a call is not admitted. ``reason`` is ``'queue_full'`` or
+    ``'deadline'``, and ``retry_after`` the number of seconds after which to retry."""
+
+    def __init__(self, message: str, reason: str, retry_after: int = DFLT_RETRY_AFTER):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionLimit:
+    """Admits at most ``max_concurrency`` calls at a time, and makes at most
+    ``max_queue`` others wait for their turn, for at most ``max_wait`` seconds (if
+    given) or until their deadline. Other calls are rejected with an ``Overloaded``
+    error.
+
+    >>> limit = AdmissionLimit(max_concurrency=1, max_queue=0)
+    >>> limit.acquire()
+    >>> limit.acquire()
+    Traceback (most recent call last):
+      ...
+    extrude.admission.Overloaded: 1 calls running and 0 waiting, out of 1 + 0
+    >>> limit.release(service_time=0.5)
+    >>> limit.acquire()
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        max_queue: int = 0,
+        max_wait: Optional[float] = None,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.running = 0
+        self.waiting = 0
+        self.service_time = None  # moving average of the time calls run, in seconds
+        self._condition = threading.Condition()
+
+    def retry_after(self) -> int:
+        """The number of seconds in which a call is expected to be admitted: the time
+        it takes to serve the calls queued, rounded up."""
+        if self.service_time is None:
+            return DFLT_RETRY_AFTER
+        seconds = self.service_time * (self.waiting + 1) / self.max_concurrency
+        return max(math.ceil(seconds), DFLT_RETRY_AFTER)
+
+    def acquire(self, deadline: Optional[float] = None):
+        """Waits for the call to be admitted, until ``deadline`` (a ``time.monotonic``
+        time) at most."""
+        with self._condition:
+            if deadline is not None and deadline <= time.monotonic():
+                raise Overloaded(
+                    'The deadline of the call has passed', DEADLINE, self.retry_after()
+                )
+            if self.running < self.max_concurrency and not self.waiting:
+                self.running += 1
+                return
+            if self.waiting >= self.max_queue:
+                raise Overloaded(
+                    f'{self.running} calls running and {self.waiting} waiting, out '
+                    f'of {self.max_concurrency} + {self.max_queue}',
+                    QUEUE_FULL,
+                    self.retry_after(),
+                )
+            if self.max_wait is not None:
+                max_wait_deadline = time.monotonic() + self.max_wait
+                deadline = min(deadline or max_wait_deadline, max_wait_deadline)
+            self.waiting += 1
+            try:
+                while self.running >= self.max_concurrency:
+                    timeout = None if deadline is None else deadline - time.monotonic()
+                    if timeout is not None and timeout <= 0:
+                        raise Overloaded(
+                            'The call waited past its deadline',
+                            DEADLINE,
+                            self.retry_after(),
+                        )
+                    self._condition.wait(timeout)
+            finally:
+                self.waiting -= 1
+            self.running += 1
+
+    def release(self, service_time: Optional[float] = None):
+        """Lets the next call in, after a call that ran ``service_time`` seconds."""
+        with self._condition:
+            self.running -= 1
+            if service_time is not None:
+                self.service_time = (
+                    service_time
+                    if self.service_time is None
+                    else SERVICE_TIME_EWMA_WEIGHT * service_time
+                    + (1 - SERVICE_TIME_EWMA_WEIGHT) * self.service_time
+                )
+            self._condition.notify()
+
+
+class _ReleasingBody:
+    """The body of a response, releasing the slot of its call once sent (closed)."""
+
+    def __init__(self, body, release):
+        self.body = body
+        self._release = release
+
+    def __iter__(self):
+        return iter(self.body)
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            release, self._release = self._release, None
+            if release is not None:
+                release()
+
+
+def mk_admission_limits(configs: Mapping[str, Union[int, Mapping]]) -> dict:
+    """Makes the AdmissionLimit of each function of a ``{func_name: config}`` mapping,
+    ``config`` being the ``max_concurrency`` or the keyword arguments of the limit.
+
+    >>> limits = mk_admission_limits({'foo': 2, 'bar': dict(max_concurrency=1)})
+    >>> limits['foo'].max_concurrency, limits['bar'].max_concurrency
+    (2, 1)
+    """
+    return {
+        name: AdmissionLimit(
+            **(dict(max_concurrency=config) if isinstance(config, int) else config)
+        )
+        for name, config in configs.items()
+    }
+
+
+def shed_response(start_response, error: Overloaded):
+    """Responds to a call that was not admitted."""
+    return json_response(
+        start_response,
+        dict(error=str(error), reason=error.reason),
+        status=SERVICE_UNAVAILABLE,
+        headers=[('Retry-After', str(error.retry_after)), (SHED_HEADER, error.reason)],
+    )
+
+
+def request_deadline(environ, received: float) -> Optional[float]:
+    """The ``time.monotonic`` time after which the client of a request (received at
+    ``received``) won't wait for its response anymore, if it told (with an
+    ``X-Extrude-Timeout`` header).
+
+    >>> request_deadline({'HTTP_X_EXTRUDE_TIMEOUT': '2.5'}, received=100)
+    102.5
+    >>> request_deadline({}, received=100) is None
+    True
+    """
+    environ_key = 'HTTP_' + TIMEOUT_HEADER.upper().replace('-', '_')
+    try:
+        return received + float(environ[environ_key])
+    except (KeyError, ValueError):
+        return None
+
+
+def _shed_calls_counter(registry: Optional[MetricsRegistry]):
+    if registry is None:
+        return None
+    return registry.counter(
+        'extrude_shed_calls_total', 'Calls rejected by the admission control.'
+    )
+
+
+def limit_calls(
+    func: Callable,
+    limit: AdmissionLimit,
+    name: Optional[str] = None,
+    registry: Optional[MetricsRegistry] = None,
+):
+    """Makes ``func`` admit its calls within ``limit``, raising an ``Overloaded`` error
+    for the others, which are counted in ``registry`` (if given). The deadline of the
+    calls is the one of the request they are made for (see
+    ``mk_admission_middleware``). This is how the calls of a batch are limited, as the
+    middleware only sees the batch.
+
+    >>> limit = AdmissionLimit(max_concurrency=1)
+    >>> limited_pow = limit_calls(pow, limit)
+    >>> limited_pow(2, 10)
+    1024
+    >>> limit.acquire()  # another call is running
+    >>> limited_pow(2, 10)
+    Traceback (most recent call last):
+      ...
+    extrude.admission.Overloaded: 1 calls running and 0 waiting, out of 1 + 0
+    """
+    name = name or func.__name__
+    shed_calls = _shed_calls_counter(registry)
+
+    @wraps(func)
+    def limited_func(*args, **kwargs):
+        try:
+            limit.acquire(_request_deadline.get())
+        except Overloaded as error:
+            if shed_calls is not None:
+                shed_calls.inc(func=name, reason=error.reason)
+            raise
+        admitted = time.monotonic()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            limit.release(time.monotonic() - admitted)
+
+    return limited_func
+
+
+def mk_admission_middleware(
+    limits: Mapping[str, AdmissionLimit], registry: Optional[MetricsRegistry] = None
+):
+    """Returns a middleware admitting the calls of the functions of ``limits`` (a
+    ``{func_name: AdmissionLimit}`` mapping, served at ``/name``) within their limit,
+    and rejecting the others (see ``shed_response``). Calls hold their slot until their
+    response is sent (and closed). The rejected calls are counted in ``registry``, if
+    given. The deadline of every request is kept for the functions of ``limit_calls``
+    to use, for the calls of batches.
+
+    >>> import io
+    >>> def app(environ, start_response):
+    ...     start_response('200 OK', [])
+    ...     return [b'done']
+    >>> limits = {'foo': AdmissionLimit(max_concurrency=1)}
+    >>> admitting_app = mk_admission_middleware(limits)(app)
+    >>> environ = {'PATH_INFO': '/foo'}
+    >>> body = admitting_app(environ, lambda status, headers: None)
+    >>> _ = admitting_app(environ, lambda status, headers: print(status, headers[2:]))
+    503 Service Unavailable [('Retry-After', '1'), ('X-Extrude-Shed', 'queue_full')]
+    >>> list(body)
+    [b'done']
+    >>> body.close()  # the response of the first call is sent: it frees its slot
+    >>> list(admitting_app(environ, lambda status, headers: None))
+    [b'done']
+    """
+    shed_calls = _shed_calls_counter(registry)
+
+    def middleware(wsgi):
+        def admitting_wsgi(environ, start_response):
+            deadline = request_deadline(environ, time.monotonic())
+            token = _request_deadline.set(deadline)
+            try:
+                return admit(environ, start_response, deadline)
+            finally:
+                _request_deadline.reset(token)
+
+        def admit(environ, start_response, deadline):
+            func_name = environ.get('PATH_INFO', '').strip('/')
+            limit = limits.get(func_name)
+            if limit is None:
+                return wsgi(environ, start_response)
+            try:
+                limit.acquire(deadline)
+            except Overloaded as error:
+                if shed_calls is not None:
+                    shed_calls.inc(func=func_name, reason=error.reason)
+                return shed_response(start_response, error)
+            admitted = time.monotonic()
+
+            def release():
+                limit.release(time.monotonic() - admitted)
+
+            try:
+                body = wsgi(environ, start_response)
+            except BaseException:
+                release()
+                raise
+            return _ReleasingBody(body, release)
+
+        return admitting_wsgi
+
+    return middleware
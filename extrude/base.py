@@ -1,39 +1,182 @@
+"""The entry points of extrude: ``mk_api`` and ``run_api`` for the server side, and
+``mk_web_app`` for the front end.
+
+The heavy dependencies of each side are only imported when it is used: ``py2http``
+when an API is made, and ``streamlit``, ``streamlitfront``, ``front``, ``glom`` and
+``http2py`` when a front app is. So a headless API doesn't load any UI library.
+
+>>> LAZY_DEPENDENCIES & imported_modules('import extrude, extrude.base')
+set()
+"""
+
 import json
-from functools import wraps
-from typing import Callable, Iterable, Mapping, Optional
+from functools import partial, wraps
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Iterable,
+    Mapping,
+    Optional,
+    Sequence,
+    Union,
+)
 from urllib.parse import urljoin
-import glom
 
-# import streamlit.bootstrap
-from http2py import HttpClient
 from i2 import name_of_obj
 from i2.wrapper import Sig
-from py2http import mk_app as mk_webservice, run_app as run_webservice
 
-# from py2http.util import run_process
-from streamlitfront.base import mk_app as mk_front_app
-from meshed import DAG
-from front.crude import Mall
-from front import RENDERING_KEY, ELEMENT_KEY
-from streamlitfront.elements import SelectBox
+from extrude.admission import (
+    limit_calls,
+    mk_admission_limits,
+    mk_admission_middleware,
+)
+from extrude.batch import mk_batch_func
+from extrude.client import (
+    DFLT_MAX_RETRIES,
+    DFLT_POOL_SIZE,
+    DFLT_STORE_KEYS_TTL,
+    DFLT_TIMEOUT,
+    ApiClient,
+    OpenApiSpecCache,
+    get_api_client,
+    get_store_keys_cache,
+)
+from extrude.compression import (
+    available_encodings,
+    mk_compression_middleware,
+    mk_content_encodings_spec_patch,
+)
+from extrude.execution import run_in_pool
+from extrude.memo import MEMO_CACHE_ATTR, coalesce_calls, memoize
+from extrude.metrics import (
+    METRICS_PATH,
+    MetricsRegistry,
+    instrument,
+    mk_metrics_middleware,
+)
+from extrude.middleware import (
+    install_middleware,
+    mk_openapi_patch_middleware,
+    mk_response_headers_middleware,
+    mk_routes_middleware,
+)
+from extrude.profiling import DFLT_REPORT_LIMIT, Profiler
+from extrude.serving import DFLT_HOST, DFLT_PORT, serve_prefork, serve_threaded
+from extrude.stores import (
+    DFLT_KEYS_PAGE_SIZE,
+    OUTPUT_STORE_ATTR,
+    count_keys,
+    filter_keys,
+    keys_page,
+    mk_output_storing_func,
+    mk_store_keys_stream_app,
+)
+from extrude.streaming import (
+    is_streaming_func,
+    mk_stream_spec_patch,
+    mk_streaming_middleware,
+)
+from extrude.uploads import UPLOAD_PATH, Uploads
+from extrude.util import SubDagSpec, funcs_fingerprint, imported_modules, split_dag
+from extrude.wire import (
+    advertise_wire_formats,
+    mk_wire_format_middleware,
+    msgpack_available,
+)
 
-from extrude.util import SubDagSpec, split_dag
+if TYPE_CHECKING:
+    from front.crude import Mall
+    from http2py import HttpClient
 
+LAZY_DEPENDENCIES = {
+    'streamlit',
+    'streamlitfront',
+    'front',
+    'meshed',
+    'glom',
+    'http2py',
+    'py2http',
+}
 PARAM_TO_MALL_MAP_ATTR = 'param_to_mall_map'
+DFLT_MAX_EAGER_STORE_KEYS = 1000
+
+
+def mk_store_key_select_box(fetch_keys: Callable[[str], list]):
+    """Makes a select box element fetching its options on demand: the user types a
+    search string and ``fetch_keys(search_string)`` gives the options to choose from.
+    """
+    import streamlit as st
+    from streamlitfront.elements import SelectBox
+
+    class StoreKeySelectBox(SelectBox):
+        def render(self):
+            search = st.text_input(
+                f'Search {self.name}', key=f'{self.name}__store_key_search'
+            )
+            self.options = fetch_keys(search or None)
+            return super().render()
+
+    return StoreKeySelectBox
+
+
+def _api_key(api_url):
+    return api_url if isinstance(api_url, (str, type(None))) else tuple(api_url)
 
 
 def mk_web_app(
-    funcs: Iterable[Callable], *, api: HttpClient = None, api_url: str = None, **kwargs
+    funcs: Iterable[Callable],
+    *,
+    api: Union[ApiClient, 'HttpClient'] = None,
+    api_url: Union[str, Sequence[str]] = None,
+    max_eager_store_keys: int = DFLT_MAX_EAGER_STORE_KEYS,
+    store_keys_page_size: int = DFLT_KEYS_PAGE_SIZE,
+    store_keys_ttl: float = DFLT_STORE_KEYS_TTL,
+    openapi_spec_cache: OpenApiSpecCache = None,
+    pool_size: int = DFLT_POOL_SIZE,
+    timeout=DFLT_TIMEOUT,
+    max_retries: int = DFLT_MAX_RETRIES,
+    **kwargs,
 ):
     """Generates a front application which will consume a web service exposing a bunch
     of functions.
 
     :param funcs: A list of functions.
-    :param api: The HttpClient object to consume the API.
-    :param api_url: The base url of the API to create a HttpClient object in case the 
-    `api` parameter is not provided. Ignored otherwise
+    :param api: The client object to consume the API (an ``extrude.client.ApiClient``
+    or an ``http2py.HttpClient``).
+    :param api_url: The base url of the API to create an ApiClient object in case the
+    `api` parameter is not provided. Ignored otherwise. Can be the list of the base urls
+    of replicas of the API: calls are then spread across the healthy ones (see
+    ``extrude.client.BalancedTransport``), and the spec is only fetched once.
+    :param openapi_spec_cache: (Optional) The cache of the OpenAPI spec used to make the
+    ApiClient from ``api_url``. Defaults to ``extrude.client.openapi_spec_cache``,
+    which keeps specs in process and on disk, and only downloads one again when the
+    ``openapi_fingerprint`` published by the API changes.
+    :param pool_size: The number of keep-alive connections to the API kept by the
+    ApiClient made from ``api_url``.
+    :param timeout: The timeout of the calls to the API, in seconds.
+    :param max_retries: How many times failed calls to the idempotent functions (see
+    ``extrude.client.idempotent``) are retried, with an exponential backoff.
+    :param max_eager_store_keys: The options of a crudified parameter are all fetched
+    up front if its store has at most that many keys. Otherwise, the user searches the
+    store and only a page of ``store_keys_page_size`` matching keys is fetched at a time.
+    :param store_keys_page_size: See ``max_eager_store_keys``.
+    :param store_keys_ttl: The number of seconds after which the store keys fetched for
+    the crudified parameters are refreshed (in the background). The keys of all the
+    stores needed are fetched in one call, and cached across the builds of the app.
     :param kwargs: Any extra keyword argument used to make the front application.
+
+    The items of the outputs of streaming functions (see ``extrude.streaming``) are
+    shown as they arrive.
+
+    The timings of the calls to the API (round trip, serialization, server compute
+    and transfer) are recorded in ``api.transport.metrics`` (see
+    ``extrude.client.Transport``).
     """
+    import glom
+    import streamlit as st
+    from front import ELEMENT_KEY, RENDERING_KEY
+    from streamlitfront.base import mk_app as mk_front_app
+    from streamlitfront.elements import SelectBox
 
     def flatten_api_meth(meth):
         sig = Sig(meth) - 'self'
@@ -41,10 +184,42 @@ def mk_web_app(
         @sig
         @wraps(meth)
         def flat_func(*args, **kwargs):
+            if getattr(meth, 'is_stream', False):
+                return show_stream(meth(*args, **kwargs))
             return meth(*args, **kwargs)
 
         return flat_func
 
+    def show_stream(items):
+        # Shows the items of a streamed output as they arrive, then hands them all over
+        # to the front, which displays the output once the stream is over.
+        placeholder = st.empty()
+        live_output = placeholder.container()
+        received = []
+        for item in items:
+            live_output.write(item)
+            received.append(item)
+        placeholder.empty()
+        return received
+
+    def fetch_store_keys_page(store, search):
+        page = api.get_store_keys(store, contains=search, limit=store_keys_page_size)
+        return page['keys']
+
+    def fetch_many_store_keys(store_names):
+        if hasattr(api, 'get_many_store_keys'):
+            return api.get_many_store_keys(store_names, max_keys=max_eager_store_keys)
+
+        def store_summary(store):  # APIs without the batched endpoint
+            count = None
+            if hasattr(api, 'count_store_keys'):
+                count = api.count_store_keys(store)
+            if count is not None and count > max_eager_store_keys:
+                return dict(count=count, keys=None)
+            return dict(count=count, keys=api.get_store_keys(store))
+
+        return {store: store_summary(store) for store in store_names}
+
     def handle_crudified_params():
         def build_crude_config():
             for func in funcs:
@@ -55,6 +230,7 @@ def mk_web_app(
         crude_config = {k: v for k, v in build_crude_config()}
         if crude_config:
             config = kwargs.get('config', {})
+            params_without_element = []
             for func_name, param_to_mall_map in crude_config.items():
                 for param, store in param_to_mall_map.items():
                     path = '.'.join(
@@ -62,18 +238,42 @@ def mk_web_app(
                     )
                     param_config = glom.glom(config, path, default={})
                     if ELEMENT_KEY not in param_config:
-                        if not hasattr(api, 'get_store_keys'):
-                            raise RuntimeError(
-                                'Some parameters have been crudified but there is no way to get the list of valid keys for them. Make sure to expose the "get_store_keys" endpoint through the API'
-                            )
+                        params_without_element.append((path, param_config, store))
+            if params_without_element:
+                if not hasattr(api, 'get_store_keys'):
+                    raise RuntimeError(
+                        'Some parameters have been crudified but there is no way to get the list of valid keys for them. Make sure to expose the "get_store_keys" endpoint through the API'
+                    )
+                store_keys_cache = get_store_keys_cache(
+                    _api_key(api_url) or api,
+                    fetch_many_store_keys,
+                    fetch_options=dict(max_eager_store_keys=max_eager_store_keys),
+                    ttl=store_keys_ttl,
+                )
+                store_summaries = store_keys_cache.get_many(
+                    store for _, _, store in params_without_element
+                )
+                for path, param_config, store in params_without_element:
+                    keys = store_summaries[store]['keys']
+                    if keys is None:
+                        param_config[ELEMENT_KEY] = mk_store_key_select_box(
+                            partial(fetch_store_keys_page, store)
+                        )
+                    else:
                         param_config[ELEMENT_KEY] = SelectBox
-                        param_config['options'] = api.get_store_keys(store)
-                        glom.assign(config, path, param_config, missing=dict)
+                        param_config['options'] = keys
+                    glom.assign(config, path, param_config, missing=dict)
             kwargs['config'] = config
 
     if not api:
-        openapi_spec_url = urljoin(api_url, 'openapi')
-        api = HttpClient(url=openapi_spec_url)
+        api = get_api_client(
+            api_url,
+            funcs,
+            spec_cache=openapi_spec_cache,
+            pool_size=pool_size,
+            timeout=timeout,
+            max_retries=max_retries,
+        )
     func_names = [name_of_obj(func) for func in funcs]
     ws_funcs = [flatten_api_meth(getattr(api, name)) for name in func_names]
     handle_crudified_params()
@@ -81,28 +281,331 @@ def mk_web_app(
     return mk_front_app(ws_funcs, **kwargs)
 
 
-def mk_api(funcs: Iterable[Callable], mall: Optional[Mall] = None, **kwargs):
+def _apply_func_configs(
+    funcs: Iterable[Callable], func_configs: Optional[Mapping], wrapper: Callable
+):
+    """Wraps the functions that have a config in ``func_configs`` (a ``{func_name:
+    config}`` mapping) with ``wrapper(func, **config)``. A config of True stands for the
+    default config."""
+    func_configs = func_configs or {}
+    for func in funcs:
+        config = func_configs.get(name_of_obj(func))
+        if config:
+            func = wrapper(func, **({} if config is True else config))
+        yield func
+
+
+def _mk_profiler(profiling, mall) -> Optional[Profiler]:
+    if not profiling or isinstance(profiling, Profiler):
+        return profiling or None
+    config = {} if profiling is True else dict(profiling)
+    store_name = config.pop('store_name', None)
+    if store_name is not None:
+        if mall is None:
+            raise ValueError('Keeping profiles in a store requires a mall')
+        if store_name not in mall:
+            mall[store_name] = {}
+        config['store'] = mall[store_name]
+    return Profiler(**config)
+
+
+def mk_api(
+    funcs: Iterable[Callable],
+    mall: Optional['Mall'] = None,
+    *,
+    memo: Optional[Mapping[str, Union[bool, dict]]] = None,
+    coalesce: Iterable[str] = (),
+    execution: Optional[Mapping[str, Union[str, dict]]] = None,
+    admission: Optional[Mapping[str, Union[int, dict]]] = None,
+    output_stores: Optional[Mapping[str, Union[str, dict]]] = None,
+    binary_wire_format: bool = True,
+    upload_dir: Optional[str] = None,
+    metrics: bool = True,
+    profiling: Union[bool, Mapping, Profiler] = None,
+    compression: Union[bool, Mapping] = False,
+    **kwargs,
+):
     """Generates a py2http application with default configuration for extrude.
 
     :param funcs: A list of functions.
+    :param mall: (Optional) The mall holding the stores of the crudified parameters of
+        ``funcs``. Its keys are then listed, paginated and counted by the
+        ``get_store_keys``, ``count_store_keys`` and (batched) ``get_many_store_keys``
+        endpoints, and streamed as newline delimited json by the ``/stream_store_keys``
+        route. Files can be uploaded into its file-backed stores (``dol.Files``, say),
+        in resumable chunks, through the ``/upload`` route (see ``extrude.uploads`` and
+        ``extrude.client.Transport.upload``). A ``extrude.stores.BoundedMall`` keeps the
+        values in memory within a budget, and its ``get_mall_memory_report`` endpoint
+        tells how much is in memory and on disk.
+    :param memo: (Optional) A ``{func_name: config}`` mapping of the functions to
+        memoize, ``config`` being True or the keyword arguments of
+        ``extrude.memo.memoize``. Functions can also be memoized with this decorator
+        beforehand. The ``X-Extrude-Cache`` header of the responses then tells whether
+        results were cached, and the ``invalidate_memo`` endpoint clears cached results.
+        The outputs of functions that also have an ``output_stores`` config are cached,
+        not their keys: every call, hit or miss, stores its output under a new key.
+    :param coalesce: The names of the functions whose identical concurrent calls are
+        coalesced: only one of them computes the result, and the others wait for it and
+        share it (see ``extrude.memo.coalesce_calls``). Coalescing happens beneath
+        memoization, so that concurrent cache misses compute once, and above the
+        execution pools, so that duplicates don't take up a worker. The
+        ``extrude_coalesced_calls_total`` metric counts the computations saved.
+    :param execution: (Optional) A ``{func_name: policy}`` mapping telling where to run
+        functions: ``'inline'`` (the default), ``'thread'`` or ``'process'``, or the
+        keyword arguments of ``extrude.execution.run_in_pool`` to also size the pool
+        and its queue. Functions are run in their pool beneath their memoization.
+        Serve the app with ``run_api(app, threaded=True)`` so that requests waiting for
+        a pool don't hold up the others. Calls finding a full pool queue get a ``503``
+        response, telling clients when to retry.
+    :param admission: (Optional) A ``{func_name: config}`` mapping of the functions
+        whose calls are limited, ``config`` being the maximum number of calls running
+        at once, or the keyword arguments of ``extrude.admission.AdmissionLimit``
+        (``max_concurrency``, ``max_queue``, ``max_wait``). Calls beyond the limit, and
+        calls that waited past the timeout their client gave in an
+        ``X-Extrude-Timeout`` header, are rejected with a ``503`` response and a
+        ``Retry-After`` header, instead of piling up (see ``extrude.admission``). The
+        calls of a batch are limited too: the ones not admitted fail on their own.
+    :param output_stores: (Optional) A ``{func_name: store_name}`` mapping of the
+        functions whose outputs are written in a store of ``mall`` instead of being sent
+        back, the response only holding their key (see
+        ``extrude.stores.mk_output_storing_func``). Functions can also be marked with
+        ``extrude.stores.store_output``. The ``get_stored_value`` endpoint fetches the
+        value of a key when it's really needed, and ``delete_stored_output`` deletes it
+        once it isn't. Only the last outputs of each function are kept: give a
+        ``{'store_name': ..., 'max_outputs': ..., 'ttl': ...}`` dict instead of the
+        store name to change how many, and for how long.
+    :param binary_wire_format: Whether to let clients call the functions with msgpack
+        instead of json, if msgpack is installed (see ``extrude.wire``). The published
+        OpenAPI spec then tells so, for clients to switch to it.
+    :param upload_dir: (Optional) Where to keep the partial files of uploads (see
+        ``extrude.uploads.Uploads``).
+    :param metrics: Whether to measure the calls of the functions (see
+        ``extrude.metrics``): counts, errors, queue, execution and serialization times,
+        payload sizes. The metrics are served at ``/metrics`` in the Prometheus text
+        format, and are the ``extrude_metrics`` attribute of the app.
+    :param profiling: (Optional) Whether to profile calls on demand (see
+        ``extrude.profiling``): True, a Profiler, or its keyword arguments. A
+        ``store_name`` key tells to keep the profiles in that store of ``mall``. Calls
+        are then profiled when requests have an ``X-Extrude-Profile: 1`` header, or
+        at the given ``sample_rate``, and the ``list_profiles`` and ``get_profile``
+        endpoints report on them.
+    :param compression: Whether to compress the responses (to clients accepting it) and
+        decompress the requests (see ``extrude.compression``): True, or the keyword
+        arguments of ``extrude.compression.mk_compression_middleware`` (``min_size``,
+        ``encodings``, ``levels``...). Only responses of at least ``min_size`` bytes
+        are compressed: large outputs, listings of the keys of all the stores... The
+        published OpenAPI spec tells clients they can compress their requests too.
     :param kwargs: Any extra keyword argument used to make the py2http application.
 
+    The outputs of generator functions, and of functions marked with
+    ``extrude.streaming.stream_output``, are streamed as newline delimited json, item
+    by item. These functions run inline, and can't be memoized, coalesced, run in a
+    pool or have their outputs stored.
+
+    The app also has a ``batch`` endpoint, running several calls of the other
+    functions in one request (see ``extrude.batch.mk_batch_func``).
+
     >>> def foo():
     ...     pass
     ...
     >>> app = mk_api([foo])
     """
+    from py2http import mk_app as mk_webservice
+
+    streaming_funcs = {
+        name_of_obj(func): func for func in funcs if is_streaming_func(func)
+    }
+    coalesce = dict.fromkeys(coalesce or (), True)
+    for config_name, func_configs in [
+        ('memo', memo),
+        ('coalesce', coalesce),
+        ('execution', execution),
+        ('output_stores', output_stores),
+    ]:
+        if set(func_configs or ()) & set(streaming_funcs):
+            raise ValueError(
+                f'Streaming functions can not be given a {config_name} config: '
+                f'{set(func_configs) & set(streaming_funcs)}'
+            )
+    profiler = _mk_profiler(profiling, mall)
+    if profiler is not None:
+        funcs = [
+            func
+            if name_of_obj(func) in streaming_funcs
+            else profiler.profile(func, name_of_obj(func))
+            for func in funcs
+        ]
+    execution = {
+        name: dict(mode=policy) if isinstance(policy, str) else policy
+        for name, policy in (execution or {}).items()
+    }
+    funcs = list(_apply_func_configs(funcs, execution, run_in_pool))
+    output_stores = {
+        name: dict(store_name=config) if isinstance(config, str) else dict(config)
+        for name, config in dict(
+            {
+                name_of_obj(func): getattr(func, OUTPUT_STORE_ATTR)
+                for func in funcs
+                if hasattr(func, OUTPUT_STORE_ATTR)
+            },
+            **(output_stores or {}),
+        ).items()
+    }
+    if output_stores and mall is None:
+        raise ValueError('Storing the outputs of functions requires a mall')
+    funcs = list(_apply_func_configs(funcs, coalesce, coalesce_calls))
+    funcs = list(_apply_func_configs(funcs, memo, memoize))
+    # Above memoization, so that cache hits are stored (under a new key) too: cached
+    # keys would outlive the outputs deleted or evicted from the store
+    funcs = [
+        mk_output_storing_func(func, mall, **output_stores[name_of_obj(func)])
+        if name_of_obj(func) in output_stores
+        else func
+        for func in funcs
+    ]
+    routes = {}
+    middlewares = []
+
+    memoized_funcs = {
+        name_of_obj(func): func for func in funcs if hasattr(func, MEMO_CACHE_ATTR)
+    }
+    if memoized_funcs:
+
+        def invalidate_memo(func_name: str = None, kwargs: dict = None):
+            """Clears the cached results of a memoized function, or of all of them if no
+            function name is given. If ``kwargs`` are given, only clears the result of
+            the call with these arguments. Returns the names of the functions whose
+            cache was cleared."""
+            if func_name is None:
+                names = list(memoized_funcs)
+            elif func_name in memoized_funcs:
+                names = [func_name]
+            else:
+                raise ValueError(f'No memoized function named "{func_name}"')
+            for name in names:
+                func = memoized_funcs[name]
+                key = None if kwargs is None else func.memo_key(**kwargs)
+                getattr(func, MEMO_CACHE_ATTR).invalidate(key)
+            return names
+
+        funcs.append(invalidate_memo)
+
+    if profiler is not None:
+
+        def list_profiles(func_name: str = None):
+            """Lists the keys of the stored profiles of calls, of ``func_name`` if
+            given."""
+            return profiler.list_profiles(func_name)
+
+        def get_profile(
+            key: str, sort_by: str = 'cumulative', limit: int = DFLT_REPORT_LIMIT
+        ):
+            """Reports on a stored profile: its ``limit`` top entries, sorted by
+            ``sort_by`` (``cumulative``, ``tottime``, ``ncalls``...)."""
+            return profiler.get_profile(key, sort_by, limit)
+
+        funcs += [list_profiles, get_profile]
 
     if mall is not None:
 
-        def get_store_keys(store_name_: str = None):
-            if store_name_ is None:
-                return {k: get_store_keys(k) for k in mall}
+        def get_store(store_name_):
             if store_name_ not in mall:
                 raise ValueError(f'No store named "{store_name_}"')
-            return list(mall[store_name_])
+            return mall[store_name_]
+
+        def get_store_keys(
+            store_name_: str = None,
+            prefix: str = None,
+            contains: str = None,
+            cursor: str = None,
+            limit: int = None,
+        ):
+            """Lists the keys of a store, or of all stores if no store name is given.
+            The keys can be filtered by ``prefix`` and/or substring (``contains``).
+            If a ``limit`` or a ``cursor`` is given, returns a page of keys along with
+            the cursor to get the next one (see extrude.stores.keys_page). A cursor
+            belongs to the paging of one store: the next pages of the stores are asked
+            for by store name.
+            """
+            if store_name_ is None:
+                if cursor is not None:
+                    raise ValueError('A cursor can only be given with a store name')
+                return {
+                    k: get_store_keys(k, prefix, contains, None, limit) for k in mall
+                }
+            store = get_store(store_name_)
+            if limit is None and cursor is None:
+                return list(filter_keys(store, prefix, contains))
+            return keys_page(
+                store,
+                prefix=prefix,
+                contains=contains,
+                cursor=cursor,
+                limit=limit or DFLT_KEYS_PAGE_SIZE,
+            )
+
+        def count_store_keys(
+            store_name_: str = None, prefix: str = None, contains: str = None
+        ):
+            """Counts the keys of a store, or of each store if no store name is given."""
+            if store_name_ is None:
+                return {k: count_store_keys(k, prefix, contains) for k in mall}
+            return count_keys(get_store(store_name_), prefix, contains)
+
+        def get_many_store_keys(store_names_: list = None, max_keys: int = None):
+            """Tells the number of keys of several stores (all of them by default) in
+            one call, along with their keys if there are at most ``max_keys`` of them.
+            Returns a ``{store_name: {'count': ..., 'keys': ...}}`` dict.
+            """
+            if store_names_ is None:
+                store_names_ = list(mall)
+
+            def store_summary(store_name):
+                count = count_store_keys(store_name)
+                if max_keys is not None and count > max_keys:
+                    return dict(count=count, keys=None)
+                return dict(count=count, keys=get_store_keys(store_name))
+
+            return {name: store_summary(name) for name in store_names_}
+
+        def get_stored_value(store_name_: str, key: str):
+            """Returns the value stored under ``key`` in a store."""
+            store = get_store(store_name_)
+            if key not in store:
+                raise KeyError(f'No key "{key}" in the "{store_name_}" store')
+            return store[key]
 
-        funcs = funcs + [get_store_keys]
+        funcs += [
+            get_store_keys,
+            count_store_keys,
+            get_many_store_keys,
+            get_stored_value,
+        ]
+        output_store_names = {config['store_name'] for config in output_stores.values()}
+        if output_store_names:
+
+            def delete_stored_output(store_name_: str, key: str):
+                """Deletes an output stored under ``key`` in a store of outputs, once it
+                isn't needed anymore. Returns whether there was one."""
+                if store_name_ not in output_store_names:
+                    raise ValueError(f'No store of outputs named "{store_name_}"')
+                store = mall[store_name_]
+                if key not in store:
+                    return False
+                del store[key]
+                return True
+
+            funcs.append(delete_stored_output)
+        if hasattr(mall, 'report'):
+
+            def get_mall_memory_report():
+                """Tells the number and size of the values the stores hold in memory
+                and on disk (see ``extrude.stores.BoundedMall``)."""
+                return mall.report()
+
+            funcs.append(get_mall_memory_report)
+        routes['/stream_store_keys'] = mk_store_keys_stream_app(mall)
+        routes[UPLOAD_PATH] = Uploads(mall, upload_dir)
 
     dflt_config = dict(
         protocol='http',
@@ -120,8 +623,122 @@ def mk_api(funcs: Iterable[Callable], mall: Optional[Mall] = None, **kwargs):
         port = ws_config['port']
         ws_config['openapi'] = dict(base_url=f'{protocol}://{host}:{port}')
 
-    return mk_webservice(funcs, **ws_config)
+    registry = MetricsRegistry() if metrics else None
+    limits = mk_admission_limits(admission or {})
+    batched_funcs = {
+        name_of_obj(func): func
+        for func in funcs
+        if name_of_obj(func) not in streaming_funcs
+    }
+    batched_funcs = {
+        name: (
+            limit_calls(func, limits[name], name, registry) if name in limits else func
+        )
+        for name, func in batched_funcs.items()
+    }
+    funcs.append(mk_batch_func(batched_funcs))
+
+    # What the spec patches of the middlewares add to the spec goes in the fingerprint
+    compression = (
+        ({} if compression is True else dict(compression)) if compression else None
+    )
+    wire_formats = binary_wire_format and msgpack_available()
+    request_encodings = None
+    if compression is not None and compression.get('decompress_requests', True):
+        request_encodings = compression.get('encodings')
+        if request_encodings is None:
+            request_encodings = available_encodings()
+        request_encodings = list(request_encodings)
+    fingerprint = funcs_fingerprint(
+        funcs,
+        openapi=ws_config['openapi'],
+        streams=sorted(streaming_funcs),
+        wire_formats=wire_formats,
+        content_encodings=request_encodings,
+    )
+
+    def openapi_fingerprint():
+        """A hash of the interface of the API, which changes along with its OpenAPI
+        spec. Clients can check it to know whether a spec they cached is still valid."""
+        return fingerprint
+
+    funcs.append(openapi_fingerprint)
+
+    if metrics:
+        funcs = [
+            func
+            if name_of_obj(func) in streaming_funcs
+            else instrument(func, registry, name_of_obj(func))
+            for func in funcs
+        ]
+        routes[METRICS_PATH] = registry
+
+    app = mk_webservice(funcs, **ws_config)
+    app.extrude_ws_config = ws_config
+    app.extrude_metrics = registry
+    if compression is not None:
+        middlewares.append(mk_compression_middleware(**compression))
+    if memoized_funcs or coalesce or execution or metrics or profiler is not None:
+        middlewares.append(mk_response_headers_middleware())
+    if profiler is not None:
+        middlewares.append(profiler.mk_middleware())
+    if metrics:
+        func_names = [name_of_obj(func) for func in funcs]
+        middlewares.append(mk_metrics_middleware(registry, func_names))
+    if limits:
+        middlewares.append(mk_admission_middleware(limits, registry))
+    if routes:
+        middlewares.append(mk_routes_middleware(routes))
+    if streaming_funcs:
+        middlewares += [
+            mk_streaming_middleware(streaming_funcs),
+            mk_openapi_patch_middleware(mk_stream_spec_patch(streaming_funcs)),
+        ]
+    if request_encodings is not None:
+        middlewares.append(
+            mk_openapi_patch_middleware(
+                mk_content_encodings_spec_patch(request_encodings)
+            )
+        )
+    if wire_formats:
+        middlewares += [
+            mk_wire_format_middleware(
+                {
+                    name_of_obj(func): func
+                    for func in funcs
+                    if name_of_obj(func) not in streaming_funcs
+                },
+                ws_config,
+            ),
+            mk_openapi_patch_middleware(advertise_wire_formats),
+        ]
+    if middlewares:
+        install_middleware(app, *middlewares)
+    return app
 
 
-def run_api(app, **kwargs):
+def run_api(app, *, threaded: bool = False, workers: int = None, **kwargs):
+    """Serves an app made by ``mk_api``.
+
+    :param app: The app.
+    :param threaded: If True, serve with a thread per request (see
+        ``extrude.serving.serve_threaded``) instead of the default server of py2http.
+        The ``host`` and ``port`` default to the ones given to ``mk_api``.
+    :param workers: (Optional) If given, serve with that many forked worker processes
+        on the same port, each with a thread per request (see
+        ``extrude.serving.serve_prefork``; ``SIGHUP`` restarts them gracefully). The
+        stores of the mall of the app must then be shared by the processes (see
+        ``extrude.stores.mk_sqlite_mall``). Memoized results and metrics are per
+        worker.
+    :param kwargs: Any extra keyword argument used to run the py2http application.
+    """
+    ws_config = dict(getattr(app, 'extrude_ws_config', {}), **kwargs)
+    host = ws_config.get('host', DFLT_HOST)
+    port = ws_config.get('port', DFLT_PORT)
+    from py2http import run_app as run_webservice
+
+    if workers:
+        return serve_prefork(app, host=host, port=port, workers=workers)
+    if threaded:
+        return serve_threaded(app, host=host, port=port)
     run_webservice(app, **kwargs)
@@ -0,0 +1,168 @@
+"""Batch invocation: several calls of the functions of an API in one request."""
+
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Mapping
+
+BATCH_FUNC_NAME = 'batch'
+DFLT_BATCH_MAX_WORKERS = 8
+
+_in_batch = contextvars.ContextVar('extrude_in_batch', default=False)
+
+
+def in_batch() -> bool:
+    """Whether the current call is one of the calls of a batch, rather than the whole
+    request: the status and headers of the response then belong to the batch, and
+    must not be set after one of its calls.
+
+    >>> in_batch()
+    False
+    >>> mk_batch_func({'f': in_batch})([{'func': 'f'}])
+    [{'result': True}]
+    """
+    return _in_batch.get()
+
+
+class BatchCallError(RuntimeError):
+    """The error of one call of a batch.
+
+    :param index: The position of the call in the batch.
+    :param message: The error message given by the API.
+    """
+
+    def __init__(self, index: int, message: str):
+        super().__init__(f'Call {index} of the batch failed: {message}')
+        self.index = index
+        self.message = message
+
+
+def _run_call(funcs: Mapping[str, Callable], call: Mapping) -> dict:
+    try:
+        func = funcs[call['func']]
+    except KeyError:
+        return dict(error=f'No function named "{call.get("func")}"')
+    token = _in_batch.set(True)
+    try:
+        return dict(result=func(**call.get('kwargs', {})))
+    except Exception as error:
+        return dict(error=f'{type(error).__name__}: {error}')
+    finally:
+        _in_batch.reset(token)
+
+
+def mk_batch_func(
+    funcs: Mapping[str, Callable], max_workers: int = DFLT_BATCH_MAX_WORKERS
+) -> Callable:
+    """Makes the ``batch`` function of an API exposing ``funcs`` (a ``{name: func}``
+    mapping).
+
+    >>> batch = mk_batch_func({'add': lambda a, b: a + b, 'neg': lambda x: -x})
+    >>> outcomes = batch([
+    ...     {'func': 'add', 'kwargs': {'a': 1, 'b': 2}},
+    ...     {'func': 'neg', 'kwargs': {'x': 'a'}},
+    ...     {'func': 'neg', 'kwargs': {'x': 4}},
+    ... ])
+    >>> for outcome in outcomes:
+    ...     print(outcome)
+    {'result': 3}
+    {'error': "TypeError: bad operand type for unary -: 'str'"}
+    {'result': -4}
+    """
+    executor = ThreadPoolExecutor(max_workers, thread_name_prefix='extrude-batch')
+
+    def batch(calls: list, concurrent: bool = False):
+        """Runs several calls, given as ``{'func': func_name, 'kwargs': {...}}`` dicts,
+        in order, or concurrently if ``concurrent`` is True. Returns the outcomes of the
+        calls, in order, as ``{'result': ...}`` or ``{'error': ...}`` dicts: one call
+        failing doesn't prevent the others from running.
+        """
+        if not concurrent:
+            return [_run_call(funcs, call) for call in calls]
+        futures = [
+            executor.submit(contextvars.copy_context().run, _run_call, funcs, call)
+            for call in calls
+        ]
+        return [future.result() for future in futures]
+
+    return batch
+
+
+class CallBatch:
+    """Queues calls of the functions of an API, to send them in one request to its
+    ``batch`` endpoint. Attributes are the functions of the API: calling one queues a
+    call and returns its position in the batch.
+
+    >>> sent = []
+    >>> batch = CallBatch(lambda calls, concurrent: sent.append(calls) or [
+    ...     {'result': 3}, {'error': 'ZeroDivisionError: division by zero'}
+    ... ])
+    >>> batch.add(a=1, b=2)
+    0
+    >>> batch.div(x=1, y=0)
+    1
+    >>> results = batch.send(raise_errors=False)
+    >>> results[0]
+    3
+    >>> print(results[1])
+    Call 1 of the batch failed: ZeroDivisionError: division by zero
+    >>> sent[0][1]
+    {'func': 'div', 'kwargs': {'x': 1, 'y': 0}}
+
+    :param send_calls: A function taking the list of calls and the ``concurrent`` flag,
+        and returning the outcomes (typically, the ``batch`` method of a client).
+    :param concurrent: Whether the API may run the calls concurrently.
+    :param kwargs_of_call: (Optional) A ``(func_name, args, kwargs) -> kwargs``
+        function, to allow positional arguments.
+    """
+
+    def __init__(
+        self,
+        send_calls: Callable,
+        *,
+        concurrent: bool = False,
+        kwargs_of_call: Callable = None,
+    ):
+        self.send_calls = send_calls
+        self.concurrent = concurrent
+        self.kwargs_of_call = kwargs_of_call
+        self.calls = []
+        self.results = None
+
+    def call(self, func_name: str, *args, **kwargs) -> int:
+        """Queues a call of ``func_name`` and returns its position in the batch."""
+        if self.kwargs_of_call is not None:
+            kwargs = self.kwargs_of_call(func_name, args, kwargs)
+        elif args:
+            raise TypeError('Batched calls only take keyword arguments')
+        self.calls.append(dict(func=func_name, kwargs=kwargs))
+        return len(self.calls) - 1
+
+    def __getattr__(self, func_name):
+        if func_name.startswith('_'):
+            raise AttributeError(func_name)
+        return lambda *args, **kwargs: self.call(func_name, *args, **kwargs)
+
+    def send(self, raise_errors: bool = True) -> list:
+        """Sends the queued calls and returns their results, in order. The first error
+        is raised as a BatchCallError if ``raise_errors``, else errors are returned as
+        BatchCallError instances among the results."""
+        calls, self.calls = self.calls, []
+        outcomes = self.send_calls(calls, self.concurrent) if calls else []
+        self.results = [
+            BatchCallError(i, outcome['error'])
+            if 'error' in outcome
+            else outcome['result']
+            for i, outcome in enumerate(outcomes)
+        ]
+        if raise_errors:
+            for result in self.results:
+                if isinstance(result, BatchCallError):
+                    raise result
+        return self.results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.send()
@@ -0,0 +1,955 @@
+"""Tools for the client side of extrude: the front apps consuming an extrude API."""
+
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import weakref
+from inspect import Parameter, Signature
+from typing import Callable, Hashable, Iterable, Mapping, Optional, Sequence, Union
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+from i2 import Sig, name_of_obj
+from urllib3.exceptions import NewConnectionError
+
+from extrude.admission import SHED_HEADER, TIMEOUT_HEADER
+from extrude.batch import BATCH_FUNC_NAME, CallBatch
+from extrude.compression import (
+    CONTENT_ENCODINGS_SPEC_KEY,
+    DFLT_MIN_SIZE,
+    available_encodings,
+    compress,
+)
+from extrude.metrics import (
+    DFLT_SIZE_BUCKETS,
+    EXECUTION,
+    QUEUE,
+    MetricsRegistry,
+    parse_server_timing,
+)
+from extrude.streaming import STREAM_SPEC_KEY, iter_response_items
+from extrude.uploads import DFLT_UPLOAD_CHUNK_SIZE, UPLOAD_PATH
+from extrude.wire import (
+    JSON_CONTENT_TYPE,
+    MSGPACK_CONTENT_TYPE,
+    WIRE_FORMATS_SPEC_KEY,
+    decode,
+    encode,
+    msgpack_available,
+)
+
+DFLT_STORE_KEYS_TTL = 60
+DFLT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'extrude')
+DFLT_SPEC_REVALIDATE_AFTER = 5
+DFLT_POOL_SIZE = 10
+DFLT_TIMEOUT = 30
+DFLT_MAX_RETRIES = 2
+DFLT_BACKOFF_FACTOR = 0.1
+RETRY_STATUSES = frozenset([502, 503, 504])
+DFLT_MAX_RETRY_AFTER = 10
+DFLT_REPLICA_COOLDOWN = 1
+DFLT_MAX_REPLICA_COOLDOWN = 30
+LATENCY_EWMA_WEIGHT = 0.3
+
+IDEMPOTENT_ATTR = 'idempotent'
+# Endpoints added by extrude.base.mk_api, which can safely be called again
+IDEMPOTENT_ENDPOINTS = frozenset(
+    [
+        'get_store_keys',
+        'count_store_keys',
+        'get_many_store_keys',
+        'get_stored_value',
+        'openapi_fingerprint',
+    ]
+)
+
+
+def idempotent(func: Callable):
+    """Marks ``func`` as idempotent, so that clients may retry its failed calls.
+
+    >>> @idempotent
+    ... def foo(x):
+    ...     return x
+    >>> getattr(foo, IDEMPOTENT_ATTR)
+    True
+    """
+    setattr(func, IDEMPOTENT_ATTR, True)
+    return func
+
+
+class ApiCallError(requests.HTTPError):
+    """Raised when a call to an API function gets an error response."""
+
+
+class Transport:
+    """Sends requests to an API through a pool of keep-alive connections.
+
+    Calls of idempotent functions that fail on a connection error, a timeout or a
+    502/503/504 response are retried up to ``max_retries`` times, with an exponential
+    backoff of ``backoff_factor * 2 ** attempt`` seconds. Other calls are only retried
+    when the server tells it did not run them (see ``extrude.admission``), since it may
+    have run them already otherwise. Retries wait for the ``Retry-After`` the server
+    asks for, if longer than the backoff, and aren't made if it's longer than
+    ``max_retry_after`` seconds. Requests tell the server how long they are waited for
+    (``X-Extrude-Timeout``), so that it doesn't run calls nobody waits for anymore.
+
+    The timings of the calls are recorded in the ``metrics`` attribute (an
+    ``extrude.metrics.MetricsRegistry``): the round trip, the time spent encoding and
+    decoding on the client (``serialization``), the time spent computing on the server
+    (queued and running, as told by its ``Server-Timing`` header) and the rest of the
+    round trip (``transfer``: network, and serialization on the server).
+
+    Compressed responses (see ``extrude.compression``) are decompressed by ``requests``,
+    which tells the server the encodings it can decompress. Request bodies of at least
+    ``compression_min_size`` bytes are compressed with ``request_encoding``, if given.
+
+    :param base_url: The base url of the API.
+    :param pool_size: The maximum number of connections kept alive.
+    :param timeout: The timeout of the requests, in seconds. Can be a ``(connect,
+        read)`` tuple.
+    :param max_retries: See above.
+    :param backoff_factor: See above.
+    :param max_retry_after: See above.
+    :param content_type: The wire format of the calls: json, or msgpack (see
+        ``extrude.wire``).
+    :param request_encoding: (Optional) See above. ``'gzip'`` or ``'zstd'``.
+    :param compression_min_size: See above.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        *,
+        pool_size: int = DFLT_POOL_SIZE,
+        timeout=DFLT_TIMEOUT,
+        max_retries: int = DFLT_MAX_RETRIES,
+        backoff_factor: float = DFLT_BACKOFF_FACTOR,
+        max_retry_after: float = DFLT_MAX_RETRY_AFTER,
+        content_type: str = JSON_CONTENT_TYPE,
+        request_encoding: Optional[str] = None,
+        compression_min_size: int = DFLT_MIN_SIZE,
+    ):
+        self.base_url = base_url.rstrip('/') + '/'
+        self.content_type = content_type
+        self.request_encoding = request_encoding
+        self.compression_min_size = compression_min_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_retry_after = max_retry_after
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.metrics = MetricsRegistry()
+
+    def url(self, path: str) -> str:
+        return urljoin(self.base_url, path.lstrip('/'))
+
+    def _send_request(self, method: str, url: str, request_kwargs):
+        read_timeout = self.timeout
+        if isinstance(read_timeout, tuple):
+            read_timeout = read_timeout[1]
+        if read_timeout is not None:
+            headers = {TIMEOUT_HEADER: str(read_timeout)}
+            headers.update(request_kwargs.get('headers') or {})
+            request_kwargs = dict(request_kwargs, headers=headers)
+        return self.session.request(method, url, timeout=self.timeout, **request_kwargs)
+
+    def _retry_delay(
+        self, response: requests.Response, attempt: int, idempotent: bool
+    ) -> Optional[float]:
+        """How long to wait before retrying a request that got ``response``, or None
+        if it should not be retried."""
+        is_shed = SHED_HEADER in response.headers
+        if not is_shed and not (idempotent and response.status_code in RETRY_STATUSES):
+            return None
+        backoff = self.backoff_factor * 2 ** attempt
+        retry_after = retry_after_seconds(response)
+        if retry_after is None:
+            return backoff
+        if retry_after > self.max_retry_after:
+            return None
+        return max(backoff, retry_after)
+
+    def request(
+        self, method: str, path: str, *, idempotent: bool = False, **request_kwargs
+    ) -> requests.Response:
+        for attempt in range(self.max_retries + 1):
+            is_last_attempt = attempt == self.max_retries
+            delay = self.backoff_factor * 2 ** attempt
+            try:
+                response = self._send_request(method, self.url(path), request_kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if is_last_attempt or not idempotent:
+                    raise
+            else:
+                delay = self._retry_delay(response, attempt, idempotent)
+                if is_last_attempt or delay is None:
+                    return response
+            time.sleep(delay)
+
+    def call(
+        self,
+        path: str,
+        kwargs: Mapping,
+        *,
+        http_method: str = 'post',
+        idempotent: bool = False,
+    ):
+        """Calls the function of the API at ``path`` with ``kwargs`` and returns its
+        output."""
+        started = time.perf_counter()
+        if http_method.lower() == 'get':
+            request_kwargs = dict(params=kwargs)
+        elif self.content_type == MSGPACK_CONTENT_TYPE:
+            request_kwargs = dict(
+                data=encode(kwargs, MSGPACK_CONTENT_TYPE),
+                headers={
+                    'Content-Type': MSGPACK_CONTENT_TYPE,
+                    'Accept': MSGPACK_CONTENT_TYPE,
+                },
+            )
+        else:
+            request_kwargs = dict(
+                data=json.dumps(kwargs, allow_nan=False).encode(),
+                headers={'Content-Type': JSON_CONTENT_TYPE},
+            )
+        data = request_kwargs.get('data')
+        if self.request_encoding and len(data or b'') >= self.compression_min_size:
+            request_kwargs['data'] = compress(data, self.request_encoding)
+            request_kwargs['headers']['Content-Encoding'] = self.request_encoding
+        sent = time.perf_counter()
+        response = self.request(
+            http_method, path, idempotent=idempotent, **request_kwargs
+        )
+        received = time.perf_counter()
+        output = decode_response(response)
+        self._record_call(
+            path.strip('/'),
+            response,
+            round_trip=received - sent,
+            serialization=(sent - started) + (time.perf_counter() - received),
+            request_size=len(request_kwargs.get('data') or b''),
+        )
+        if not response.ok:
+            raise ApiCallError(
+                f'{response.status_code} error calling {path}: {output}',
+                response=response,
+            )
+        return output
+
+    def _record_call(
+        self, func_name, response, round_trip, serialization, request_size
+    ):
+        server_timings = parse_server_timing(response.headers.get('Server-Timing'))
+        compute = server_timings.get(QUEUE, 0) + server_timings.get(EXECUTION, 0)
+        metrics = self.metrics
+        metrics.counter('extrude_client_calls_total', 'Calls.').inc(func=func_name)
+        if not response.ok:
+            metrics.counter('extrude_client_errors_total', 'Failed calls.').inc(
+                func=func_name
+            )
+        for name, help, seconds in [
+            ('round_trip', 'Time from sending a request to its response.', round_trip),
+            ('serialization', 'Time spent encoding and decoding.', serialization),
+            ('server_compute', 'Time the call queued and ran on the server.', compute),
+            (
+                'transfer',
+                'Round trip time not spent computing on the server: network, and '
+                'serialization on the server.',
+                max(round_trip - compute, 0),
+            ),
+        ]:
+            metrics.histogram(f'extrude_client_{name}_seconds', help).observe(
+                seconds, func=func_name
+            )
+        for name, size in [
+            ('request', request_size),
+            ('response', len(response.content)),
+        ]:
+            metrics.histogram(
+                f'extrude_client_{name}_bytes',
+                f'Size of the {name} body.',
+                DFLT_SIZE_BUCKETS,
+            ).observe(size, func=func_name)
+
+    def stream(self, path: str, kwargs: Mapping):
+        """Calls the streaming function of the API at ``path`` (see
+        ``extrude.streaming``) with ``kwargs`` and returns an iterator over the items of
+        its output, yielded as they arrive. Errors of the call itself are raised right
+        away, and the ones the function raised while streaming are raised as a
+        ``extrude.streaming.StreamError`` when reached."""
+        response = self.request('post', path, json=kwargs, stream=True)
+        if not response.ok:
+            with response:
+                raise ApiCallError(
+                    f'{response.status_code} error calling {path}: '
+                    f'{decode_response(response)}',
+                    response=response,
+                )
+        return iter_response_items(response)
+
+    def upload(
+        self,
+        filepath: str,
+        store_name: str,
+        key: str = None,
+        *,
+        chunk_size: int = DFLT_UPLOAD_CHUNK_SIZE,
+    ) -> str:
+        """Uploads a file into a file-backed store of the API (see ``extrude.uploads``)
+        in chunks of ``chunk_size`` bytes, so that only one chunk is in memory at a
+        time. An upload that was interrupted (in this call, or an earlier one) resumes
+        where the API says it stopped. Returns the key of the file in the store, which
+        defaults to the name of the file."""
+        key = key or os.path.basename(filepath)
+        params = dict(store_name_=store_name, key=key)
+        size = os.path.getsize(filepath)
+        with open(filepath, 'rb') as fp:
+            for attempt in range(self.max_retries + 1):
+                status = self._upload_request('get', params)
+                try:
+                    while not status['complete']:
+                        fp.seek(status['offset'])
+                        chunk = fp.read(chunk_size)
+                        offset = status['offset'] + len(chunk)
+                        status = self._upload_request(
+                            'put',
+                            dict(
+                                params,
+                                offset=status['offset'],
+                                complete=str(offset >= size).lower(),
+                            ),
+                            data=chunk,
+                        )
+                    return key
+                except (requests.ConnectionError, requests.Timeout):
+                    if attempt == self.max_retries:
+                        raise
+                    time.sleep(self.backoff_factor * 2 ** attempt)
+
+    def _upload_request(self, http_method, params, **request_kwargs):
+        response = self.request(
+            http_method, UPLOAD_PATH, params=params, idempotent=True, **request_kwargs
+        )
+        if not response.ok and response.status_code != 409:  # 409: at another offset
+            raise ApiCallError(
+                f'{response.status_code} error uploading {params["key"]}: '
+                f'{decode_response(response)}',
+                response=response,
+            )
+        return response.json()
+
+    def close(self):
+        self.session.close()
+
+
+def retry_after_seconds(response: requests.Response) -> Optional[float]:
+    """The number of seconds the ``Retry-After`` header of ``response`` asks to wait,
+    if it has one (in seconds: HTTP dates are ignored)."""
+    try:
+        return max(float(response.headers['Retry-After']), 0)
+    except (KeyError, ValueError):
+        return None
+
+
+def _connection_failed(error: requests.RequestException) -> bool:
+    """Whether ``error`` was raised before a connection to the server was made, in
+    which case the request was surely not sent."""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    cause = error.args[0] if error.args else None
+    return isinstance(getattr(cause, 'reason', None), NewConnectionError)
+
+
+class _Replica:
+    def __init__(self, url: str):
+        self.url = url.rstrip('/') + '/'
+        self.outstanding = 0
+        self.latency = None  # exponentially weighted moving average, in seconds
+        self.failures = 0  # consecutive ones
+        self.down_until = 0.0
+
+    def load(self) -> float:
+        return (self.outstanding + 1) * (self.latency or 0)
+
+    def status(self, now: float) -> dict:
+        return dict(
+            url=self.url,
+            healthy=self.down_until <= now,
+            outstanding=self.outstanding,
+            latency=self.latency,
+            failures=self.failures,
+        )
+
+
+class BalancedTransport(Transport):
+    """A Transport spreading requests across the replicas of an API, served at
+    ``base_urls``.
+
+    Each request goes to the healthy replica with the least load: its number of
+    outstanding requests, weighted by its (moving average) latency. Replicas are checked
+    passively: a replica failing to respond (connection error, timeout, or 502/503/504
+    response) is taken out for ``cooldown`` seconds, doubled on each consecutive
+    failure up to ``max_cooldown``, and its requests fail over to another replica. Calls
+    of idempotent functions fail over up to ``max_retries`` times. Other calls only fail
+    over when no connection could be made, or when the replica tells it did not run
+    them (see ``extrude.admission``), since a replica may have run them already.
+    If all replicas are out, the one due back first is tried.
+
+    Uploads go to a single replica, where they resume.
+
+    :param base_urls: The base urls of the replicas.
+    :param cooldown: See above.
+    :param max_cooldown: See above.
+    :param transport_kwargs: The keyword arguments of ``Transport``.
+    """
+
+    def __init__(
+        self,
+        base_urls: Sequence[str],
+        *,
+        cooldown: float = DFLT_REPLICA_COOLDOWN,
+        max_cooldown: float = DFLT_MAX_REPLICA_COOLDOWN,
+        pool_size: int = DFLT_POOL_SIZE,
+        **transport_kwargs,
+    ):
+        if not base_urls:
+            raise ValueError('No replica urls given')
+        super().__init__(base_urls[0], pool_size=pool_size, **transport_kwargs)
+        self.replicas = [_Replica(url) for url in base_urls]
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        adapter = HTTPAdapter(
+            pool_connections=len(self.replicas), pool_maxsize=pool_size
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._lock = threading.Lock()
+        self._pinned = threading.local()
+
+    def replicas_status(self) -> list:
+        """The health, load and latency of each replica."""
+        now = time.monotonic()
+        with self._lock:
+            return [replica.status(now) for replica in self.replicas]
+
+    def _pick(self, exclude=()) -> _Replica:
+        pinned = getattr(self._pinned, 'replica', None)
+        if pinned is not None:
+            return pinned
+        now = time.monotonic()
+        with self._lock:
+            candidates = [r for r in self.replicas if r not in exclude] or self.replicas
+            healthy = [r for r in candidates if r.down_until <= now]
+            if not healthy:
+                return min(candidates, key=lambda r: r.down_until)
+            random.shuffle(healthy)  # spreads the requests among equally loaded ones
+            return min(healthy, key=_Replica.load)
+
+    def _send(self, replica: _Replica, method: str, path: str, request_kwargs):
+        with self._lock:
+            replica.outstanding += 1
+        started = time.monotonic()
+        failed, retry_after = True, None
+        try:
+            response = self._send_request(
+                method, urljoin(replica.url, path.lstrip('/')), request_kwargs
+            )
+            failed = response.status_code in RETRY_STATUSES
+            if failed:
+                retry_after = retry_after_seconds(response)
+            return response
+        finally:
+            latency = time.monotonic() - started
+            self._update_replica(replica, latency, failed, retry_after)
+
+    def _update_replica(
+        self,
+        replica: _Replica,
+        latency: float,
+        failed: bool,
+        retry_after: Optional[float] = None,
+    ):
+        labels = dict(replica=replica.url)
+        self.metrics.counter(
+            'extrude_client_replica_requests_total', 'Requests sent to the replica.'
+        ).inc(**labels)
+        with self._lock:
+            replica.outstanding -= 1
+            if failed:
+                replica.failures += 1
+                cooldown = self.cooldown * 2 ** (replica.failures - 1)
+                cooldown = max(min(cooldown, self.max_cooldown), retry_after or 0)
+                replica.down_until = time.monotonic() + cooldown
+            else:
+                replica.failures = 0
+                replica.latency = (
+                    latency
+                    if replica.latency is None
+                    else LATENCY_EWMA_WEIGHT * latency
+                    + (1 - LATENCY_EWMA_WEIGHT) * replica.latency
+                )
+        if failed:
+            self.metrics.counter(
+                'extrude_client_replica_failures_total',
+                'Requests the replica failed to respond to.',
+            ).inc(**labels)
+
+    def request(
+        self, method: str, path: str, *, idempotent: bool = False, **request_kwargs
+    ) -> requests.Response:
+        tried = []
+        while True:
+            replica = self._pick(exclude=tried)
+            tried.append(replica)
+            attempt = len(tried) - 1
+            is_last_attempt = attempt >= self.max_retries
+            delay = self.backoff_factor * 2 ** attempt
+            try:
+                response = self._send(replica, method, path, request_kwargs)
+            except (requests.ConnectionError, requests.Timeout) as error:
+                untried = len(tried) < len(self.replicas)
+                fails_over = untried and _connection_failed(error)
+                if not (fails_over or (idempotent and not is_last_attempt)):
+                    raise
+            else:
+                delay = self._retry_delay(response, attempt, idempotent)
+                if is_last_attempt or delay is None:
+                    return response
+            if len(tried) >= len(self.replicas):  # all tried: let them recover a bit
+                time.sleep(delay)
+
+    def upload(self, filepath: str, store_name: str, key: str = None, **kwargs) -> str:
+        self._pinned.replica = self._pick()
+        try:
+            return super().upload(filepath, store_name, key, **kwargs)
+        finally:
+            self._pinned.replica = None
+
+
+def decode_response(response: requests.Response):
+    """Decodes the body of a response according to its content type."""
+    content_type = response.headers.get('Content-Type', JSON_CONTENT_TYPE)
+    if content_type.startswith(MSGPACK_CONTENT_TYPE):
+        return decode(response.content, MSGPACK_CONTENT_TYPE)
+    try:
+        return response.json()
+    except ValueError:
+        return response.text
+
+
+def _signature_of_operation(operation_spec: Mapping) -> Signature:
+    """Makes a signature from the json schema of the request body of an operation."""
+    content = operation_spec.get('requestBody', {}).get('content', {})
+    schema = content.get('application/json', {}).get('schema', {})
+    required = set(schema.get('required', []))
+    properties = sorted(schema.get('properties', {}), key=lambda p: p not in required)
+    return Signature(
+        [
+            Parameter(
+                name,
+                Parameter.POSITIONAL_OR_KEYWORD,
+                default=Parameter.empty if name in required else None,
+            )
+            for name in properties
+        ]
+    )
+
+
+class ApiClient:
+    """Exposes the functions of an extrude API as methods, given its OpenAPI spec.
+
+    Unlike ``http2py.HttpClient``, calls go through a ``Transport``, reusing pooled
+    keep-alive connections instead of opening a connection per call.
+
+    :param openapi_spec: The OpenAPI spec of the API.
+    :param transport: (Optional) The Transport to send calls with. Defaults to one
+        made from the first server url of the spec.
+    :param funcs: (Optional) Local versions of the functions exposed by the API. Their
+        signatures are given to the methods, and they tell which functions are
+        idempotent (see ``idempotent``).
+    :param wire_format: ``'json'``, ``'msgpack'``, or ``'auto'`` to use msgpack if the
+        spec says the API takes it and msgpack is installed (see ``extrude.wire``).
+    :param compress_requests: Whether to compress large request bodies, if the spec
+        says the API takes compressed ones (see ``extrude.compression``), with the
+        first of its encodings available here.
+
+    The methods of the functions the spec flags as streaming (see
+    ``extrude.streaming``) return an iterator over the items of their output, which
+    arrive while the function is still running. Their ``is_stream`` attribute is True.
+    """
+
+    def __init__(
+        self,
+        openapi_spec: Mapping,
+        transport: Optional[Transport] = None,
+        *,
+        funcs: Iterable[Callable] = (),
+        wire_format: str = 'auto',
+        compress_requests: bool = True,
+    ):
+        self.openapi_spec = openapi_spec
+        if transport is None:
+            transport = Transport(openapi_spec['servers'][0]['url'])
+        if wire_format == 'auto':
+            use_msgpack = msgpack_available() and MSGPACK_CONTENT_TYPE in (
+                openapi_spec.get(WIRE_FORMATS_SPEC_KEY, ())
+            )
+            wire_format = 'msgpack' if use_msgpack else 'json'
+        if wire_format == 'msgpack':
+            transport.content_type = MSGPACK_CONTENT_TYPE
+        if compress_requests and transport.request_encoding is None:
+            encodings = openapi_spec.get(CONTENT_ENCODINGS_SPEC_KEY, ())
+            usable = [e for e in encodings if e in available_encodings()]
+            transport.request_encoding = usable[0] if usable else None
+        self.transport = transport
+        self._sigs = {}
+        local_funcs = {name_of_obj(func): func for func in funcs}
+        for path, path_spec in openapi_spec.get('paths', {}).items():
+            name = path.strip('/')
+            for http_method, operation_spec in path_spec.items():
+                method = self._mk_method(
+                    name, path, http_method, operation_spec, local_funcs.get(name)
+                )
+                setattr(self, name, method)
+
+    def _mk_method(self, name, path, http_method, operation_spec, local_func):
+        if local_func is not None:
+            sig = Sig(local_func)
+            is_idempotent = getattr(local_func, IDEMPOTENT_ATTR, False)
+        else:
+            sig = Sig(_signature_of_operation(operation_spec))
+            is_idempotent = name in IDEMPOTENT_ENDPOINTS
+        self._sigs[name] = sig
+        is_stream = operation_spec.get(STREAM_SPEC_KEY, False)
+
+        def method(*args, **kwargs):
+            kwargs = sig.kwargs_from_args_and_kwargs(args, kwargs)
+            if is_stream:
+                return self.transport.stream(path, kwargs)
+            return self.transport.call(
+                path, kwargs, http_method=http_method, idempotent=is_idempotent
+            )
+
+        method.__name__ = name
+        method.__doc__ = operation_spec.get('description')
+        method = sig(method)
+        method.is_stream = is_stream
+        return method
+
+    def mk_batch(self, concurrent: bool = False) -> CallBatch:
+        """Returns a CallBatch queuing calls of the functions of the API, to send them
+        in one request to its ``batch`` endpoint (see ``extrude.base.mk_api``).
+
+        ``with client.mk_batch() as batch: ...`` sends the calls when exiting the
+        block, after which their results are in ``batch.results``.
+        """
+        if not hasattr(self, BATCH_FUNC_NAME):
+            raise RuntimeError(f'The API has no "{BATCH_FUNC_NAME}" endpoint')
+
+        def kwargs_of_call(func_name, args, kwargs):
+            if func_name not in self._sigs:
+                raise AttributeError(f'The API has no function named "{func_name}"')
+            return self._sigs[func_name].kwargs_from_args_and_kwargs(args, kwargs)
+
+        return CallBatch(
+            getattr(self, BATCH_FUNC_NAME),
+            concurrent=concurrent,
+            kwargs_of_call=kwargs_of_call,
+        )
+
+
+class StoreKeysCache:
+    """A client side cache of what an API tells about its stores (see
+    ``get_many_store_keys`` in ``extrude.base.mk_api``).
+
+    Missing stores are fetched in a single call of ``fetch_many``. Entries older than
+    ``ttl`` seconds are still served, but are then refreshed in one background call (or
+    synchronously, if ``refresh_in_background`` is False).
+
+    >>> calls = []
+    >>> def fetch_many(store_names):
+    ...     calls.append(store_names)
+    ...     return {name: dict(count=1, keys=[f'{name}_key']) for name in store_names}
+    >>> cache = StoreKeysCache(fetch_many, ttl=60)
+    >>> cache.get_many(['a', 'b'])
+    {'a': {'count': 1, 'keys': ['a_key']}, 'b': {'count': 1, 'keys': ['b_key']}}
+    >>> _ = cache.get_many(['b', 'a'])
+    >>> _ = cache.get_many(['a', 'c'])
+    >>> calls
+    [['a', 'b'], ['c']]
+    """
+
+    def __init__(
+        self,
+        fetch_many: Callable[[list], dict],
+        ttl: float = DFLT_STORE_KEYS_TTL,
+        refresh_in_background: bool = True,
+    ):
+        self.fetch_many = fetch_many
+        self.ttl = ttl
+        self.refresh_in_background = refresh_in_background
+        self._entries = {}  # store name -> (fetch time, value)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def get_many(self, store_names: Iterable[str]) -> dict:
+        store_names = list(dict.fromkeys(store_names))
+        now = time.monotonic()
+        with self._lock:
+            missing = [name for name in store_names if name not in self._entries]
+            stale = [
+                name
+                for name in store_names
+                if name in self._entries
+                and now - self._entries[name][0] > self.ttl
+                and name not in self._refreshing
+            ]
+            self._refreshing.update(stale)
+        if missing:
+            self._fetch(missing)
+        if stale:
+            if self.refresh_in_background:
+                threading.Thread(target=self._fetch, args=(stale,), daemon=True).start()
+            else:
+                self._fetch(stale)
+        with self._lock:
+            return {name: self._entries[name][1] for name in store_names}
+
+    def get(self, store_name: str):
+        return self.get_many([store_name])[store_name]
+
+    def invalidate(self, store_names: Iterable[str] = None):
+        with self._lock:
+            if store_names is None:
+                self._entries.clear()
+            for name in store_names or ():
+                self._entries.pop(name, None)
+
+    def _fetch(self, store_names):
+        try:
+            values = self.fetch_many(store_names)
+            fetch_time = time.monotonic()
+            with self._lock:
+                for name in store_names:
+                    self._entries[name] = (fetch_time, values[name])
+        finally:
+            with self._lock:
+                self._refreshing.difference_update(store_names)
+
+
+_store_keys_caches = {}  # api url(s): {fetch options: StoreKeysCache}
+_client_store_keys_caches = weakref.WeakKeyDictionary()  # client: {...: ...}
+_store_keys_caches_lock = threading.Lock()
+
+
+def get_store_keys_cache(
+    api_key: Hashable,
+    fetch_many: Callable[[list], dict],
+    *,
+    fetch_options: Mapping = None,
+    **cache_kwargs,
+) -> StoreKeysCache:
+    """Returns the StoreKeysCache of the API identified by ``api_key``, creating it if
+    needed. Caches are kept at module level, so that they survive the reruns of a
+    streamlit app. ``fetch_many`` replaces the one the cache was made with.
+
+    ``api_key`` is the url (or list of urls) of the API, or else its client: the caches
+    of a client are then dropped along with it. ``fetch_options`` are the options
+    changing what ``fetch_many`` returns (``max_eager_store_keys``, say): each set of
+    options has its own cache.
+
+    >>> cache = get_store_keys_cache('http://api', dict, fetch_options={'max_keys': 1})
+    >>> cache is get_store_keys_cache('http://api', dict, fetch_options={'max_keys': 1})
+    True
+    >>> cache is get_store_keys_cache('http://api', dict, fetch_options={'max_keys': 2})
+    False
+    """
+    options_key = tuple(sorted((fetch_options or {}).items()))
+    with _store_keys_caches_lock:
+        if isinstance(api_key, (str, tuple)):
+            caches = _store_keys_caches.setdefault(api_key, {})
+        else:
+            caches = _client_store_keys_caches.setdefault(api_key, {})
+        cache = caches.get(options_key)
+        if cache is None:
+            cache = caches[options_key] = StoreKeysCache(fetch_many, **cache_kwargs)
+            return cache
+    cache.fetch_many = fetch_many
+    for attr, value in cache_kwargs.items():
+        setattr(cache, attr, value)
+    return cache
+
+
+class OpenApiSpecCache:
+    """An in-process and on-disk cache of the OpenAPI specs of extrude APIs, keyed by
+    url.
+
+    A cached spec is checked against the ``openapi_fingerprint`` endpoint of the API
+    (see ``extrude.base.mk_api``) before being used, which is cheaper than downloading
+    it again, and is only downloaded again when the fingerprint changed. Specs checked
+    less than ``revalidate_after`` seconds ago are used without any request.
+
+    :param cache_dir: The directory of the on-disk cache. None to only cache in process.
+    :param revalidate_after: See above.
+    :param timeout: The timeout of the requests made to the API, in seconds.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = os.path.join(DFLT_CACHE_DIR, 'openapi'),
+        revalidate_after: float = DFLT_SPEC_REVALIDATE_AFTER,
+        timeout: float = 10,
+    ):
+        self.cache_dir = cache_dir
+        self.revalidate_after = revalidate_after
+        self.timeout = timeout
+        self.session = requests.Session()
+        self._entries = {}  # url -> dict(fingerprint, spec, checked_at)
+        self._lock = threading.Lock()
+
+    def get(self, api_url: str) -> dict:
+        """Returns the spec of the API at ``api_url``."""
+        return self.get_entry(api_url)['spec']
+
+    def get_entry(self, api_url: str) -> dict:
+        """Returns the ``dict(fingerprint=..., spec=..., checked_at=...)`` cache entry
+        of the API at ``api_url``, after validating it if needed."""
+        with self._lock:
+            entry = self._entries.get(api_url)
+        now = time.monotonic()
+        if entry is not None and now - entry['checked_at'] < self.revalidate_after:
+            return entry
+        fingerprint = self.fetch_fingerprint(api_url)
+
+        def is_valid(entry):
+            return entry is not None and entry['fingerprint'] == fingerprint
+
+        if fingerprint is None or not is_valid(entry):
+            entry = self._read_from_disk(api_url)
+        if fingerprint is None or not is_valid(entry):
+            entry = dict(fingerprint=fingerprint, spec=self.fetch_spec(api_url))
+            self._write_to_disk(api_url, entry)
+        entry = dict(entry, checked_at=now)
+        with self._lock:
+            self._entries[api_url] = entry
+        return entry
+
+    def fetch_fingerprint(self, api_url: str):
+        """The fingerprint published by the API, or None if it publishes none."""
+        try:
+            response = self.session.post(
+                urljoin(api_url, 'openapi_fingerprint'), json={}, timeout=self.timeout
+            )
+        except requests.RequestException:
+            return None
+        if not response.ok:
+            return None
+        return response.json()
+
+    def fetch_spec(self, api_url: str) -> dict:
+        response = self.session.get(urljoin(api_url, 'openapi'), timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def _filepath(self, api_url):
+        filename = hashlib.sha256(api_url.encode()).hexdigest() + '.json'
+        return os.path.join(self.cache_dir, filename)
+
+    def _read_from_disk(self, api_url):
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self._filepath(api_url)) as fp:
+                entry = json.load(fp)
+        except (OSError, ValueError):
+            return None
+        if entry.get('url') != api_url:
+            return None
+        return dict(fingerprint=entry['fingerprint'], spec=entry['spec'])
+
+    def _write_to_disk(self, api_url, entry):
+        if self.cache_dir is None or entry['fingerprint'] is None:
+            return
+        filepath = self._filepath(api_url)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_filepath = f'{filepath}.{os.getpid()}.tmp'
+            with open(tmp_filepath, 'w') as fp:
+                json.dump(dict(entry, url=api_url), fp)
+            os.replace(tmp_filepath, filepath)
+        except OSError:
+            pass  # the on-disk cache is an optimization, not a requirement
+
+
+openapi_spec_cache = OpenApiSpecCache()
+_api_clients = {}  # (api urls, funcs, transport kwargs): (fingerprint, client)
+_api_clients_lock = threading.Lock()
+
+
+def _get_spec_entry(spec_cache: OpenApiSpecCache, api_urls: Sequence[str]):
+    """The spec cache entry of the first of the replicas ``api_urls`` that responds."""
+    for i, api_url in enumerate(api_urls):
+        try:
+            return spec_cache.get_entry(api_url)
+        except requests.RequestException:
+            if i == len(api_urls) - 1:
+                raise
+
+
+def get_api_client(
+    api_url: Union[str, Sequence[str]],
+    funcs: Iterable[Callable] = (),
+    *,
+    spec_cache: OpenApiSpecCache = None,
+    **transport_kwargs,
+) -> ApiClient:
+    """Returns an ApiClient for the API at ``api_url``, made from the spec given by
+    ``spec_cache``. Clients are kept at module level, one per ``api_url``, ``funcs``
+    and ``transport_kwargs``, and reused (along with their connections) as long as the
+    spec doesn't change. When it does, the client is replaced, and the connections of
+    the old one are closed.
+
+    :param api_url: The base url of the API, or the list of the base urls of its
+        replicas, across which calls are then spread (see ``BalancedTransport``). The
+        spec is only fetched from one of them.
+    :param funcs: See ApiClient.
+    :param spec_cache: (Optional) Defaults to the module level ``openapi_spec_cache``.
+    :param transport_kwargs: Arguments of the Transport of the client (``pool_size``,
+        ``timeout``...).
+    """
+    funcs = list(funcs)
+    api_urls = [api_url] if isinstance(api_url, str) else list(api_url)
+    entry = _get_spec_entry(spec_cache or openapi_spec_cache, api_urls)
+    fingerprint = entry['fingerprint']
+    key = (
+        tuple(api_urls),
+        tuple((name_of_obj(f), getattr(f, IDEMPOTENT_ATTR, False)) for f in funcs),
+        tuple(sorted(transport_kwargs.items())),
+    )
+    if fingerprint is not None:
+        with _api_clients_lock:
+            cached_fingerprint, client = _api_clients.get(key, (None, None))
+        if client is not None and cached_fingerprint == fingerprint:
+            return client
+    if len(api_urls) == 1:
+        transport = Transport(api_urls[0], **transport_kwargs)
+    else:
+        transport = BalancedTransport(api_urls, **transport_kwargs)
+    client = ApiClient(entry['spec'], transport, funcs=funcs)
+    if fingerprint is not None:
+        with _api_clients_lock:
+            cached_fingerprint, stale_client = _api_clients.get(key, (None, None))
+            if cached_fingerprint == fingerprint:  # made meanwhile by another thread
+                client, stale_client = stale_client, client
+            else:
+                _api_clients[key] = (fingerprint, client)
+        if stale_client is not None:
+            stale_client.transport.close()
+    return client
@@ -0,0 +1,234 @@
+"""Compression of the bodies of the requests and responses of extrude APIs.
+
+Responses are compressed when the client accepts it (``Accept-Encoding``) and they are
+large enough for compression to pay for its cost. Requests can be compressed too: the
+OpenAPI spec then tells clients which encodings the API takes (see
+``extrude.client.ApiClient``). ``gzip`` is always available, and ``zstd`` (faster, and
+compressing better) if ``zstandard`` is installed.
+"""
+
+import gzip
+import io
+import zlib
+from typing import Iterable, Mapping, Optional
+
+from extrude.middleware import json_response, read_body
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+GZIP, ZSTD = 'gzip', 'zstd'
+CONTENT_ENCODINGS_SPEC_KEY = 'x-extrude-content-encodings'
+DFLT_MIN_SIZE = 1024
+DFLT_LEVELS = {GZIP: 5, ZSTD: 3}
+DFLT_MAX_REQUEST_SIZE = 1024 ** 3
+_DECOMPRESSION_ERRORS = (zlib.error, EOFError) + (
+    (zstandard.ZstdError,) if zstandard is not None else ()
+)
+COMPRESSIBLE_CONTENT_TYPES = (
+    'application/json',
+    'application/x-msgpack',
+    'text/',
+)
+
+
+class DecompressionError(ValueError):
+    """Raised when a body can't be decompressed."""
+
+
+def available_encodings() -> list:
+    """The encodings that can be used, the preferred ones first."""
+    return ([ZSTD] if zstandard is not None else []) + [GZIP]
+
+
+def compress(data: bytes, encoding: str = GZIP, level: Optional[int] = None) -> bytes:
+    """Compresses ``data`` with ``encoding``, at ``level`` (defaults to one trading a
+    little compression for speed).
+
+    >>> data = b'{"keys": ["a", "b"]}' * 100
+    >>> len(compress(data)) < len(data)
+    True
+    >>> decompress(compress(data)) == data
+    True
+    """
+    level = DFLT_LEVELS[encoding] if level is None else level
+    if encoding == GZIP:
+        return gzip.compress(data, compresslevel=level, mtime=0)
+    if encoding == ZSTD and zstandard is not None:
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    raise ValueError(f'Unsupported encoding: {encoding}')
+
+
+def decompress(data: bytes, encoding: str = GZIP, max_size: Optional[int] = None):
+    """Decompresses ``data``, refusing to make more than ``max_size`` bytes (if given)
+    of it, so that small bodies can't take up all the memory.
+
+    >>> decompress(compress(b'x' * 1000), max_size=100)
+    Traceback (most recent call last):
+      ...
+    extrude.compression.DecompressionError: The decompressed body exceeds 100 bytes
+    """
+    read_size = -1 if max_size is None else max_size + 1
+    try:
+        if encoding == GZIP:
+            decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+            output = decompressor.decompress(data, max(read_size, 0))
+        elif encoding == ZSTD and zstandard is not None:
+            reader = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data))
+            output = reader.read(read_size)
+        else:
+            raise DecompressionError(f'Unsupported encoding: {encoding}')
+    except _DECOMPRESSION_ERRORS as error:
+        raise DecompressionError(f'Invalid {encoding} body: {error}')
+    if max_size is not None and len(output) > max_size:
+        raise DecompressionError(f'The decompressed body exceeds {max_size} bytes')
+    return output
+
+
+def negotiate_encoding(accept_encoding: str, encodings: Iterable[str]):
+    """The first of ``encodings`` that an ``Accept-Encoding`` header accepts, if any.
+
+    >>> negotiate_encoding('gzip, deflate, zstd', ['zstd', 'gzip'])
+    'zstd'
+    >>> negotiate_encoding('gzip;q=1.0, zstd;q=0', ['zstd', 'gzip'])
+    'gzip'
+    >>> negotiate_encoding('identity', ['gzip']) is None
+    True
+    """
+    accepted = {}
+    for item in (accept_encoding or '').split(','):
+        name, *params = [part.strip() for part in item.split(';')]
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[name.lower()] = q
+    for encoding in encodings:
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+def _is_compressible(headers: Mapping, min_size: int) -> bool:
+    content_type = headers.get('content-type', '')
+    return (
+        'content-encoding' not in headers
+        and int(headers.get('content-length') or 0) >= min_size
+        and content_type.startswith(COMPRESSIBLE_CONTENT_TYPES)
+    )
+
+
+def mk_compression_middleware(
+    min_size: int = DFLT_MIN_SIZE,
+    encodings: Optional[Iterable[str]] = None,
+    levels: Optional[Mapping[str, int]] = None,
+    *,
+    decompress_requests: bool = True,
+    max_request_size: int = DFLT_MAX_REQUEST_SIZE,
+):
+    """Returns a middleware compressing the responses of at least ``min_size`` bytes
+    with the first of ``encodings`` (defaults to ``available_encodings()``) the client
+    accepts, and decompressing the bodies of the requests that have a
+    ``Content-Encoding`` (if ``decompress_requests``), up to ``max_request_size``
+    bytes. Only responses with a ``Content-Length`` are compressed: streamed ones are
+    sent as is.
+
+    >>> def app(environ, start_response):
+    ...     body = read_body(environ) * 200
+    ...     start_response('200 OK', [('Content-Type', 'application/json'),
+    ...                               ('Content-Length', str(len(body)))])
+    ...     return [body]
+    >>> compressing_app = mk_compression_middleware(encodings=['gzip'])(app)
+    >>> request_body = compress(b'"hello"')
+    >>> environ = {'HTTP_ACCEPT_ENCODING': 'gzip', 'HTTP_CONTENT_ENCODING': 'gzip',
+    ...            'CONTENT_LENGTH': str(len(request_body)),
+    ...            'wsgi.input': io.BytesIO(request_body)}
+    >>> [body] = compressing_app(environ, lambda status, headers: print(headers[1:3]))
+    [('Content-Encoding', 'gzip'), ('Vary', 'Accept-Encoding')]
+    >>> decompress(body) == b'"hello"' * 200
+    True
+    """
+    encodings = list(available_encodings() if encodings is None else encodings)
+    levels = dict(DFLT_LEVELS, **(levels or {}))
+
+    def decompress_request(environ):
+        encoding = environ.pop('HTTP_CONTENT_ENCODING').strip().lower()
+        if encoding == 'identity':
+            return
+        body = decompress(read_body(environ), encoding, max_request_size)
+        environ['wsgi.input'] = io.BytesIO(body)
+        environ['CONTENT_LENGTH'] = str(len(body))
+
+    def middleware(wsgi):
+        def compressing_wsgi(environ, start_response):
+            if decompress_requests and environ.get('HTTP_CONTENT_ENCODING'):
+                try:
+                    decompress_request(environ)
+                except DecompressionError as error:
+                    return json_response(
+                        start_response,
+                        dict(error=str(error)),
+                        status='415 Unsupported Media Type',
+                    )
+            encoding = negotiate_encoding(
+                environ.get('HTTP_ACCEPT_ENCODING', ''), encodings
+            )
+            if encoding is None:
+                return wsgi(environ, start_response)
+            deferred = {}
+
+            def deferring_start_response(status, headers, *args):
+                # Responses to compress are only started once compressed
+                if 'body' not in deferred and _is_compressible(
+                    {k.lower(): v for k, v in headers}, min_size
+                ):
+                    deferred.update(status=status, headers=headers)
+                    return deferred.setdefault('written', []).append
+                headers = list(headers) + [('Vary', 'Accept-Encoding')]
+                return start_response(status, headers, *args)
+
+            body = wsgi(environ, deferring_start_response)
+            deferred['body'] = body  # responses started from here on are sent as is
+            if 'status' not in deferred:
+                return body
+            try:
+                data = b''.join(deferred['written'] + list(body))
+            finally:
+                if hasattr(body, 'close'):
+                    body.close()
+            compressed = compress(data, encoding, levels.get(encoding))
+            headers = [
+                (k, v) for k, v in deferred['headers'] if k.lower() != 'content-length'
+            ]
+            if len(compressed) < len(data):
+                data = compressed
+                headers.append(('Content-Encoding', encoding))
+            headers += [('Vary', 'Accept-Encoding'), ('Content-Length', str(len(data)))]
+            start_response(deferred['status'], headers)
+            return [data]
+
+        return compressing_wsgi
+
+    return middleware
+
+
+def mk_content_encodings_spec_patch(encodings: Optional[Iterable[str]] = None):
+    """Returns an OpenAPI spec patch (see ``extrude.middleware.
+    mk_openapi_patch_middleware``) telling which encodings the request bodies can be
+    compressed with.
+
+    >>> mk_content_encodings_spec_patch(['gzip'])({})
+    {'x-extrude-content-encodings': ['gzip']}
+    """
+    encodings = list(available_encodings() if encodings is None else encodings)
+
+    def advertise_content_encodings(spec: dict) -> dict:
+        return dict(spec, **{CONTENT_ENCODINGS_SPEC_KEY: encodings})
+
+    return advertise_content_encodings
@@ -0,0 +1,366 @@
+"""Serving ``meshed.DAG`` pipelines through extrude.
+
+Incremental execution: ``IncrementalDag`` keeps the outputs of the func nodes of a DAG,
+per session or per inputs, so that a call only reruns the nodes downstream of the inputs
+that changed. ``mk_incremental_dag_func`` makes the function exposing it.
+
+Distributed execution: ``mk_sub_dag_funcs`` makes the functions exposing the sub-DAGs of
+a DAG (see ``extrude.util.split_dag``) as services, and ``run_distributed_dag``
+orchestrates them. The intermediate values stay in the stores of the services: stages
+only pass each other references to them.
+"""
+
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from inspect import Parameter, signature
+from typing import Callable, Hashable, Mapping, MutableMapping, Optional
+
+import requests
+from meshed import DAG
+
+from extrude.memo import LruCache
+from extrude.util import SubDagSpec, split_dag, stable_hash
+
+FETCH_INTERMEDIATE = 'fetch_intermediate'
+DELETE_INTERMEDIATES = 'delete_intermediates'
+DFLT_NODE_CACHE_SIZE = 1024
+
+_missing = object()
+
+
+def dag_inputs(dag: DAG) -> set:
+    """The names of the variables the func nodes of ``dag`` need but don't produce."""
+    produced = {fn.out for fn in dag.func_nodes}
+    return {var for fn in dag.func_nodes for var in fn.bind.values()} - produced
+
+
+def dag_outputs(dag: DAG) -> set:
+    """The names of the variables produced by the func nodes of ``dag``."""
+    return {fn.out for fn in dag.func_nodes}
+
+
+def dag_final_outputs(dag: DAG) -> set:
+    """The names of the variables produced, but not consumed, by the func nodes of
+    ``dag``."""
+    consumed = {var for fn in dag.func_nodes for var in fn.bind.values()}
+    return dag_outputs(dag) - consumed
+
+
+def call_func_node(func_node, scope: MutableMapping):
+    """Calls a func node on the variables of ``scope`` it is bound to, and writes its
+    output in ``scope``."""
+    kwargs = {
+        param: scope[var] for param, var in func_node.bind.items() if var in scope
+    }
+    scope[func_node.out] = func_node.func(**kwargs)
+    return scope[func_node.out]
+
+
+def named_sub_dags(dag: DAG, sub_dag_spec: SubDagSpec) -> dict:
+    return dict(zip(sub_dag_spec, split_dag(dag, sub_dag_spec)))
+
+
+def mk_sub_dag_funcs(
+    dag: DAG,
+    sub_dag_spec: SubDagSpec,
+    store: Optional[MutableMapping] = None,
+    *,
+    public_url: Optional[str] = None,
+    timeout: float = 60,
+) -> list:
+    """Makes the functions to expose (with ``mk_api``) to run the sub-DAGs of ``dag``
+    as services.
+
+    Each sub-DAG becomes a function named after its key in ``sub_dag_spec``, taking a
+    ``run_id``, the ``values`` of its inputs and/or ``refs`` to them. It writes all the
+    variables it computes in ``store`` and returns references to them (``{var: {'key':
+    ..., 'url': public_url}}``), which can be given to the next stages. The values of
+    references to other services are fetched by this service, through their
+    ``fetch_intermediate`` endpoint, unless ``store`` is shared with them.
+
+    Also makes ``fetch_intermediate``, returning a stored value, and
+    ``delete_intermediates``, deleting the values stored for a run.
+
+    :param dag: The DAG.
+    :param sub_dag_spec: How to split the DAG (see ``extrude.util.split_dag``).
+    :param store: (Optional) Where the intermediate values are kept. Defaults to a dict.
+    :param public_url: (Optional) The url other services can reach this one at, if
+        they don't share ``store``.
+    :param timeout: The timeout of the requests fetching values from other services.
+    """
+    store = {} if store is None else store
+
+    def resolve_ref(ref: Mapping):
+        if ref['key'] in store:
+            return store[ref['key']]
+        if not ref.get('url') or ref['url'] == public_url:
+            raise KeyError(f'No intermediate value stored under "{ref["key"]}"')
+        response = requests.post(
+            f"{ref['url'].rstrip('/')}/{FETCH_INTERMEDIATE}",
+            json=dict(key=ref['key']),
+            timeout=timeout,
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def mk_stage_func(name, sub_dag):
+        outputs = dag_outputs(sub_dag)
+
+        def stage(run_id: str, refs: dict = None, values: dict = None):
+            scope = dict(values or {})
+            for var, ref in (refs or {}).items():
+                scope[var] = resolve_ref(ref)
+            for func_node in sub_dag.func_nodes:
+                call_func_node(func_node, scope)
+            produced_refs = {}
+            for var in outputs:
+                key = f'{run_id}/{var}'
+                store[key] = scope[var]
+                produced_refs[var] = dict(key=key, url=public_url)
+            return produced_refs
+
+        stage.__name__ = stage.__qualname__ = name
+        stage.__doc__ = f'Runs the "{name}" stage of a distributed DAG.'
+        return stage
+
+    def fetch_intermediate(key: str):
+        """Returns the intermediate value stored under ``key``."""
+        return store[key]
+
+    def delete_intermediates(run_id: str):
+        """Deletes the intermediate values stored for the run ``run_id``."""
+        keys = [key for key in list(store) if key.startswith(f'{run_id}/')]
+        for key in keys:
+            del store[key]
+        return len(keys)
+
+    stage_funcs = [
+        mk_stage_func(name, sub_dag)
+        for name, sub_dag in named_sub_dags(dag, sub_dag_spec).items()
+    ]
+    return stage_funcs + [fetch_intermediate, delete_intermediates]
+
+
+def sub_dag_dependencies(sub_dags: Mapping[str, DAG]) -> dict:
+    """Maps the name of each sub-DAG to the names of the sub-DAGs producing its inputs.
+    """
+    producers = {
+        var: name for name, sub_dag in sub_dags.items() for var in dag_outputs(sub_dag)
+    }
+    return {
+        name: {producers[var] for var in dag_inputs(sub_dag) if var in producers}
+        for name, sub_dag in sub_dags.items()
+    }
+
+
+def run_distributed_dag(
+    dag: DAG,
+    sub_dag_spec: SubDagSpec,
+    clients,
+    outputs=None,
+    *,
+    max_workers: Optional[int] = None,
+    cleanup: bool = True,
+    **inputs,
+):
+    """Runs ``dag`` on ``inputs`` through the services exposing its sub-DAGs (see
+    ``mk_sub_dag_funcs``). Stages run as soon as the stages they depend on are done, so
+    independent stages run in parallel. Only references to the intermediate values
+    transit through here: values are only fetched for the requested ``outputs``.
+
+    :param dag: The DAG.
+    :param sub_dag_spec: How to split the DAG, as given to ``mk_sub_dag_funcs``.
+    :param clients: The client (see ``extrude.client.ApiClient``) of each stage, as a
+        ``{stage_name: client}`` mapping, or a single client serving all stages.
+    :param outputs: (Optional) The names of the variables to return. Defaults to the
+        variables no func node consumes.
+    :param max_workers: (Optional) The maximum number of stages running at once.
+    :param cleanup: Whether to delete the intermediate values once done.
+    :param inputs: The values of the inputs of the DAG.
+    :return: A ``{var: value}`` dict of the ``outputs``.
+    """
+    sub_dags = named_sub_dags(dag, sub_dag_spec)
+    if not isinstance(clients, Mapping):
+        clients = dict.fromkeys(sub_dags, clients)
+    if outputs is None:
+        outputs = dag_final_outputs(dag)
+    run_id = uuid.uuid4().hex
+    pending = sub_dag_dependencies(sub_dags)
+    refs, producers, done = {}, {}, set()
+
+    def run_stage(name):
+        stage_inputs = dag_inputs(sub_dags[name])
+        stage = getattr(clients[name], name)
+        return stage(
+            run_id=run_id,
+            refs={var: refs[var] for var in stage_inputs if var in refs},
+            values={var: inputs[var] for var in stage_inputs if var in inputs},
+        )
+
+    try:
+        with ThreadPoolExecutor(max_workers) as executor:
+            running = {}
+
+            def submit_ready_stages():
+                for name, dependencies in list(pending.items()):
+                    if dependencies <= done:
+                        running[executor.submit(run_stage, name)] = name
+                        del pending[name]
+
+            submit_ready_stages()
+            while running:
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    stage_refs = future.result()
+                    refs.update(stage_refs)
+                    producers.update(dict.fromkeys(stage_refs, name))
+                    done.add(name)
+                submit_ready_stages()
+        if pending:
+            raise ValueError(f'Circular dependencies between stages: {set(pending)}')
+        return {
+            var: getattr(clients[producers[var]], FETCH_INTERMEDIATE)(
+                key=refs[var]['key']
+            )
+            for var in outputs
+        }
+    finally:
+        if cleanup:
+            for client in {id(c): c for c in clients.values()}.values():
+                try:
+                    getattr(client, DELETE_INTERMEDIATES)(run_id=run_id)
+                except Exception:
+                    pass  # best effort: the run's values may be deleted later
+
+
+class IncrementalDag:
+    """Runs ``dag``, reusing the outputs its func nodes computed in previous runs when
+    their inputs are the same: a run only recomputes the nodes downstream of the inputs
+    that changed.
+
+    The inputs of a node are identified by the stable hash (see
+    ``extrude.util.stable_hash``) of the DAG inputs they derive from, so outputs are
+    never hashed, and nodes are assumed to be deterministic.
+
+    :param dag: The DAG.
+    :param per_session: Whether outputs are kept per session, only the latest output
+        of each node being kept for a session, or shared by all the runs having the
+        same inputs (the default).
+    :param maxsize: The number of node outputs kept, the least recently used ones
+        being evicted first.
+
+    >>> from meshed import DAG
+    >>> def total(price, quantity):
+    ...     return price * quantity
+    >>> def with_tax(total, rate):
+    ...     return round(total * (1 + rate), 2)
+    >>> def label(quantity):
+    ...     return f'{quantity} items'
+    >>> incremental_dag = IncrementalDag(DAG([total, with_tax, label]))
+    >>> outputs, recomputed = incremental_dag.run(dict(price=10, quantity=3, rate=0.2))
+    >>> sorted(outputs.items()), recomputed
+    ([('label', '3 items'), ('with_tax', 36.0)], ['total', 'with_tax', 'label'])
+    >>> outputs, recomputed = incremental_dag.run(dict(price=10, quantity=3, rate=0.1))
+    >>> outputs['with_tax'], recomputed
+    (33.0, ['with_tax'])
+    """
+
+    def __init__(
+        self,
+        dag: DAG,
+        *,
+        per_session: bool = False,
+        maxsize: int = DFLT_NODE_CACHE_SIZE,
+    ):
+        self.dag = dag
+        self.per_session = per_session
+        self.cache = LruCache(maxsize)
+        self.outputs = sorted(dag_final_outputs(dag))
+        self.computed = 0
+        self.reused = 0
+
+    def _cache_key(self, session_id: Hashable, func_node, node_key: str):
+        if self.per_session:
+            return (session_id, func_node.name)
+        return node_key
+
+    def _cached(self, session_id, func_node, node_key):
+        entry = self.cache.get(self._cache_key(session_id, func_node, node_key))
+        if entry is None or entry[0] != node_key:
+            return _missing
+        return entry[1]
+
+    def run(self, inputs: Mapping, session_id: Hashable = None, outputs=None):
+        """Runs the DAG on ``inputs`` (defaults of the DAG applied), in the session
+        ``session_id`` if outputs are kept per session.
+
+        :return: The ``{var: value}`` dict of ``outputs`` (defaults to the variables no
+            func node consumes), and the list of the variables output by the recomputed
+            nodes.
+        """
+        bound = signature(self.dag).bind(**inputs)
+        bound.apply_defaults()
+        scope = dict(bound.arguments)
+        hashes = {var: stable_hash(value) for var, value in scope.items()}
+        recomputed = []
+        for func_node in self.dag.func_nodes:
+            node_key = stable_hash(
+                [
+                    func_node.name,
+                    {param: hashes.get(var) for param, var in func_node.bind.items()},
+                ]
+            )
+            value = self._cached(session_id, func_node, node_key)
+            if value is _missing:
+                value = call_func_node(func_node, scope)
+                self.cache.set(
+                    self._cache_key(session_id, func_node, node_key), (node_key, value)
+                )
+                recomputed.append(func_node.out)
+                self.computed += 1
+            else:
+                scope[func_node.out] = value
+                self.reused += 1
+            hashes[func_node.out] = node_key
+        outputs = self.outputs if outputs is None else outputs
+        return {var: scope[var] for var in outputs}, recomputed
+
+    def forget_session(self, session_id: Hashable):
+        """Drops the outputs kept for ``session_id``."""
+        for key in self.cache:
+            if isinstance(key, tuple) and key[0] == session_id:
+                self.cache.delete(key)
+
+
+def mk_incremental_dag_func(
+    dag: DAG, name: Optional[str] = None, **incremental_dag_kwargs
+) -> Callable:
+    """Makes the function exposing ``dag`` (with ``mk_api``) as an ``IncrementalDag``.
+    It takes the inputs of the DAG and an optional ``session_id``, and returns the
+    ``outputs`` of the DAG along with the variables of the nodes it ``recomputed``. The
+    IncrementalDag is its ``incremental_dag`` attribute.
+
+    :param dag: The DAG.
+    :param name: (Optional) The name of the function. Defaults to the name of the DAG.
+    :param incremental_dag_kwargs: The keyword arguments of ``IncrementalDag``.
+    """
+    incremental_dag = IncrementalDag(dag, **incremental_dag_kwargs)
+
+    def run_dag(session_id: str = None, **inputs):
+        outputs, recomputed = incremental_dag.run(inputs, session_id)
+        return dict(outputs=outputs, recomputed=recomputed)
+
+    sig = signature(dag)
+    params = [p.replace(kind=Parameter.KEYWORD_ONLY) for p in sig.parameters.values()]
+    session_param = Parameter(
+        'session_id', Parameter.KEYWORD_ONLY, default=None, annotation=str
+    )
+    run_dag.__signature__ = sig.replace(parameters=params + [session_param])
+    run_dag.__name__ = run_dag.__qualname__ = name or getattr(dag, '__name__', 'dag')
+    run_dag.__doc__ = (
+        f'Runs the {run_dag.__name__} DAG, only recomputing the nodes whose inputs '
+        'changed since the last run (in the session ``session_id``).'
+    )
+    run_dag.incremental_dag = incremental_dag
+    return run_dag
@@ -0,0 +1,180 @@
+"""Execution policies of the functions exposed by ``mk_api``: run them inline, in the
+request handling thread, or in a thread or process pool with a bounded queue.
+"""
+
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import wraps
+from typing import Callable, Optional
+
+import dill
+
+from extrude.admission import (
+    DFLT_RETRY_AFTER,
+    QUEUE_FULL,
+    SERVICE_UNAVAILABLE,
+    SHED_HEADER,
+)
+from extrude.batch import in_batch
+from extrude.metrics import EXECUTION, QUEUE, record_timing
+from extrude.middleware import set_response_header, set_response_status
+
+INLINE, THREAD, PROCESS = 'inline', 'thread', 'process'
+EXECUTION_MODES = (INLINE, THREAD, PROCESS)
+EXECUTION_POOL_ATTR = 'execution_pool'
+
+
+class QueueFullError(RuntimeError):
+    """Raised when a call is submitted to an ExecutionPool whose queue is full. When
+    handling a request, its response is then a ``503``, telling the client that the call
+    was not run and when to retry it (see ``extrude.admission``). Within a batch, only
+    the outcome of that call is an error."""
+
+
+def _call_dilled(payload: bytes) -> bytes:
+    func, args, kwargs = dill.loads(payload)
+    return dill.dumps(func(*args, **kwargs))
+
+
+def _timed_call(func: Callable, *args, **kwargs):
+    # Wall clock times, to compare them with the ones of the process submitting calls
+    started = time.time()
+    output = func(*args, **kwargs)
+    return started, time.time(), output
+
+
+class ExecutionPool:
+    """A thread or process pool accepting at most ``max_workers + max_queue`` calls at
+    a time: calls beyond that fail right away with a QueueFullError instead of piling
+    up. The executor is only made on the first call, so that process pools are made in
+    the process serving the requests (after a fork, say).
+
+    In process pools, functions and their arguments are pickled with ``dill``, so they
+    can be closures, lambdas or functions defined in ``__main__``.
+
+    >>> pool = ExecutionPool(THREAD, max_workers=2)
+    >>> pool.call(pow, 2, 10)
+    1024
+    """
+
+    def __init__(
+        self,
+        mode: str = THREAD,
+        max_workers: Optional[int] = None,
+        max_queue: Optional[int] = None,
+    ):
+        if mode not in (THREAD, PROCESS):
+            raise ValueError(f'Unknown pool mode: {mode}. Should be thread or process')
+        self.mode = mode
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = None
+        self._lock = threading.Lock()
+        self._slots = None
+        if max_queue is not None:
+            n_workers = max_workers or os.cpu_count() or 1
+            self._slots = threading.BoundedSemaphore(n_workers + max_queue)
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                if self.mode == PROCESS:
+                    self._executor = ProcessPoolExecutor(self.max_workers)
+                else:
+                    self._executor = ThreadPoolExecutor(
+                        self.max_workers, thread_name_prefix='extrude-exec'
+                    )
+            return self._executor
+
+    def submit(self, func: Callable, *args, **kwargs):
+        """Submits a call and returns its future (whose result, for process pools, is
+        the pickled output)."""
+        return self._submit(func, func, args, kwargs)
+
+    def _submit(self, func, target, args, kwargs):
+        if self._slots is not None and not self._slots.acquire(blocking=False):
+            if not in_batch():  # in a batch, only this call fails, not the request
+                set_response_status(SERVICE_UNAVAILABLE)
+                set_response_header('Retry-After', str(DFLT_RETRY_AFTER))
+                set_response_header(SHED_HEADER, QUEUE_FULL)
+            raise QueueFullError(
+                f'The {self.mode} pool of {getattr(func, "__name__", func)} is full'
+            )
+        try:
+            if self.mode == PROCESS:
+                payload = dill.dumps((target, args, kwargs))
+                future = self.executor.submit(_call_dilled, payload)
+            else:
+                context = contextvars.copy_context()
+                future = self.executor.submit(context.run, target, *args, **kwargs)
+        except BaseException:
+            if self._slots is not None:
+                self._slots.release()
+            raise
+        if self._slots is not None:
+            future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def call(self, func: Callable, *args, **kwargs):
+        """Runs ``func(*args, **kwargs)`` in the pool and waits for its output. The
+        time the call waited for a worker and ran is recorded for the metrics of the
+        API (see ``extrude.metrics.record_timing``)."""
+        submitted = time.time()
+        future = self._submit(func, _timed_call, (func,) + args, kwargs)
+        result = future.result()
+        if self.mode == PROCESS:
+            result = dill.loads(result)
+        started, ended, output = result
+        record_timing(QUEUE, max(started - submitted, 0))
+        record_timing(EXECUTION, ended - started)
+        return output
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
+
+
+def run_in_pool(
+    func: Callable = None,
+    *,
+    mode: str = THREAD,
+    max_workers: Optional[int] = None,
+    max_queue: Optional[int] = None,
+):
+    """Makes ``func`` run in its own ExecutionPool (see there for the parameters), or
+    returns it as is if ``mode`` is ``'inline'``. The pool is the ``execution_pool``
+    attribute of the returned function.
+
+    When stacked with ``extrude.memo.memoize``, memoize should be the outer decorator,
+    so that cached results don't go through the pool.
+
+    >>> @run_in_pool(mode='thread', max_workers=2, max_queue=4)
+    ... def foo(a, b=2):
+    ...     return a * b
+    >>> foo(3)
+    6
+    """
+    if func is None:
+        return lambda func: run_in_pool(
+            func, mode=mode, max_workers=max_workers, max_queue=max_queue
+        )
+    if mode not in EXECUTION_MODES:
+        raise ValueError(
+            f'Unknown execution mode: {mode}. Should be in {EXECUTION_MODES}'
+        )
+    if mode == INLINE:
+        return func
+    pool = ExecutionPool(mode, max_workers, max_queue)
+
+    @wraps(func)
+    def func_run_in_pool(*args, **kwargs):
+        return pool.call(func, *args, **kwargs)
+
+    setattr(func_run_in_pool, EXECUTION_POOL_ATTR, pool)
+    return func_run_in_pool
@@ -0,0 +1,405 @@
+"""Memoization of the (expensive, deterministic) functions exposed by ``mk_api``.
+
+Results are cached in memory (LRU) and, optionally, on disk, both tiers being bounded
+in size and, optionally, in age.
+
+Identical calls made at the same time can also be coalesced: only one of them computes
+the result, which the others wait for and share (see ``coalesce_calls``).
+"""
+
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from inspect import signature
+from typing import Callable, Optional
+
+from extrude.metrics import COALESCED, record_timing
+from extrude.middleware import set_response_header
+from extrude.util import stable_hash
+
+MEMO_CACHE_ATTR = 'memo_cache'
+SINGLE_FLIGHT_ATTR = 'single_flight'
+CACHE_STATUS_HEADER = 'X-Extrude-Cache'
+COALESCED_HEADER = 'X-Extrude-Coalesced'
+DFLT_MEMO_MAXSIZE = 128
+
+_missing = object()
+
+
+class LruCache:
+    """An in-memory cache keeping at most ``maxsize`` entries, evicting the least
+    recently used ones first, and entries older than ``ttl`` seconds (if given).
+
+    >>> cache = LruCache(maxsize=2)
+    >>> cache.set('a', 1); cache.set('b', 2)
+    >>> cache.get('a')
+    1
+    >>> cache.set('c', 3)  # evicts 'b', the least recently used
+    >>> cache.get('b', 'nothing')
+    'nothing'
+    >>> sorted(cache)
+    ['a', 'c']
+    """
+
+    def __init__(self, maxsize: int = DFLT_MEMO_MAXSIZE, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (time stored, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if self.ttl is not None and time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._entries))
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskCache:
+    """A cache pickling its values into the files of ``rootdir``. It is bounded to
+    ``max_bytes`` (if given) by deleting the least recently used files, and entries
+    older than ``ttl`` seconds (if given) are ignored and deleted.
+
+    >>> import tempfile
+    >>> cache = DiskCache(tempfile.mkdtemp())
+    >>> cache.set('a', [1, 2])
+    >>> cache.get('a')
+    [1, 2]
+    >>> cache.get('b', 'nothing')
+    'nothing'
+    """
+
+    def __init__(
+        self, rootdir: str, max_bytes: Optional[int] = None, ttl: Optional[float] = None
+    ):
+        self.rootdir = rootdir
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        os.makedirs(rootdir, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def _filepath(self, key):
+        return os.path.join(self.rootdir, f'{key}.pkl')
+
+    def get(self, key, default=None):
+        filepath = self._filepath(key)
+        try:
+            with open(filepath, 'rb') as fp:
+                stored_at, value = pickle.load(fp)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return default
+        if self.ttl is not None and time.time() - stored_at > self.ttl:
+            self.delete(key)
+            return default
+        try:
+            os.utime(filepath)  # the mtime of a file tells when it was last used
+        except OSError:
+            pass
+        return value
+
+    def set(self, key, value):
+        filepath = self._filepath(key)
+        tmp_filepath = f'{filepath}.{threading.get_ident()}.tmp'
+        with open(tmp_filepath, 'wb') as fp:
+            pickle.dump((time.time(), value), fp)
+        os.replace(tmp_filepath, filepath)
+        if self.max_bytes is not None:
+            self._evict()
+
+    def _evict(self):
+        with self._lock:
+            files = [
+                entry
+                for entry in os.scandir(self.rootdir)
+                if entry.is_file() and entry.name.endswith('.pkl')
+            ]
+            files.sort(key=lambda entry: entry.stat().st_mtime)
+            total_bytes = sum(entry.stat().st_size for entry in files)
+            for entry in files:
+                if total_bytes <= self.max_bytes:
+                    break
+                total_bytes -= entry.stat().st_size
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+    def delete(self, key):
+        try:
+            os.remove(self._filepath(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        for entry in os.scandir(self.rootdir):
+            if entry.name.endswith('.pkl'):
+                self.delete(entry.name[: -len('.pkl')])
+
+
+class MemoCache:
+    """The cache of a memoized function: an LruCache in front of an optional DiskCache.
+    Values found on disk are promoted to memory.
+
+    :param maxsize: The maximum number of results kept in memory.
+    :param ttl: (Optional) The number of seconds after which results expire.
+    :param cache_dir: (Optional) The directory of the disk tier. None for no disk tier.
+    :param max_disk_bytes: (Optional) The maximum size of the disk tier.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = DFLT_MEMO_MAXSIZE,
+        ttl: Optional[float] = None,
+        cache_dir: Optional[str] = None,
+        max_disk_bytes: Optional[int] = None,
+    ):
+        self.memory = LruCache(maxsize, ttl)
+        self.disk = None
+        if cache_dir is not None:
+            self.disk = DiskCache(cache_dir, max_disk_bytes, ttl)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        value = self.memory.get(key, _missing)
+        if value is _missing and self.disk is not None:
+            value = self.disk.get(key, _missing)
+            if value is not _missing:
+                self.memory.set(key, value)
+        if value is _missing:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    def invalidate(self, key=None):
+        """Deletes the entry of ``key``, or all entries if no key is given."""
+        for tier in filter(None, [self.memory, self.disk]):
+            if key is None:
+                tier.clear()
+            else:
+                tier.delete(key)
+
+
+def mk_call_key_func(func: Callable, version: Optional[str] = None) -> Callable:
+    """Returns a function giving the key of the arguments of a call of ``func``: a
+    stable hash of them, bound to the parameters of ``func``, with defaults applied. So
+    ``foo(3)`` and ``foo(a=3, b=2)`` have the same key if ``b`` defaults to ``2``.
+
+    The key also hashes the module and qualified name of ``func``, and ``version`` if
+    given, so that functions sharing a cache (on disk, say) don't share their keys, and
+    bumping the version of a function makes it ignore the results of the previous one.
+
+    >>> def foo(a, b=2):
+    ...     pass
+    >>> def bar(a, b=2):
+    ...     pass
+    >>> mk_call_key_func(foo)(3) == mk_call_key_func(foo)(a=3, b=2)
+    True
+    >>> mk_call_key_func(foo)(3) == mk_call_key_func(bar)(3)
+    False
+    >>> mk_call_key_func(foo)(3) == mk_call_key_func(foo, version='2')(3)
+    False
+    """
+    sig = signature(func)
+    func_id = dict(
+        module=getattr(func, '__module__', None),
+        qualname=getattr(func, '__qualname__', getattr(func, '__name__', None)),
+        version=version,
+    )
+
+    def call_key(*args, **kwargs):
+        bound = sig.bind(*args, **kwargs)
+        bound.apply_defaults()
+        return stable_hash(dict(func_id, arguments=dict(bound.arguments)))
+
+    return call_key
+
+
+def memoize(
+    func: Callable = None,
+    *,
+    maxsize: int = DFLT_MEMO_MAXSIZE,
+    ttl: Optional[float] = None,
+    cache_dir: Optional[str] = None,
+    max_disk_bytes: Optional[int] = None,
+    version: Optional[str] = None,
+):
+    """Memoizes ``func``, a deterministic function, keying its results on a stable hash
+    of its arguments (see ``extrude.util.stable_hash``), with defaults applied, and of
+    its name and ``version`` (see ``mk_call_key_func``): change the version when the
+    results of the function change, to ignore the ones cached on disk. When called
+    while handling a request, the ``X-Extrude-Cache`` header of the response tells
+    whether the result was a ``hit`` or a ``miss``.
+
+    The cache is the ``memo_cache`` attribute of the memoized function, and the key of
+    some arguments is given by its ``memo_key`` method. See MemoCache for the other
+    parameters.
+
+    >>> @memoize
+    ... def foo(a, b=2):
+    ...     print('computing...')
+    ...     return a * b
+    >>> foo(3)
+    computing...
+    6
+    >>> foo(a=3, b=2)
+    6
+    >>> foo.memo_cache.hits, foo.memo_cache.misses
+    (1, 1)
+    """
+    if func is None:
+        return lambda func: memoize(
+            func,
+            maxsize=maxsize,
+            ttl=ttl,
+            cache_dir=cache_dir,
+            max_disk_bytes=max_disk_bytes,
+            version=version,
+        )
+    cache = MemoCache(maxsize, ttl, cache_dir, max_disk_bytes)
+    memo_key = mk_call_key_func(func, version)
+
+    @wraps(func)
+    def memoized_func(*args, **kwargs):
+        key = memo_key(*args, **kwargs)
+        result = cache.get(key, _missing)
+        if result is not _missing:
+            set_response_header(CACHE_STATUS_HEADER, 'hit')
+            return result
+        set_response_header(CACHE_STATUS_HEADER, 'miss')
+        result = func(*args, **kwargs)
+        cache.set(key, result)
+        return result
+
+    setattr(memoized_func, MEMO_CACHE_ATTR, cache)
+    memoized_func.memo_key = memo_key
+    return memoized_func
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time: calls made with the key of a call in
+    flight wait for it and share its result (or its error) instead of computing it
+    again. ``calls`` counts the calls, and ``coalesced`` the ones that shared the result
+    of another.
+
+    >>> flights = SingleFlight()
+    >>> flights.run('key', pow, 2, 10)
+    (1024, False)
+    >>> flights.calls, flights.coalesced
+    (1, 0)
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def run(self, key, func: Callable, *args, **kwargs):
+        """Runs ``func(*args, **kwargs)``, unless a call with ``key`` is in flight.
+        Returns the result, and whether it was shared."""
+        with self._lock:
+            self.calls += 1
+            flight = self._flights.get(key)
+            is_leader = flight is None
+            if is_leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self.coalesced += 1
+        if not is_leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+        try:
+            flight.result = func(*args, **kwargs)
+            return flight.result, False
+        except BaseException as error:
+            flight.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+
+def coalesce_calls(func: Callable):
+    """Coalesces the identical calls of ``func`` made at the same time: the first one
+    computes the result, and the others wait for it and share it (see SingleFlight).
+    Calls are identical when their arguments have the same key (see
+    ``mk_call_key_func``). When called while handling a request, the
+    ``X-Extrude-Coalesced`` header of the response tells whether the result was shared,
+    and the instrumentation of ``mk_api`` counts the shared calls (the computations
+    saved) in the ``extrude_coalesced_calls_total`` metric.
+
+    The SingleFlight is the ``single_flight`` attribute of the returned function.
+
+    >>> import threading, time
+    >>> @coalesce_calls
+    ... def slow_square(x):
+    ...     time.sleep(0.2)
+    ...     return x * x
+    >>> threads = [threading.Thread(target=slow_square, args=(3,)) for _ in range(4)]
+    >>> for thread in threads:
+    ...     thread.start()
+    >>> for thread in threads:
+    ...     thread.join()
+    >>> slow_square.single_flight.coalesced
+    3
+    """
+    flights = SingleFlight()
+    call_key = mk_call_key_func(func)
+
+    @wraps(func)
+    def coalesced_func(*args, **kwargs):
+        started = time.perf_counter()
+        result, shared = flights.run(call_key(*args, **kwargs), func, *args, **kwargs)
+        if shared:
+            record_timing(COALESCED, time.perf_counter() - started)
+        set_response_header(COALESCED_HEADER, 'true' if shared else 'false')
+        return result
+
+    setattr(coalesced_func, SINGLE_FLIGHT_ATTR, flights)
+    return coalesced_func
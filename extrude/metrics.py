@@ -0,0 +1,368 @@
+"""Performance metrics of extrude APIs and of their clients, in the Prometheus text
+format.
+
+On the server side, ``mk_api`` counts the calls of each function and measures, per
+call:
+
+- the time spent waiting for a worker of its execution pool (``queue``),
+- the time spent running it (``exec``), or waiting for an identical call in flight to
+  share its result (``coalesced``, see ``extrude.memo.coalesce_calls``),
+- the rest of the handling of the request (``serialization``: parsing the request,
+  encoding the response, framework overhead),
+- the sizes of the request and response bodies.
+
+The metrics are served at ``/metrics``, and the queue and exec times of each call are
+also sent back in a ``Server-Timing`` header, which clients use to tell the time spent
+computing on the server from the time spent on the network (see
+``extrude.client.Transport``).
+"""
+
+import threading
+import time
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, Iterable, Optional
+
+from extrude.middleware import set_response_header
+
+QUEUE, EXECUTION, COALESCED = 'queue', 'exec', 'coalesced'
+METRICS_PATH = '/metrics'
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DFLT_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 30)
+DFLT_SIZE_BUCKETS = (100, 1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+
+
+def _labels_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels_key: tuple, **extra) -> str:
+    labels = list(labels_key) + list(extra.items())
+    if not labels:
+        return ''
+    inner = ','.join(
+        '{}="{}"'.format(k, str(v).replace('\\', r'\\').replace('"', r'\"'))
+        for k, v in labels
+    )
+    return '{' + inner + '}'
+
+
+def _format_value(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A counter, per set of labels.
+
+    >>> calls = Counter('calls_total', 'The number of calls.')
+    >>> calls.inc(func='foo')
+    >>> calls.inc(2, func='foo')
+    >>> calls.value(func='foo')
+    3
+    >>> print(calls.render())
+    # HELP calls_total The number of calls.
+    # TYPE calls_total counter
+    calls_total{func="foo"} 3
+    """
+
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str = ''):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _labels_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(_labels_key(labels), 0)
+
+    def _sample_lines(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in values.items():
+            yield f'{self.name}{_format_labels(key)} {_format_value(value)}'
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        return '\n'.join(lines + list(self._sample_lines()))
+
+
+class Histogram(Counter):
+    """A histogram of observed values, per set of labels.
+
+    >>> latency = Histogram('latency_seconds', 'Latency.', buckets=(0.1, 1))
+    >>> latency.observe(0.05, func='foo')
+    >>> latency.observe(0.5, func='foo')
+    >>> print(latency.render())
+    # HELP latency_seconds Latency.
+    # TYPE latency_seconds histogram
+    latency_seconds_bucket{func="foo",le="0.1"} 1
+    latency_seconds_bucket{func="foo",le="1"} 2
+    latency_seconds_bucket{func="foo",le="+Inf"} 2
+    latency_seconds_sum{func="foo"} 0.55
+    latency_seconds_count{func="foo"} 2
+    """
+
+    kind = 'histogram'
+
+    def __init__(
+        self, name: str, help: str = '', buckets: Iterable = DFLT_LATENCY_BUCKETS
+    ):
+        super().__init__(name, help)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = _labels_key(labels)
+        with self._lock:
+            if key not in self._values:
+                n_buckets = len(self.buckets)
+                self._values[key] = dict(buckets=[0] * n_buckets, sum=0, count=0)
+            stats = self._values[key]
+            for i, bound in enumerate(self.buckets):
+                stats['buckets'][i] += value <= bound
+            stats['sum'] += value
+            stats['count'] += 1
+
+    def value(self, **labels):
+        """The ``(count, sum)`` of the values observed with ``labels``."""
+        stats = self._values.get(_labels_key(labels), dict(count=0, sum=0))
+        return stats['count'], stats['sum']
+
+    def _sample_lines(self):
+        with self._lock:
+            values = {
+                key: dict(stats, buckets=list(stats['buckets']))
+                for key, stats in self._values.items()
+            }
+        for key, stats in values.items():
+            for count, bound in zip(stats['buckets'], self.buckets):
+                labels = _format_labels(key, le=_format_value(bound))
+                yield f'{self.name}_bucket{labels} {count}'
+            count, total = stats['count'], stats['sum']
+            yield f'{self.name}_bucket{_format_labels(key, le="+Inf")} {count}'
+            yield f'{self.name}_sum{_format_labels(key)} {round(total, 9)}'
+            yield f'{self.name}_count{_format_labels(key)} {count}'
+
+
+class MetricsRegistry:
+    """The metrics of a service (or client). Metrics are made on first use:
+    ``registry.counter(name)`` returns the same counter every time.
+
+    A registry is also the WSGI app serving its metrics in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, metric_type, name, *args, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = metric_type(name, *args, **kwargs)
+            return self._metrics[name]
+
+    def counter(self, name: str, help: str = '') -> Counter:
+        return self._get(Counter, name, help)
+
+    def histogram(
+        self, name: str, help: str = '', buckets: Iterable = DFLT_LATENCY_BUCKETS
+    ) -> Histogram:
+        return self._get(Histogram, name, help, buckets)
+
+    def __getitem__(self, name):
+        return self._metrics[name]
+
+    def __iter__(self):
+        return iter(list(self._metrics))
+
+    def render(self) -> str:
+        """The metrics, in the Prometheus text format."""
+        return ''.join(metric.render() + '\n' for metric in self._metrics.values())
+
+    def __call__(self, environ, start_response):
+        body = self.render().encode()
+        start_response(
+            '200 OK',
+            [
+                ('Content-Type', PROMETHEUS_CONTENT_TYPE),
+                ('Content-Length', str(len(body))),
+            ],
+        )
+        return [body]
+
+
+_call_timings = ContextVar('extrude_call_timings', default=None)
+_request_info = ContextVar('extrude_request_info', default=None)
+
+
+def record_timing(phase: str, seconds: float):
+    """Adds ``seconds`` to the time spent in ``phase`` (``'queue'`` or ``'exec'``) by
+    the call of the exposed function being handled, if it is instrumented (see
+    ``instrument``). Calls that waited for an identical call in flight record their
+    wait as ``'coalesced'``."""
+    timings = _call_timings.get()
+    if timings is not None:
+        timings[phase] = timings.get(phase, 0) + seconds
+
+
+def format_server_timing(timings: dict) -> str:
+    """Formats timings, in seconds, as the value of a ``Server-Timing`` header.
+
+    >>> format_server_timing({'queue': 0.0012, 'exec': 0.25})
+    'queue;dur=1.2, exec;dur=250.0'
+    """
+    return ', '.join(
+        f'{name};dur={round(seconds * 1000, 3)}' for name, seconds in timings.items()
+    )
+
+
+def parse_server_timing(header: Optional[str]) -> dict:
+    """Parses the value of a ``Server-Timing`` header into timings in seconds.
+
+    >>> parse_server_timing('queue;dur=1.2, exec;dur=250.0')
+    {'queue': 0.0012, 'exec': 0.25}
+    """
+    timings = {}
+    for metric in (header or '').split(','):
+        name, *params = [part.strip() for part in metric.split(';')]
+        for param in params:
+            key, _, value = param.partition('=')
+            if name and key == 'dur':
+                try:
+                    timings[name] = float(value) / 1000
+                except ValueError:
+                    pass
+    return timings
+
+
+def instrument(func: Callable, registry: MetricsRegistry, name: str):
+    """Wraps ``func`` to count its calls and errors in ``registry`` (labelled with
+    ``name``), and measure the time they spend queued in an execution pool and running
+    (see ``extrude.execution``). These times are also set in the ``Server-Timing``
+    header of the response, when handling a request. Calls that shared the result of an
+    identical call in flight (see ``extrude.memo.coalesce_calls``) are counted as
+    ``extrude_coalesced_calls_total``: the computations saved.
+
+    >>> registry = MetricsRegistry()
+    >>> foo = instrument(lambda x: x + 1, registry, 'foo')
+    >>> foo(1)
+    2
+    >>> registry['extrude_calls_total'].value(func='foo')
+    1
+    >>> registry['extrude_exec_seconds'].value(func='foo')[0]
+    1
+    """
+    calls = registry.counter('extrude_calls_total', 'Calls of the function.')
+    errors = registry.counter(
+        'extrude_errors_total', 'Calls of the function that raised an error.'
+    )
+    queue_seconds = registry.histogram(
+        'extrude_queue_seconds', 'Time spent waiting for a worker of the pool.'
+    )
+    exec_seconds = registry.histogram(
+        'extrude_exec_seconds', 'Time spent running the function.'
+    )
+    coalesced_calls = registry.counter(
+        'extrude_coalesced_calls_total',
+        'Calls that shared the result of an identical call in flight.',
+    )
+
+    @wraps(func)
+    def instrumented_func(*args, **kwargs):
+        timings = {}
+        token = _call_timings.set(timings)
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            errors.inc(func=name)
+            raise
+        finally:
+            total = time.perf_counter() - started
+            _call_timings.reset(token)
+            waited = timings.get(QUEUE, 0) + timings.get(COALESCED, 0)
+            timings.setdefault(EXECUTION, total - waited)
+            calls.inc(func=name)
+            if COALESCED in timings:
+                coalesced_calls.inc(func=name)
+            queue_seconds.observe(timings.get(QUEUE, 0), func=name)
+            exec_seconds.observe(timings[EXECUTION], func=name)
+            request_info = _request_info.get()
+            if request_info is not None:
+                request_info['func_seconds'] = total
+            set_response_header(
+                'Server-Timing', format_server_timing({QUEUE: 0, **timings})
+            )
+
+    return instrumented_func
+
+
+def mk_metrics_middleware(registry: MetricsRegistry, func_names: Iterable[str]):
+    """Returns a middleware measuring, for the requests calling ``func_names`` (served
+    at ``/name``), the time spent handling them, the part of it not spent in the
+    (instrumented) function (``serialization``), the sizes of the request and response
+    bodies, and the status of the responses."""
+    func_names = set(func_names)
+    request_seconds = registry.histogram(
+        'extrude_request_seconds', 'Time spent handling the request.'
+    )
+    serialization_seconds = registry.histogram(
+        'extrude_serialization_seconds',
+        'Time spent handling the request outside of the function: parsing the '
+        'request, encoding the response, framework overhead.',
+    )
+    request_bytes = registry.histogram(
+        'extrude_request_bytes', 'Size of the request body.', DFLT_SIZE_BUCKETS
+    )
+    response_bytes = registry.histogram(
+        'extrude_response_bytes', 'Size of the response body.', DFLT_SIZE_BUCKETS
+    )
+    responses = registry.counter('extrude_responses_total', 'Responses, per status.')
+
+    def middleware(wsgi):
+        def metrics_wsgi(environ, start_response):
+            func_name = environ.get('PATH_INFO', '').strip('/')
+            if func_name not in func_names:
+                return wsgi(environ, start_response)
+            started = time.perf_counter()
+            request_info = {}
+
+            def start_response_with_status(status, headers, *args):
+                responses.inc(func=func_name, status=status.split(' ', 1)[0])
+                return start_response(status, headers, *args)
+
+            token = _request_info.set(request_info)
+            try:
+                body = wsgi(environ, start_response_with_status)
+            finally:
+                _request_info.reset(token)
+            request_size = int(environ.get('CONTENT_LENGTH') or 0)
+            request_bytes.observe(request_size, func=func_name)
+
+            def measured_body():
+                size = 0
+                try:
+                    for chunk in body:
+                        size += len(chunk)
+                        yield chunk
+                finally:
+                    if hasattr(body, 'close'):
+                        body.close()
+                    total = time.perf_counter() - started
+                    request_seconds.observe(total, func=func_name)
+                    if 'func_seconds' in request_info:  # not for streamed outputs
+                        serialization_seconds.observe(
+                            total - request_info['func_seconds'], func=func_name
+                        )
+                    response_bytes.observe(size, func=func_name)
+
+            return measured_body()
+
+        return metrics_wsgi
+
+    return middleware
@@ -0,0 +1,203 @@
+"""WSGI middleware to extend the web services made by py2http.
+
+py2http apps are WSGI apps (bottle, or flask), so routes and behaviors that don't fit
+the "one function per route, json in, json out" model of py2http can be added around
+them.
+"""
+
+import json
+from contextvars import ContextVar
+from typing import Callable, Iterable, Mapping
+from urllib.parse import parse_qsl
+
+JSON_LINES_CONTENT_TYPE = 'application/x-ndjson'
+
+
+def install_middleware(app, *middlewares: Callable):
+    """Wraps the WSGI callable of a py2http ``app`` with ``middlewares``, in place.
+    The first middleware is the outermost one. Returns the app, which can still be
+    served with ``run_api``.
+
+    :param app: A bottle (``app.wsgi``) or flask (``app.wsgi_app``) application.
+    :param middlewares: Functions taking a WSGI callable and returning a WSGI callable.
+    """
+    for attr in ('wsgi_app', 'wsgi'):
+        if callable(getattr(app, attr, None)):
+            break
+    else:
+        raise TypeError(f'Can not install a WSGI middleware on {type(app)} objects')
+    wsgi = getattr(app, attr)
+    for middleware in reversed(middlewares):
+        wsgi = middleware(wsgi)
+    setattr(app, attr, wsgi)
+    return app
+
+
+def mk_routes_middleware(routes: Mapping[str, Callable]):
+    """Returns a middleware serving each path of ``routes`` with its WSGI callable, and
+    the other paths with the wrapped app.
+
+    >>> def hello(environ, start_response):
+    ...     start_response('200 OK', [('Content-Type', 'text/plain')])
+    ...     return [b'hello']
+    >>> def not_found(environ, start_response):
+    ...     start_response('404 Not Found', [])
+    ...     return [b'']
+    >>> app = mk_routes_middleware({'/hello': hello})(not_found)
+    >>> app({'PATH_INFO': '/hello'}, lambda status, headers: None)
+    [b'hello']
+    """
+
+    def middleware(wsgi):
+        def routed_wsgi(environ, start_response):
+            route = routes.get(environ.get('PATH_INFO', '/'), wsgi)
+            return route(environ, start_response)
+
+        return routed_wsgi
+
+    return middleware
+
+
+def query_params(environ) -> dict:
+    """The parameters of the query string of a request, keeping the last value of
+    repeated parameters.
+
+    >>> query_params({'QUERY_STRING': 'prefix=a&limit=10'})
+    {'prefix': 'a', 'limit': '10'}
+    """
+    return dict(parse_qsl(environ.get('QUERY_STRING', '')))
+
+
+def read_body(environ) -> bytes:
+    """Reads the whole body of a request."""
+    length = int(environ.get('CONTENT_LENGTH') or 0)
+    return environ['wsgi.input'].read(length) if length else b''
+
+
+def mk_openapi_patch_middleware(patch: Callable[[dict], dict], path='/openapi'):
+    """Returns a middleware applying ``patch`` to the OpenAPI spec published by the app
+    at ``path``, to describe what the other middlewares add to it.
+
+    >>> def app(environ, start_response):
+    ...     start_response('200 OK', [('Content-Type', 'application/json')])
+    ...     return [b'{"paths": {}}']
+    >>> patch = lambda spec: dict(spec, info='patched')
+    >>> patched_app = mk_openapi_patch_middleware(patch)(app)
+    >>> patched_app({'PATH_INFO': '/openapi'}, lambda status, headers: None)
+    [b'{"paths": {}, "info": "patched"}']
+    """
+
+    def middleware(wsgi):
+        def patching_wsgi(environ, start_response):
+            if environ.get('PATH_INFO') != path:
+                return wsgi(environ, start_response)
+            captured = {}
+
+            def capture_start_response(status, headers, *args):
+                captured.update(status=status, headers=headers)
+                return lambda data: None  # the body is only sent once patched
+
+            body = b''.join(wsgi(environ, capture_start_response))
+            if captured['status'].startswith('200'):
+                body = json.dumps(patch(json.loads(body))).encode()
+            headers = [
+                (k, v) for k, v in captured['headers'] if k.lower() != 'content-length'
+            ]
+            headers.append(('Content-Length', str(len(body))))
+            start_response(captured['status'], headers)
+            return [body]
+
+        return patching_wsgi
+
+    return middleware
+
+
+def json_response(start_response, obj, status='200 OK', headers=()):
+    body = json.dumps(obj).encode()
+    start_response(
+        status,
+        [('Content-Type', 'application/json'), ('Content-Length', str(len(body)))]
+        + list(headers),
+    )
+    return [body]
+
+
+def iter_json_lines(items: Iterable):
+    """Encodes ``items`` as newline delimited json, one chunk per item.
+
+    >>> list(iter_json_lines(['a', {'b': 1}]))
+    [b'"a"\\n', b'{"b": 1}\\n']
+    """
+    for item in items:
+        yield json.dumps(item).encode() + b'\n'
+
+
+def json_lines_response(start_response, items: Iterable):
+    """Streams ``items`` as newline delimited json. The WSGI server pulls the chunks one
+    by one as it writes them, so ``items`` is only consumed as fast as the client reads.
+    """
+    start_response('200 OK', [('Content-Type', JSON_LINES_CONTENT_TYPE)])
+    return iter_json_lines(items)
+
+
+_response_headers = ContextVar('extrude_response_headers', default=None)
+_response_status = ContextVar('extrude_response_status', default=None)
+
+
+def set_response_header(name: str, value: str):
+    """Sets a header of the response to the request being handled, from anywhere in the
+    code handling it (typically, a wrapper of an exposed function). Does nothing outside
+    of the requests handled by ``mk_response_headers_middleware``.
+    """
+    headers = _response_headers.get()
+    if headers is not None:
+        headers[name] = value
+
+
+def set_response_status(status: str):
+    """Sets the status of the response to the request being handled (``'503 Service
+    Unavailable'``, say), from anywhere in the code handling it, overriding the one the
+    app gives. Does nothing outside of the requests handled by
+    ``mk_response_headers_middleware``.
+    """
+    response_status = _response_status.get()
+    if response_status is not None:
+        response_status['status'] = status
+
+
+def mk_response_headers_middleware():
+    """Returns a middleware adding the headers set with ``set_response_header`` to the
+    responses, and giving them the status set with ``set_response_status``, if any.
+
+    >>> def app(environ, start_response):
+    ...     set_response_header('X-Extra', 'yes')
+    ...     start_response('200 OK', [])
+    ...     return [b'']
+    >>> _ = mk_response_headers_middleware()(app)({}, lambda s, h: print(h))
+    [('X-Extra', 'yes')]
+    """
+
+    def middleware(wsgi):
+        def headers_wsgi(environ, start_response):
+            headers = {}
+            response_status = {}
+
+            def start_response_with_headers(status, response_headers, *args):
+                response_headers = [
+                    (k, v) for k, v in response_headers if k not in headers
+                ]
+                response_headers.extend(headers.items())
+                status = response_status.get('status', status)
+                return start_response(status, response_headers, *args)
+
+            headers_token = _response_headers.set(headers)
+            status_token = _response_status.set(response_status)
+            try:
+                return wsgi(environ, start_response_with_headers)
+            finally:
+                _response_status.reset(status_token)
+                _response_headers.reset(headers_token)
+
+        return headers_wsgi
+
+    return middleware
@@ -4,11 +4,15 @@ How to prepare an application for dispatch:
 
 """
 
+import ast
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 from pathlib import Path
 import streamlit as st
-from typing import Iterable
+from typing import Callable, Hashable, Iterable, Mapping, Union
 import importlib.util
 import sys
 import types
@@ -17,6 +21,7 @@ from streamlitfront.base import dispatch_funcs
 
 ROOT_APP = '__extrude_root__'
 EXTRUDE_FUNCS = 'extrude_funcs'
+DFLT_PREWARM_RETRY_AFTER = 60
 
 
 def execute_module_spec(spec):
@@ -27,6 +32,21 @@ def execute_module_spec(spec):
     return module
 
 
+def forget_module(name: str):
+    """Removes the module ``name`` and its submodules from ``sys.modules``, so that a
+    stale package is executed anew, along with its submodules, rather than finding the
+    old ones.
+
+    >>> sys.modules['stale_pkg'] = sys.modules['stale_pkg.sub'] = types.ModuleType('m')
+    >>> forget_module('stale_pkg')
+    >>> 'stale_pkg' in sys.modules, 'stale_pkg.sub' in sys.modules
+    (False, False)
+    """
+    for module_name in list(sys.modules):
+        if module_name == name or module_name.startswith(name + '.'):
+            sys.modules.pop(module_name, None)
+
+
 def dispatch_raw_module(spec):
     """Creates a callable that will execute a module when called.
     Used to run a streamlit app without needing to modify it.
@@ -40,6 +60,255 @@ def dispatch_raw_module(spec):
     return app
 
 
+def module_spec_source_files(spec):
+    """Yields the source files of a module spec: the module file itself or, for a
+    package, every python file under the package directory."""
+    if spec.submodule_search_locations:
+        for location in spec.submodule_search_locations:
+            for dirpath, dirnames, filenames in os.walk(location):
+                dirnames[:] = [d for d in dirnames if not d.startswith('__')]
+                for filename in filenames:
+                    if filename.endswith('.py'):
+                        yield os.path.join(dirpath, filename)
+    elif spec.origin:
+        yield spec.origin
+
+
+def module_spec_signature(spec):
+    """A snapshot of the (path, mtime) pairs of the source files of a module spec.
+    Two equal signatures mean none of the files were touched in between."""
+
+    def mtime(path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    return tuple(sorted((path, mtime(path)) for path in module_spec_source_files(spec)))
+
+
+def module_spec_imports(spec):
+    """Yields the names of the modules imported (absolutely) at the top level of the
+    source files of a module spec."""
+    for path in module_spec_source_files(spec):
+        try:
+            with open(path) as fp:
+                tree = ast.parse(fp.read(), path)
+        except (OSError, SyntaxError, ValueError):
+            continue
+        for node in tree.body:
+            if isinstance(node, ast.Import):
+                yield from (alias.name for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and not node.level and node.module:
+                yield node.module
+
+
+def import_module_spec_dependencies(spec):
+    """Imports the top level dependencies of a module spec without executing the module
+    itself, so that a later execution finds them in ``sys.modules``.
+    Returns the names of the dependencies that could not be imported."""
+    failed = []
+    for name in dict.fromkeys(module_spec_imports(spec)):
+        try:
+            importlib.import_module(name)
+        except Exception:
+            failed.append(name)
+    return failed
+
+
+class ModuleRegistry:
+    """Keeps executed child modules, and the apps built from them, across streamlit
+    reruns. A child module is only executed again when the mtimes of its source files
+    change, in which case the apps built from the old module are dropped too, along
+    with its submodules (see ``forget_module``) and its warm-up status.
+
+    >>> import tempfile
+    >>> rootdir = tempfile.mkdtemp()
+    >>> pathname = os.path.join(rootdir, 'child_app.py')
+    >>> with open(pathname, 'w') as fp:
+    ...     _ = fp.write('n_executions = 1')
+    >>> registry = ModuleRegistry()
+    >>> spec = get_module_spec_from_pathname(pathname)
+    >>> registry.module(spec).n_executions
+    1
+    >>> registry.module(spec) is registry.module(spec)
+    True
+    >>> registry.stats()
+    {'hits': 2, 'misses': 1, 'modules': 1}
+    >>> def mk_app(module):
+    ...     return lambda: module.n_executions
+    >>> app = registry.app(spec, mk_app)
+    >>> app is registry.app(spec, mk_app)
+    True
+    >>> os.utime(pathname, ns=(0, 0))  # touching the file invalidates the entry
+    >>> app is registry.app(spec, mk_app)
+    False
+    >>> registry.stats()
+    {'hits': 4, 'misses': 2, 'modules': 1}
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.warmup_status = {}
+        self._warmups = {}  # name: (signature warmed, time the warm-up ended)
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._module_locks = {}
+
+    def _module_lock(self, name):
+        with self._lock:
+            return self._module_locks.setdefault(name, threading.RLock())
+
+    def _entry(self, spec):
+        signature = module_spec_signature(spec)
+        entry = self._entries.get(spec.name)
+        hit = entry is not None and entry['signature'] == signature
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if hit:
+            return entry
+        if entry is not None:  # stale
+            forget_module(spec.name)
+            with self._lock:
+                self.warmup_status.pop(spec.name, None)
+                self._warmups.pop(spec.name, None)
+        entry = dict(
+            signature=signature, module=execute_module_spec(spec), apps={}
+        )
+        self._entries[spec.name] = entry
+        return entry
+
+    def module(self, spec):
+        """Returns the module of ``spec``, executing it only if it is new or stale."""
+        with self._module_lock(spec.name):
+            return self._entry(spec)['module']
+
+    def app(self, spec, mk_app: Callable, key=None):
+        """Returns the app ``mk_app(module)`` built from the module of ``spec``.
+        The app is built once per execution of the module.
+
+        :param spec: importlib.machinery.ModuleSpec
+        :param mk_app: A function that takes the module and returns the app.
+        :param key: (Optional) Distinguishes several apps built from the same module.
+            Defaults to ``mk_app`` itself.
+        """
+        with self._module_lock(spec.name):
+            entry = self._entry(spec)
+            key = mk_app if key is None else key
+            if key not in entry['apps']:
+                entry['apps'][key] = mk_app(entry['module'])
+            return entry['apps'][key]
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, modules=len(self._entries))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.warmup_status.clear()
+            self._warmups.clear()
+
+    def prewarm(
+        self,
+        warmers: Mapping[str, Callable],
+        *,
+        max_workers: int = 4,
+        timeout=None,
+        signatures: Mapping[str, Hashable] = None,
+        retry_after: float = DFLT_PREWARM_RETRY_AFTER,
+    ):
+        """Calls the ``warmers`` (a ``{name: callable}`` mapping) on a background thread
+        pool and returns immediately. The progress of each name is recorded in
+        ``warmup_status`` as one of ``'pending'``, ``'ready'``, ``'timeout'`` or
+        ``'failed: <error>'``. A name is only warmed again when its signature changed,
+        or ``retry_after`` seconds after its warm-up failed or timed out.
+
+        :param warmers: The callables doing the warm-up, typically building an app
+            through this registry.
+        :param max_workers: The number of warm-ups running at the same time.
+        :param timeout: (Optional) The number of seconds after which a running warm-up
+            is given up on. The work itself can't be interrupted and goes on in a
+            daemon thread, but stops holding a worker of the pool.
+        :param signatures: (Optional) A ``{name: signature}`` mapping (of the
+            ``module_spec_signature`` of the modules warmed, say): names are warmed
+            again when their signature changes.
+        :param retry_after: The number of seconds after which failed or timed out
+            warm-ups are retried.
+
+        >>> import time
+        >>> registry = ModuleRegistry()
+        >>> registry.prewarm(
+        ...     {'fast': lambda: None, 'slow': lambda: time.sleep(2)}, timeout=0.5
+        ... )
+        >>> time.sleep(1)
+        >>> sorted(registry.warmup_status.items())
+        [('fast', 'ready'), ('slow', 'timeout')]
+        >>> registry.prewarm({'fast': lambda: None, 'slow': lambda: None}, retry_after=0)
+        >>> time.sleep(0.5)
+        >>> sorted(registry.warmup_status.items())
+        [('fast', 'ready'), ('slow', 'ready')]
+        """
+        signatures = signatures or {}
+        now = time.monotonic()
+
+        def needs_warmup(name):
+            status = self.warmup_status.get(name)
+            if status is None:
+                return True
+            if status == 'pending':
+                return False
+            signature, ended = self._warmups.get(name, (None, None))
+            if signatures.get(name) != signature:
+                return True
+            return status != 'ready' and now - ended >= retry_after
+
+        with self._lock:
+            warmers = {
+                name: warmer for name, warmer in warmers.items() if needs_warmup(name)
+            }
+            for name in warmers:
+                self.warmup_status[name] = 'pending'
+                self._warmups[name] = (signatures.get(name), None)
+        if not warmers:
+            return
+        executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='extrude-prewarm'
+        )
+        for name, warmer in warmers.items():
+            executor.submit(self._warm, name, warmer, timeout)
+        executor.shutdown(wait=False)
+
+    def _warm(self, name, warmer, timeout):
+        def set_status(status):
+            with self._lock:
+                self.warmup_status[name] = status
+                signature, _ = self._warmups.get(name, (None, None))
+                self._warmups[name] = (signature, time.monotonic())
+
+        def run():
+            try:
+                warmer()
+                set_status('ready')
+            except Exception as error:
+                set_status(f'failed: {error}')
+
+        thread = threading.Thread(
+            target=run, name=f'extrude-prewarm-{name}', daemon=True
+        )
+        thread.start()
+        thread.join(timeout)
+        if thread.is_alive():
+            set_status('timeout')
+
+
+# Module level, so that it survives streamlit reruns of the root app script
+module_registry = ModuleRegistry()
+
+
 def get_module_spec_from_pathname(pathname: str):
     """Creates an instance of importlib.machinery.ModuleSpec from a path."""
     module_name = os.path.basename(os.path.normpath(pathname))
@@ -72,7 +341,42 @@ def mk_dflt_dispatch(module, configs):
     return dispatch
 
 
-def dispatch_child_apps(pathnames: Iterable[str], configs: dict = None):
+def mk_child_app(module, configs: dict):
+    """Builds the app of a child module from its configuration (see dispatch_child_apps)."""
+    app = configs.get('app', None)
+    if isinstance(app, str):
+        app = getattr(module, app, configs.get(app, None))
+    if not callable(app):
+        dispatch = configs.get('dispatch', mk_dflt_dispatch(module, configs))
+        if isinstance(dispatch, str):
+            dispatch = getattr(module, dispatch)
+        app = dispatch()
+    return app
+
+
+def mk_child_warmer(spec, configs: dict, registry: ModuleRegistry):
+    """Returns a callable preparing a child app ahead of its first display.
+    Configured apps are built through the registry. Raw streamlit scripts would render
+    when executed, so only their top level dependencies are imported."""
+    app = configs.get('app', None)
+    if not app:
+        return partial(import_module_spec_dependencies, spec)
+    if callable(app):
+        return lambda: None
+    return partial(
+        registry.app, spec, partial(mk_child_app, configs=configs), key='app'
+    )
+
+
+def dispatch_child_apps(
+    pathnames: Iterable[str],
+    configs: dict = None,
+    registry: ModuleRegistry = None,
+    *,
+    prewarm: Union[bool, Iterable[str]] = False,
+    prewarm_timeout: float = 60,
+    prewarm_workers: int = 4,
+):
     """Recurses through a Python module to collect objects that can be dispatched to a streamlit app.
 
     :param pathnames: An iterable of files and/or directory to scan through. If a filename
@@ -86,9 +390,23 @@ def dispatch_child_apps(pathnames: Iterable[str], configs: dict = None):
         config[pkgname]['dispatch'] can be a string to refer to a dispatcher within the module,
         or a reference to a callable from the root app. The default dispatcher will be
         streamlitfront.base.dispatch_funcs.
+    :param registry: (Optional) The ModuleRegistry keeping the executed child modules and
+        their apps across reruns. Defaults to the module level ``module_registry``.
+        Children without an ``app`` config are run as raw streamlit scripts, so they
+        are still executed on every rerun.
+    :param prewarm: (Optional) If True, while the root navigation page is displayed, the
+        children are prepared on a background thread pool (see mk_child_warmer) so that
+        opening one of them doesn't pay for its imports. Can also be an iterable of the
+        names of the children to prepare. Children are prepared again when their files
+        change, and their failed warm-ups are retried (see ``ModuleRegistry.prewarm``).
+    :param prewarm_timeout: The number of seconds after which the warm-up of a child is
+        given up on.
+    :param prewarm_workers: The number of children prepared at the same time.
     """
     if not configs:
         configs = {}
+    if registry is None:
+        registry = module_registry
 
     module_specs = [get_module_spec_from_pathname(pathname) for pathname in pathnames]
 
@@ -101,8 +419,31 @@ def dispatch_child_apps(pathnames: Iterable[str], configs: dict = None):
     if 'current_app' not in st.session_state:
         st.session_state['current_app'] = ROOT_APP
 
+    names = list(module_mapping if prewarm is True else prewarm or ())
+    unknown_names = [name for name in names if name not in module_mapping]
+    if unknown_names:
+        raise ValueError(
+            f'Can not prewarm {unknown_names}: the children are {list(module_mapping)}'
+        )
+
     current_app_name = st.session_state['current_app']
+    if current_app_name not in module_mapping:  # the child is gone: back to the root
+        current_app_name = st.session_state['current_app'] = ROOT_APP
     if current_app_name == ROOT_APP:
+        if names:
+            registry.prewarm(
+                {
+                    name: mk_child_warmer(
+                        module_mapping[name], configs.get(name, configs), registry
+                    )
+                    for name in names
+                },
+                max_workers=prewarm_workers,
+                timeout=prewarm_timeout,
+                signatures={
+                    name: module_spec_signature(module_mapping[name]) for name in names
+                },
+            )
         return render_root_nav(app_name_mapping)
 
     current_module_spec = module_mapping[current_app_name]
@@ -110,16 +451,12 @@ def dispatch_child_apps(pathnames: Iterable[str], configs: dict = None):
     app = config_for_module.get('app', None)
     if not app:
         app = dispatch_raw_module(current_module_spec)
-    current_module = execute_module_spec(current_module_spec)
-    if isinstance(app, str):
-        app = getattr(current_module, app, config_for_module.get(app, None))
-    if not callable(app):
-        dispatch = config_for_module.get(
-            'dispatch', mk_dflt_dispatch(current_module, config_for_module)
+    elif not callable(app):
+        app = registry.app(
+            current_module_spec,
+            partial(mk_child_app, configs=config_for_module),
+            key='app',
         )
-        if isinstance(dispatch, str):
-            dispatch = getattr(current_module, dispatch)
-        app = dispatch()
     try:
         app()
     except Exception as error:
@@ -131,27 +468,29 @@ def dispatch_child_apps(pathnames: Iterable[str], configs: dict = None):
     )
 
 
-def dispatch_child_apps_from_root(root_dir: str, configs: dict = None):
+def dispatch_child_apps_from_root(root_dir: str, configs: dict = None, **kwargs):
     """Lists the contents of a directory and passes the list to dispatch_child_apps_from_paths.
 
     :param root_dir: A path to a directory that contains one or more children to dispatch.
     :param configs: (Optional) See dispatch_child_apps.
+    :param kwargs: (Optional) Extra arguments of dispatch_child_apps, such as ``prewarm``.
     """
     root_pathname = os.path.abspath(root_dir)
     if not os.path.isdir(root_pathname):
         raise ValueError(f'{root_dir} is not a path to a directory.')
     children = [path for path in os.listdir(root_pathname) if not path.startswith('__')]
     child_paths = [os.path.join(root_pathname, child) for child in children]
-    return dispatch_child_apps(child_paths, configs)
+    return dispatch_child_apps(child_paths, configs, **kwargs)
 
 
 def dispatch_child_apps_from_module(
-    root_module: types.ModuleType, configs: dict = None
+    root_module: types.ModuleType, configs: dict = None, **kwargs
 ):
     """Takes a root Python module and scans through its immediate children to dispatch functions.
 
     :param root_module: A module that contains one or more child packages to dispatch.
     :param configs: (Optional) See dispatch_child_apps.
+    :param kwargs: (Optional) Extra arguments of dispatch_child_apps, such as ``prewarm``.
 
     >>> import streamlit as st
     >>> import extrude.examples.example_apps_simple as example_apps
@@ -162,5 +501,5 @@ def dispatch_child_apps_from_module(
     root_filename = root_module.__file__
     root_dir = Path(root_filename).parent.absolute()
     return dispatch_child_apps_from_root(
-        str(root_dir).replace('__pycache__/', ''), configs
+        str(root_dir).replace('__pycache__/', ''), configs, **kwargs
     )
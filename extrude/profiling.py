@@ -0,0 +1,164 @@
+"""On-demand profiling of the functions exposed by ``mk_api``.
+
+Calls are run under ``cProfile`` when the request asks for it with an
+``X-Extrude-Profile: 1`` header, or for a random sample of the calls. The stats of each
+profiled call are written, in the ``pstats`` format, in a store (a store of the mall of
+the API, a directory...), under a key sent back in the ``X-Extrude-Profile-Key``
+header. The ``list_profiles`` and ``get_profile`` endpoints of the API then list them
+and report on them.
+"""
+
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, MutableMapping, Optional, Union
+
+from extrude.middleware import set_response_header
+
+PROFILE_HEADER = 'X-Extrude-Profile'
+PROFILE_KEY_HEADER = 'X-Extrude-Profile-Key'
+DFLT_MAX_PROFILES = 100
+DFLT_REPORT_LIMIT = 30
+
+_profile_requested = ContextVar('extrude_profile_requested', default=False)
+
+
+def _dir_store(rootdir: str) -> MutableMapping:
+    from dol import Files
+
+    os.makedirs(rootdir, exist_ok=True)
+    return Files(rootdir)
+
+
+class Profiler:
+    """Profiles the calls of functions (see ``profile``) on demand, and keeps their
+    stats in ``store``.
+
+    :param store: (Optional) Where to keep the stats: a mapping taking bytes, or the
+        path of a directory. Defaults to a dict.
+    :param sample_rate: The fraction of the calls to profile, regardless of headers.
+    :param on_header: Whether to profile the calls of the requests that have an
+        ``X-Extrude-Profile`` header (see ``mk_middleware``).
+    :param max_profiles: The number of profiles to keep: the oldest ones written by
+        this profiler are deleted beyond that.
+
+    Calls run in process pools (see ``extrude.execution``) aren't profiled.
+
+    >>> profiler = Profiler(sample_rate=1)
+    >>> double = profiler.profile(lambda x: x * 2, 'double')
+    >>> double(21)
+    42
+    >>> [key] = profiler.list_profiles('double')
+    >>> 'function calls' in profiler.get_profile(key)
+    True
+    """
+
+    def __init__(
+        self,
+        store: Optional[Union[MutableMapping, str]] = None,
+        *,
+        sample_rate: float = 0.0,
+        on_header: bool = True,
+        max_profiles: int = DFLT_MAX_PROFILES,
+    ):
+        if store is None:
+            store = {}
+        elif isinstance(store, str):
+            store = _dir_store(store)
+        self.store = store
+        self.sample_rate = sample_rate
+        self.on_header = on_header
+        self.max_profiles = max_profiles
+        self._pid = os.getpid()
+        self._written_keys = deque()
+        self._lock = threading.Lock()
+
+    def should_profile(self) -> bool:
+        if os.getpid() != self._pid:
+            return False
+        if self.on_header and _profile_requested.get():
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def profile(self, func: Callable, name: str) -> Callable:
+        """Wraps ``func`` (exposed as ``name``) to profile the calls that should be."""
+
+        @wraps(func)
+        def profiled_func(*args, **kwargs):
+            if not self.should_profile():
+                return func(*args, **kwargs)
+            profile = cProfile.Profile()
+            started = time.time()
+            try:
+                return profile.runcall(func, *args, **kwargs)
+            finally:
+                key = self._save(name, profile, started)
+                set_response_header(PROFILE_KEY_HEADER, key)
+
+        return profiled_func
+
+    def _save(self, name: str, profile: cProfile.Profile, started: float) -> str:
+        profile.create_stats()
+        time_str = time.strftime('%Y%m%dT%H%M%S', time.gmtime(started))
+        key = f'{name}-{time_str}-{uuid.uuid4().hex[:8]}.prof'
+        self.store[key] = marshal.dumps(profile.stats)
+        with self._lock:
+            self._written_keys.append(key)
+            while len(self._written_keys) > self.max_profiles:
+                self.store.pop(self._written_keys.popleft(), None)
+        return key
+
+    def list_profiles(self, func_name: str = None) -> list:
+        """Lists the keys of the stored profiles, of the calls of ``func_name`` if
+        given."""
+        keys = (str(k) for k in self.store)
+        if func_name is not None:
+            keys = (k for k in keys if k.startswith(f'{func_name}-'))
+        return sorted(keys)
+
+    def stats(self, key: str) -> pstats.Stats:
+        """The ``pstats.Stats`` of a stored profile."""
+        stats = pstats.Stats()
+        stats.stats = marshal.loads(self.store[key])
+        stats.get_top_level_stats()
+        return stats
+
+    def get_profile(
+        self, key: str, sort_by: str = 'cumulative', limit: int = DFLT_REPORT_LIMIT
+    ) -> str:
+        """The report of a stored profile: its ``limit`` top entries by ``sort_by``
+        (``'cumulative'``, ``'tottime'``, ``'ncalls'``...)."""
+        if key not in self.store:
+            raise KeyError(f'No profile under "{key}"')
+        report = io.StringIO()
+        stats = self.stats(key)
+        stats.stream = report
+        stats.sort_stats(sort_by).print_stats(limit)
+        return report.getvalue()
+
+    def mk_middleware(self):
+        """Returns a middleware telling the profiled functions whether the request
+        handled asked for profiling (with an ``X-Extrude-Profile`` header)."""
+        environ_key = 'HTTP_' + PROFILE_HEADER.upper().replace('-', '_')
+
+        def middleware(wsgi):
+            def profiling_wsgi(environ, start_response):
+                requested = environ.get(environ_key, '0').lower()
+                token = _profile_requested.set(requested not in ('', '0', 'false'))
+                try:
+                    return wsgi(environ, start_response)
+                finally:
+                    _profile_requested.reset(token)
+
+            return profiling_wsgi
+
+        return middleware
@@ -0,0 +1,206 @@
+"""Servers for the WSGI apps made by ``mk_api``, as alternatives to the default
+(single threaded) server of py2http.
+"""
+
+import os
+import signal
+import sys
+import threading
+import time
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+DFLT_HOST = 'localhost'
+DFLT_PORT = 3030
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    """A WSGI server handling each request in its own thread."""
+
+    daemon_threads = True
+
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def serve_threaded(app, host: str = DFLT_HOST, port: int = DFLT_PORT, quiet=False):
+    """Serves the WSGI ``app`` with a thread per request, so that slow calls (or calls
+    waiting for a pool, see ``extrude.execution``) don't hold up the others."""
+    handler_class = QuietWSGIRequestHandler if quiet else WSGIRequestHandler
+    with make_server(
+        host,
+        int(port),
+        app,
+        server_class=ThreadingWSGIServer,
+        handler_class=handler_class,
+    ) as server:
+        server.serve_forever()
+
+
+class _WorkerWSGIServer(ThreadingWSGIServer):
+    # Requests in flight are completed when a worker is stopped
+    daemon_threads = False
+    block_on_close = True
+
+    def server_activate(self):
+        super().server_activate()
+        # All the workers are woken up by a connection, and all but one find nothing
+        # to accept: they must go back to their loop (to see they were asked to stop)
+        # rather than block in accept()
+        self.socket.setblocking(False)
+
+    def get_request(self):
+        connection, address = super().get_request()  # BlockingIOError if none left
+        connection.setblocking(True)
+        return connection, address
+
+
+def _run_worker(server):
+    def stop(signum, frame):
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the master stops the workers
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    exit_code = 0
+    try:
+        server.serve_forever()
+        server.server_close()
+    except BaseException:
+        exit_code = 1
+    finally:
+        os._exit(exit_code)
+
+
+class PreforkMaster:
+    """Runs ``n_workers`` forked processes serving the requests of ``server`` (all
+    accepting connections on its listening socket), replaces the workers that die, and
+    handles signals:
+
+    - ``SIGHUP``: graceful restart. New workers are started, and the old ones finish
+      the requests they're handling before exiting.
+    - ``SIGTERM``, ``SIGINT``: graceful stop.
+
+    Workers not done ``graceful_timeout`` seconds after being asked to stop are killed.
+    """
+
+    poll_interval = 0.2
+    min_worker_lifetime = 1.0
+
+    def __init__(self, server, n_workers: int, graceful_timeout: float = 30):
+        self.server = server
+        self.n_workers = n_workers
+        self.graceful_timeout = graceful_timeout
+        self.workers = {}  # pid: (generation, start time)
+        self.stop_deadlines = {}  # pid: time after which the worker is killed
+        self.generation = 0
+        self.restart_requested = False
+        self.stopping = False
+
+    def spawn_worker(self):
+        pid = os.fork()
+        if pid == 0:
+            _run_worker(self.server)
+        self.workers[pid] = (self.generation, time.monotonic())
+        return pid
+
+    def stop_workers(self, pids):
+        deadline = time.monotonic() + self.graceful_timeout
+        for pid in pids:
+            self.stop_deadlines.setdefault(pid, deadline)
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def restart_workers(self):
+        old_pids = list(self.workers)
+        self.generation += 1
+        for _ in range(self.n_workers):
+            self.spawn_worker()
+        self.stop_workers(old_pids)
+
+    def _reap_workers(self):
+        while True:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            generation, started = self.workers.pop(pid, (None, None))
+            self.stop_deadlines.pop(pid, None)
+            if generation == self.generation and not self.stopping:
+                if time.monotonic() - started < self.min_worker_lifetime:
+                    time.sleep(self.min_worker_lifetime)  # don't spin on crashes
+                self.spawn_worker()
+
+    def _kill_overdue_workers(self):
+        now = time.monotonic()
+        for pid, deadline in list(self.stop_deadlines.items()):
+            if now > deadline:
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+
+    def _on_restart_signal(self, signum, frame):
+        self.restart_requested = True
+
+    def _on_stop_signal(self, signum, frame):
+        self.stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGHUP, self._on_restart_signal)
+        signal.signal(signal.SIGTERM, self._on_stop_signal)
+        signal.signal(signal.SIGINT, self._on_stop_signal)
+        for _ in range(self.n_workers):
+            self.spawn_worker()
+        try:
+            while self.workers:
+                if self.stopping:
+                    self.stop_workers(
+                        [pid for pid in self.workers if pid not in self.stop_deadlines]
+                    )
+                elif self.restart_requested:
+                    self.restart_requested = False
+                    self.restart_workers()
+                self._reap_workers()
+                self._kill_overdue_workers()
+                time.sleep(self.poll_interval)
+        finally:
+            self.server.server_close()
+
+
+def serve_prefork(
+    app,
+    host: str = DFLT_HOST,
+    port: int = DFLT_PORT,
+    workers: int = None,
+    *,
+    quiet: bool = False,
+    graceful_timeout: float = 30,
+):
+    """Serves the WSGI ``app`` with ``workers`` forked processes (one per core by
+    default) sharing the same port, each handling requests with a thread per request.
+    See ``PreforkMaster`` for how workers are restarted (send ``SIGHUP`` to the master
+    process for a graceful restart) and stopped.
+
+    The app is made once, before the workers are forked, so each worker has its own
+    copy of what is in memory: state that must be shared by all workers, like the
+    stores of a mall, must live out of the process (see ``extrude.stores.SqliteStore``,
+    or ``dol`` stores on files).
+    """
+    if not hasattr(os, 'fork'):
+        raise RuntimeError(f'Forked workers are not supported on {sys.platform}')
+    handler_class = QuietWSGIRequestHandler if quiet else WSGIRequestHandler
+    server = make_server(
+        host,
+        int(port),
+        app,
+        server_class=_WorkerWSGIServer,
+        handler_class=handler_class,
+    )
+    PreforkMaster(server, workers or os.cpu_count() or 1, graceful_timeout).run()
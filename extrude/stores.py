@@ -0,0 +1,715 @@
+"""Tools to browse the stores of a Mall without loading all their keys at once, and
+stores shared by several processes."""
+
+import os
+import pickle
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import wraps
+from itertools import chain, islice
+from typing import Callable, Iterable, Mapping, MutableMapping, Optional
+
+from i2 import name_of_obj
+
+from extrude.middleware import json_lines_response, json_response, query_params
+
+DFLT_KEYS_PAGE_SIZE = 100
+MAX_SUSPENDED_PAGINGS = 128
+SQLITE_ITER_CHUNK_SIZE = 1000
+DFLT_MAX_STORED_OUTPUTS = 1000
+OUTPUT_STORE_ATTR = 'output_store'
+_exhausted = object()
+
+
+def filter_keys(
+    keys: Iterable, prefix: Optional[str] = None, contains: Optional[str] = None
+):
+    """Lazily filters ``keys`` on (the string representation of) their prefix and/or a
+    substring.
+
+    >>> list(filter_keys(['apple', 'banana', 'apricot'], prefix='ap'))
+    ['apple', 'apricot']
+    >>> list(filter_keys(['apple', 'banana', 'apricot'], contains='an'))
+    ['banana']
+    """
+    return (key for key in keys if _key_matches(key, prefix, contains))
+
+
+def _key_matches(key, prefix, contains):
+    if prefix is not None and not str(key).startswith(prefix):
+        return False
+    return contains is None or contains in str(key)
+
+
+# Iterators over the keys of stores, left where the last page given stopped
+_suspended_pagings = OrderedDict()  # token: (store, prefix, contains, n_scanned, keys)
+_suspended_pagings_lock = threading.Lock()
+
+
+def _resume_keys(store, prefix, contains, cursor):
+    n_scanned, _, token = (cursor or '0').partition('-')
+    n_scanned = int(n_scanned)
+    with _suspended_pagings_lock:
+        suspended = _suspended_pagings.pop(token, None)
+    if suspended is not None:
+        suspended_store, *position, remaining = suspended
+        if suspended_store is store and position == [prefix, contains, n_scanned]:
+            return n_scanned, remaining
+    # Unknown (or evicted) cursor, from another process say: skip the keys scanned
+    return n_scanned, islice(iter(store), n_scanned, None)
+
+
+def _next_page(store, remaining, n_scanned, prefix, contains, limit):
+    keys = []
+    for key in remaining:
+        n_scanned += 1
+        if _key_matches(key, prefix, contains):
+            keys.append(key)
+            if len(keys) == limit:
+                break
+    else:
+        return dict(keys=keys, cursor=None)
+    next_key = next(remaining, _exhausted)
+    if next_key is _exhausted:
+        return dict(keys=keys, cursor=None)
+    token = uuid.uuid4().hex
+    with _suspended_pagings_lock:
+        _suspended_pagings[token] = (
+            store,
+            prefix,
+            contains,
+            n_scanned,
+            chain([next_key], remaining),
+        )
+        while len(_suspended_pagings) > MAX_SUSPENDED_PAGINGS:
+            _suspended_pagings.popitem(last=False)
+    return dict(keys=keys, cursor=f'{n_scanned}-{token}')
+
+
+def keys_page(
+    store: Mapping,
+    *,
+    prefix: Optional[str] = None,
+    contains: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = DFLT_KEYS_PAGE_SIZE,
+) -> dict:
+    """Returns a page of at most ``limit`` (filtered) keys of ``store`` as a
+    ``{'keys': [...], 'cursor': ...}`` dict. Passing the cursor back gives the next
+    page, until the cursor is None.
+
+    The iteration over the keys is kept where the page stopped, and taken up by the
+    call given its cursor, so that paging through a store scans it once. The last
+    ``MAX_SUSPENDED_PAGINGS`` iterations are kept. Otherwise (for a cursor given by
+    another process, say), the keys scanned so far, whose number the cursor tells, are
+    skipped, so pages are consistent as long as the iteration order of the store is.
+
+    >>> store = dict.fromkeys(['a1', 'b1', 'a2', 'a3', 'b2'])
+    >>> page = keys_page(store, prefix='a', limit=2)
+    >>> page['keys'], page['cursor'].split('-')[0]
+    (['a1', 'a2'], '3')
+    >>> keys_page(store, prefix='a', limit=2, cursor=page['cursor'])
+    {'keys': ['a3'], 'cursor': None}
+    >>> keys_page(store, prefix='a', limit=2, cursor='3')  # a cursor not kept here
+    {'keys': ['a3'], 'cursor': None}
+    """
+    n_scanned, remaining = _resume_keys(store, prefix, contains, cursor)
+    try:
+        return _next_page(store, remaining, n_scanned, prefix, contains, limit)
+    except RuntimeError:  # the store changed size while its iteration was suspended
+        remaining = islice(iter(store), n_scanned, None)
+        return _next_page(store, remaining, n_scanned, prefix, contains, limit)
+
+
+def count_keys(
+    store: Mapping, prefix: Optional[str] = None, contains: Optional[str] = None
+) -> int:
+    """Counts the (filtered) keys of ``store``, without materializing them.
+
+    >>> count_keys(dict.fromkeys(['a1', 'b1', 'a2']), prefix='a')
+    2
+    """
+    if prefix is None and contains is None:
+        return len(store)
+    return sum(1 for _ in filter_keys(store, prefix, contains))
+
+
+def mk_store_keys_stream_app(mall: Mapping):
+    """Returns a WSGI app streaming the keys of a store of ``mall`` as newline delimited
+    json. The store is given by the ``store_name_`` query parameter and the keys can be
+    filtered with the ``prefix`` and ``contains`` ones (see filter_keys).
+    """
+
+    def stream_store_keys(environ, start_response):
+        params = query_params(environ)
+        store_name = params.get('store_name_')
+        if store_name not in mall:
+            return json_response(
+                start_response,
+                dict(error=f'No store named "{store_name}"'),
+                status='404 Not Found',
+            )
+        keys = filter_keys(
+            mall[store_name], params.get('prefix'), params.get('contains')
+        )
+        return json_lines_response(start_response, keys)
+
+    return stream_store_keys
+
+
+def store_output(store_name: str, **retention):
+    """Marks a function whose output ``mk_api`` should write in the ``store_name`` store
+    of its mall, returning only the key of the output (see mk_output_storing_func, for
+    the ``max_outputs`` and ``ttl`` of the ``retention`` policy).
+
+    >>> @store_output('arrays')
+    ... def foo(n):
+    ...     return list(range(n))
+    >>> getattr(foo, OUTPUT_STORE_ATTR)
+    'arrays'
+    >>> getattr(store_output('arrays', ttl=60)(foo), OUTPUT_STORE_ATTR)
+    {'store_name': 'arrays', 'ttl': 60}
+    """
+    config = dict(store_name=store_name, **retention) if retention else store_name
+
+    def mark(func):
+        setattr(func, OUTPUT_STORE_ATTR, config)
+        return func
+
+    return mark
+
+
+def mk_output_storing_func(
+    func: Callable,
+    mall: MutableMapping,
+    store_name: str,
+    *,
+    max_outputs: Optional[int] = DFLT_MAX_STORED_OUTPUTS,
+    ttl: Optional[float] = None,
+) -> Callable:
+    """Wraps ``func`` so that it writes its output in the ``store_name`` store of
+    ``mall`` (made if missing) and returns the key of the output instead. The key can
+    then be given to the parameters of other functions crudified with the same store,
+    or to the ``get_stored_value`` endpoint of ``mk_api`` to get the output itself.
+
+    So that stored outputs don't pile up, only the last ``max_outputs`` outputs of the
+    function are kept (all of them if None), for ``ttl`` seconds at most (if given):
+    older ones are deleted when the function stores new ones. The outputs are tracked
+    by the process that stored them: with several workers, each keeps its own.
+
+    >>> mall = {}
+    >>> def foo(n):
+    ...     return list(range(n))
+    >>> foo_storing_output = mk_output_storing_func(foo, mall, 'arrays', max_outputs=2)
+    >>> key = foo_storing_output(3)
+    >>> mall['arrays'][key]
+    [0, 1, 2]
+    >>> _, _ = foo_storing_output(4), foo_storing_output(5)
+    >>> len(mall['arrays']), key in mall['arrays']
+    (2, False)
+    """
+    if store_name not in mall:
+        mall[store_name] = {}
+    func_name = name_of_obj(func)
+    stored = OrderedDict()  # key: time it was stored, oldest first
+    lock = threading.Lock()
+
+    def pop_expired_keys(now):
+        expired = []
+        with lock:
+            while stored and (
+                (max_outputs is not None and len(stored) > max_outputs)
+                or (ttl is not None and next(iter(stored.values())) < now - ttl)
+            ):
+                expired.append(stored.popitem(last=False)[0])
+        return expired
+
+    @wraps(func)
+    def func_storing_output(*args, **kwargs):
+        key = f'{func_name}-{uuid.uuid4().hex}'
+        store = mall[store_name]
+        store[key] = func(*args, **kwargs)
+        now = time.monotonic()
+        with lock:
+            stored[key] = now
+        for expired_key in pop_expired_keys(now):
+            store.pop(expired_key, None)  # unless it was deleted already
+        return key
+
+    return func_storing_output
+
+
+class SqliteStore(MutableMapping):
+    """A store keeping (pickled) values in a table of a SQLite database file, so that
+    several processes (the workers of ``extrude.serving.serve_prefork``, say) see the
+    same keys and values. Keys are strings, iterated in insertion order.
+
+    Each thread of each process has its own connection. The database is in WAL mode,
+    so reads don't wait for writes.
+
+    >>> import tempfile
+    >>> filepath = os.path.join(tempfile.mkdtemp(), 'mall.db')
+    >>> store = SqliteStore(filepath, 'arrays')
+    >>> store['a'] = [1, 2]
+    >>> store['b'] = {'x': 3}
+    >>> list(SqliteStore(filepath, 'arrays').items())
+    [('a', [1, 2]), ('b', {'x': 3})]
+    >>> del store['a']
+    >>> len(store), 'a' in store
+    (1, False)
+
+    :param filepath: The path of the database file.
+    :param table: The name of the table of the store.
+    :param dumps: The function serializing values into bytes.
+    :param loads: The function deserializing values from bytes.
+    :param timeout: How long to wait for a lock on the database, in seconds.
+    """
+
+    def __init__(
+        self,
+        filepath: str,
+        table: str = 'store',
+        *,
+        dumps: Callable = pickle.dumps,
+        loads: Callable = pickle.loads,
+        timeout: float = 30,
+    ):
+        if not re.fullmatch(r'[A-Za-z_][A-Za-z0-9_]*', table):
+            raise ValueError(f'Invalid table name: {table}')
+        self.filepath = filepath
+        self.table = table
+        self.dumps = dumps
+        self.loads = loads
+        self.timeout = timeout
+        self._local = threading.local()
+        self._execute('PRAGMA journal_mode=WAL')  # persists in the database file
+        self._execute(
+            f'CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value BLOB)'
+        )
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():  # not inherited through a fork
+            local.connection = sqlite3.connect(
+                self.filepath, timeout=self.timeout, isolation_level=None
+            )
+            local.pid = os.getpid()
+        return local.connection
+
+    def _execute(self, sql: str, params=()):
+        return self.connection.execute(sql, params)
+
+    def __getitem__(self, key):
+        row = self._execute(
+            f'SELECT value FROM {self.table} WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return self.loads(row[0])
+
+    def __setitem__(self, key, value):
+        self._execute(
+            f'INSERT INTO {self.table} (key, value) VALUES (?, ?) '
+            'ON CONFLICT(key) DO UPDATE SET value = excluded.value',
+            (key, self.dumps(value)),
+        )
+
+    def __delitem__(self, key):
+        if self._execute(f'DELETE FROM {self.table} WHERE key = ?', (key,)).rowcount:
+            return
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        query = f'SELECT 1 FROM {self.table} WHERE key = ?'
+        return self._execute(query, (key,)).fetchone() is not None
+
+    def __iter__(self):
+        # By chunks, each with its own query, so that the iteration doesn't hold a read
+        # transaction, and can be taken up in another thread (see keys_page)
+        last_rowid = -1
+        while True:
+            rows = self._execute(
+                f'SELECT rowid, key FROM {self.table} WHERE rowid > ? '
+                f'ORDER BY rowid LIMIT {SQLITE_ITER_CHUNK_SIZE}',
+                (last_rowid,),
+            ).fetchall()
+            for last_rowid, key in rows:
+                yield key
+            if len(rows) < SQLITE_ITER_CHUNK_SIZE:
+                return
+
+    def __len__(self):
+        return self._execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()[0]
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state, _local=threading.local())
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.filepath!r}, {self.table!r})'
+
+
+def mk_sqlite_mall(filepath: str, store_names: Iterable[str]) -> dict:
+    """Makes a mall whose stores are tables of the same SQLite database file (see
+    SqliteStore), to share them between the processes serving an API.
+
+    All the stores must be made up front: a store added to the mall later on (like the
+    store of ``mk_output_storing_func``, when missing) only lives in one process.
+
+    >>> import tempfile
+    >>> mall = mk_sqlite_mall(os.path.join(tempfile.mkdtemp(), 'mall.db'), ['x', 'y'])
+    >>> mall['x']
+    SqliteStore('...mall.db', 'x')
+    """
+    return {name: SqliteStore(filepath, name) for name in store_names}
+
+
+_CONTAINERS = (list, tuple, set, frozenset)
+
+
+def object_size(obj) -> int:
+    """The (approximate) number of bytes ``obj`` takes in memory: the size of the buffer
+    of arrays (their ``nbytes``), the deep memory usage of pandas objects, the length
+    of bytes, the sizes of the items of builtin containers, and ``sys.getsizeof`` of
+    other builtin objects. Only the size of the pickle of other objects is measured.
+
+    >>> object_size(b'abc')
+    3
+    >>> object_size({'a': [1, 2]}) > object_size({'a': [1]})
+    True
+    """
+    if isinstance(obj, (bytes, bytearray)):
+        return len(obj)
+    if isinstance(obj, memoryview):
+        return obj.nbytes
+    if isinstance(obj, (str, int, float, complex, bool, type(None))):
+        return sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(
+            object_size(k) + object_size(v) for k, v in obj.items()
+        )
+    if isinstance(obj, _CONTAINERS):
+        return sys.getsizeof(obj) + sum(object_size(item) for item in obj)
+    if hasattr(obj, 'memory_usage') and type(obj).__module__.startswith('pandas'):
+        usage = obj.memory_usage(deep=True)
+        return int(usage.sum() if hasattr(usage, 'sum') else usage)
+    if isinstance(getattr(obj, 'nbytes', None), int):
+        return obj.nbytes
+    try:
+        return len(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception:  # not picklable
+        return sys.getsizeof(obj)
+
+
+class MemoryBudget:
+    """The memory budget shared by one or more SpillingStores: once the values they
+    hold in memory take more than ``max_bytes``, the least recently used ones are
+    spilled to the disk tier of their store."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self.lock = threading.RLock()
+        self._entries = OrderedDict()  # (id(store), key): (store, size)
+
+    def add(self, store, key, size: int):
+        with self.lock:
+            self.remove(store, key)
+            self._entries[(id(store), key)] = (store, size)
+            self.used_bytes += size
+            while self.used_bytes > self.max_bytes and self._entries:
+                (_, lru_key), (lru_store, _) = next(iter(self._entries.items()))
+                lru_store._spill(lru_key)  # which removes it from the budget
+
+    def touch(self, store, key):
+        with self.lock:
+            self._entries.move_to_end((id(store), key))
+
+    def remove(self, store, key):
+        with self.lock:
+            entry = self._entries.pop((id(store), key), None)
+            if entry is not None:
+                self.used_bytes -= entry[1]
+
+
+class SpillingStore(MutableMapping):
+    """A store keeping its values in memory within a memory budget: beyond it, the least
+    recently used values are moved to a disk tier, and moved back to memory when they
+    are accessed. Keys of both tiers are listed, in insertion order.
+
+    >>> store = SpillingStore(max_bytes=10)
+    >>> store['a'] = b'12345678'
+    >>> store['b'] = b'1234'  # 'a' is spilled to make room
+    >>> report = store.report()
+    >>> report['resident_keys'], report['spilled_keys'], report['resident_bytes']
+    (1, 1, 4)
+    >>> store['a'], list(store)  # 'a' is loaded back, spilling 'b'
+    (b'12345678', ['a', 'b'])
+    >>> store.report()['spilled_keys']
+    1
+
+    :param max_bytes: The memory budget of the store. Ignored if ``budget`` is given.
+    :param spill_store: (Optional) The disk tier: a mapping keeping values out of
+        memory. Defaults to a SqliteStore in a temporary directory.
+    :param budget: (Optional) A MemoryBudget shared with other stores.
+    :param size_of: The function measuring the size of values (see ``object_size``).
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = None,
+        spill_store: Optional[MutableMapping] = None,
+        *,
+        budget: MemoryBudget = None,
+        size_of: Callable = object_size,
+    ):
+        if budget is None:
+            if max_bytes is None:
+                raise ValueError('Give a max_bytes or a budget')
+            budget = MemoryBudget(max_bytes)
+        if spill_store is None:
+            spill_dir = tempfile.mkdtemp(prefix='extrude-spill-')
+            spill_store = SqliteStore(os.path.join(spill_dir, 'spill.db'))
+        self.budget = budget
+        self.spill_store = spill_store
+        self.size_of = size_of
+        self._keys = {}  # key: None, in insertion order
+        self._resident = {}
+        self._sizes = {}
+
+    def _spill(self, key):
+        with self.budget.lock:
+            self.spill_store[key] = self._resident.pop(key)
+            self.budget.remove(self, key)
+
+    def __getitem__(self, key):
+        with self.budget.lock:
+            if key in self._resident:
+                self.budget.touch(self, key)
+                return self._resident[key]
+            if key not in self._keys:
+                raise KeyError(key)
+            value = self.spill_store[key]
+            del self.spill_store[key]
+            self._resident[key] = value
+            self.budget.add(self, key, self._sizes[key])
+            return value
+
+    def __setitem__(self, key, value):
+        size = self.size_of(value)
+        with self.budget.lock:
+            if key in self._keys and key not in self._resident:
+                del self.spill_store[key]
+            self._keys[key] = None
+            self._resident[key] = value
+            self._sizes[key] = size
+            self.budget.add(self, key, size)
+
+    def __delitem__(self, key):
+        with self.budget.lock:
+            if key not in self._keys:
+                raise KeyError(key)
+            if key in self._resident:
+                del self._resident[key]
+                self.budget.remove(self, key)
+            else:
+                del self.spill_store[key]
+            del self._keys[key], self._sizes[key]
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __iter__(self):
+        return iter(list(self._keys))
+
+    def __len__(self):
+        return len(self._keys)
+
+    def report(self) -> dict:
+        """The number and size of the values held in memory and on disk."""
+        with self.budget.lock:
+            resident_bytes = sum(self._sizes[k] for k in self._resident)
+            return dict(
+                resident_keys=len(self._resident),
+                resident_bytes=resident_bytes,
+                spilled_keys=len(self._keys) - len(self._resident),
+                spilled_bytes=sum(self._sizes.values()) - resident_bytes,
+            )
+
+
+class CachedStore(MutableMapping):
+    """A store keeping the values of ``store`` it reads and writes in memory, within a
+    memory budget, in front of ``store``: reads of the values in memory don't go to
+    ``store``, writes and deletions do, and the least recently used values are dropped
+    from memory beyond the budget. The other attributes are the ones of ``store`` (its
+    ``rootdir``, say).
+
+    >>> backing_store = {}
+    >>> store = CachedStore(backing_store, max_bytes=10)
+    >>> store['a'] = b'12345678'
+    >>> store['b'] = b'1234'  # 'a' is dropped from memory to make room
+    >>> backing_store == {'a': b'12345678', 'b': b'1234'}
+    True
+    >>> store.report()['resident_keys'], store['a'], list(store)
+    (1, b'12345678', ['a', 'b'])
+
+    :param store: The store holding the values.
+    :param max_bytes: The memory budget of the store. Ignored if ``budget`` is given.
+    :param budget: (Optional) A MemoryBudget shared with other stores.
+    :param size_of: The function measuring the size of values (see ``object_size``).
+    """
+
+    def __init__(
+        self,
+        store: MutableMapping,
+        max_bytes: int = None,
+        *,
+        budget: MemoryBudget = None,
+        size_of: Callable = object_size,
+    ):
+        if budget is None:
+            if max_bytes is None:
+                raise ValueError('Give a max_bytes or a budget')
+            budget = MemoryBudget(max_bytes)
+        self.store = store
+        self.budget = budget
+        self.size_of = size_of
+        self._resident = {}
+        self._sizes = {}
+
+    def _spill(self, key):
+        with self.budget.lock:  # the value is in the store already: just drop it
+            del self._resident[key]
+            self.budget.remove(self, key)
+
+    def _keep(self, key, value):
+        size = self.size_of(value)
+        with self.budget.lock:
+            self._resident[key] = value
+            self._sizes[key] = size
+            self.budget.add(self, key, size)
+
+    def __getitem__(self, key):
+        with self.budget.lock:
+            if key in self._resident:
+                self.budget.touch(self, key)
+                return self._resident[key]
+        value = self.store[key]
+        self._keep(key, value)
+        return value
+
+    def __setitem__(self, key, value):
+        self.store[key] = value
+        self._keep(key, value)
+
+    def __delitem__(self, key):
+        with self.budget.lock:
+            if key in self._resident:
+                del self._resident[key]
+                self.budget.remove(self, key)
+            self._sizes.pop(key, None)
+        del self.store[key]
+
+    def __contains__(self, key):
+        return key in self._resident or key in self.store
+
+    def __iter__(self):
+        return iter(self.store)
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getattr__(self, name):
+        if name.startswith('__') or 'store' not in self.__dict__:
+            raise AttributeError(name)
+        return getattr(self.store, name)
+
+    def report(self) -> dict:
+        """The number and size of the values held in memory and only in ``store``
+        (the sizes of the values that were never read or written are unknown)."""
+        with self.budget.lock:
+            resident_bytes = sum(self._sizes[k] for k in self._resident)
+            return dict(
+                resident_keys=len(self._resident),
+                resident_bytes=resident_bytes,
+                spilled_keys=len(self.store) - len(self._resident),
+                spilled_bytes=sum(self._sizes.values()) - resident_bytes,
+            )
+
+
+class BoundedMall(dict):
+    """A mall whose stores keep their values in memory within a memory budget. The
+    stores given to it are wrapped, not copied: reads and writes go to them, and only
+    the values in memory are bounded (see CachedStore). Plain dicts, which would hold
+    all the values in memory, are copied into stores spilling the least recently used
+    values to disk instead (see SpillingStore).
+
+    >>> mall = BoundedMall({'x': {'a': b'1234'}}, max_bytes=6)
+    >>> mall['y'] = {'b': b'1234'}
+    >>> sorted(mall['x']), mall.report()['total']['spilled_keys']
+    (['a'], 1)
+
+    :param mall: (Optional) The stores to start with.
+    :param max_bytes: (Optional) The memory budget shared by all the stores.
+    :param max_bytes_per_store: (Optional) The memory budget of each store, if there's
+        no overall budget.
+    :param spill_dir: (Optional) The directory of the disk tier. Defaults to a temporary
+        directory.
+    """
+
+    def __init__(
+        self,
+        mall: Mapping = (),
+        *,
+        max_bytes: int = None,
+        max_bytes_per_store: int = None,
+        spill_dir: str = None,
+    ):
+        super().__init__()
+        if (max_bytes is None) == (max_bytes_per_store is None):
+            raise ValueError('Give either max_bytes or max_bytes_per_store')
+        self.budget = None if max_bytes is None else MemoryBudget(max_bytes)
+        self.max_bytes_per_store = max_bytes_per_store
+        self.spill_dir = spill_dir or tempfile.mkdtemp(prefix='extrude-spill-')
+        self._n_stores = 0
+        for store_name, store in dict(mall).items():
+            self[store_name] = store
+
+    def __setitem__(self, store_name, store: Mapping):
+        if isinstance(store, (SpillingStore, CachedStore)):
+            pass
+        elif type(store) is not dict:
+            store = CachedStore(store, self.max_bytes_per_store, budget=self.budget)
+        else:
+            self._n_stores += 1
+            spilling_store = SpillingStore(
+                self.max_bytes_per_store,
+                SqliteStore(
+                    os.path.join(self.spill_dir, 'spill.db'), f'store_{self._n_stores}'
+                ),
+                budget=self.budget,
+            )
+            spilling_store.update(store)
+            store = spilling_store
+        super().__setitem__(store_name, store)
+
+    def report(self) -> dict:
+        """The number and size of the values held in memory and on disk, per store and
+        in total."""
+        reports = {name: store.report() for name, store in self.items()}
+        stats = ('resident_keys', 'resident_bytes', 'spilled_keys', 'spilled_bytes')
+        total = {
+            stat: sum(report[stat] for report in reports.values()) for stat in stats
+        }
+        return dict(stores=reports, total=total)
@@ -0,0 +1,173 @@
+"""Streaming the outputs of functions returning iterators (generators, scans...) as
+newline delimited json, item by item, instead of building them whole in memory.
+"""
+
+import json
+from inspect import isgeneratorfunction, unwrap
+from typing import Callable, Iterable, Mapping
+
+from extrude.middleware import (
+    JSON_LINES_CONTENT_TYPE,
+    json_lines_response,
+    json_response,
+    read_body,
+)
+
+STREAM_OUTPUT_ATTR = 'stream_output'
+STREAM_SPEC_KEY = 'x-extrude-stream'
+STREAM_ERROR_KEY = 'x-extrude-stream-error'
+
+
+class StreamError(RuntimeError):
+    """Raised when reading a stream whose function failed once it started streaming."""
+
+
+def _error_record(error: Exception) -> dict:
+    return {'error': f'{type(error).__name__}: {error}', STREAM_ERROR_KEY: True}
+
+
+def iter_items_or_error(items: Iterable):
+    """Iterates over ``items``, ending with an error record if the iteration fails, so
+    that clients tell a failed stream from a complete one (see
+    ``iter_response_items``).
+
+    >>> def gen():
+    ...     yield 1
+    ...     raise ValueError('no more')
+    >>> list(iter_items_or_error(gen()))
+    [1, {'error': 'ValueError: no more', 'x-extrude-stream-error': True}]
+    """
+    try:
+        yield from items
+    except Exception as error:
+        yield _error_record(error)
+
+
+def stream_output(func: Callable):
+    """Marks a function returning an iterator, so that ``mk_api`` streams its items.
+    Generator functions don't need to be marked.
+
+    >>> @stream_output
+    ... def scan(n):
+    ...     return iter(range(n))
+    >>> is_streaming_func(scan)
+    True
+    """
+    setattr(func, STREAM_OUTPUT_ATTR, True)
+    return func
+
+
+def is_streaming_func(func: Callable) -> bool:
+    """Whether the outputs of ``func`` should be streamed.
+
+    >>> def gen(n):
+    ...     yield from range(n)
+    >>> is_streaming_func(gen), is_streaming_func(len)
+    (True, False)
+    """
+    return getattr(func, STREAM_OUTPUT_ATTR, False) or isgeneratorfunction(
+        unwrap(func)
+    )
+
+
+def mk_streaming_middleware(funcs: Mapping[str, Callable]):
+    """Returns a middleware serving the calls of the streaming ``funcs`` (a ``{name:
+    func}`` mapping, served at ``/name``): the items of their output are sent as
+    newline delimited json as they are produced. Since the WSGI server pulls the items
+    as it writes them, a slow client slows down the iteration (backpressure) instead of
+    letting items pile up in memory. Errors raised once the response started end it
+    with an error record (see ``iter_items_or_error``).
+
+    >>> def gen(n):
+    ...     yield from range(n)
+    >>> import io
+    >>> environ = {'PATH_INFO': '/gen', 'CONTENT_LENGTH': '8',
+    ...            'wsgi.input': io.BytesIO(b'{"n": 3}')}
+    >>> app = mk_streaming_middleware({'gen': gen})(None)
+    >>> list(app(environ, lambda status, headers: None))
+    [b'0\\n', b'1\\n', b'2\\n']
+    """
+
+    def middleware(wsgi):
+        def streaming_wsgi(environ, start_response):
+            func = funcs.get(environ.get('PATH_INFO', '').strip('/'))
+            if func is None:
+                return wsgi(environ, start_response)
+            try:
+                body = read_body(environ)
+                items = iter(func(**(json.loads(body) if body else {})))
+            except Exception as error:
+                return json_response(
+                    start_response,
+                    dict(error=f'{type(error).__name__}: {error}'),
+                    status='500 Internal Server Error',
+                )
+            return json_lines_response(start_response, iter_items_or_error(items))
+
+        return streaming_wsgi
+
+    return middleware
+
+
+def mk_stream_spec_patch(func_names):
+    """Returns an OpenAPI spec patch (see ``extrude.middleware.
+    mk_openapi_patch_middleware``) flagging the operations of ``func_names`` as
+    streaming newline delimited json. Their calls only take json.
+
+    >>> spec = {'paths': {'/gen': {'post': {'requestBody': {'content': {
+    ...     'application/json': {}, 'application/x-msgpack': {}}}}}}}
+    >>> spec = mk_stream_spec_patch(['gen'])(spec)
+    >>> operation_spec = spec['paths']['/gen']['post']
+    >>> operation_spec['x-extrude-stream']
+    True
+    >>> list(operation_spec['requestBody']['content'])
+    ['application/json']
+    """
+    paths = {f'/{name}' for name in func_names}
+
+    def mark_streams(spec: dict) -> dict:
+        for path, path_spec in spec.get('paths', {}).items():
+            if path in paths:
+                for operation_spec in path_spec.values():
+                    operation_spec[STREAM_SPEC_KEY] = True
+                    request_body = operation_spec.get('requestBody', {})
+                    if 'content' in request_body:
+                        request_body['content'] = {
+                            k: v
+                            for k, v in request_body['content'].items()
+                            if k == 'application/json'
+                        }
+                    operation_spec.setdefault('responses', {})['200'] = {
+                        'content': {JSON_LINES_CONTENT_TYPE: {'schema': {}}}
+                    }
+        return spec
+
+    return mark_streams
+
+
+def iter_response_items(response):
+    """Iterates over the items of a streamed (newline delimited json) ``requests``
+    response as they arrive, closing it once done. Raises a StreamError if the stream
+    ends with an error record.
+
+    >>> class Response:
+    ...     def __enter__(self): return self
+    ...     def __exit__(self, *exc_info): pass
+    ...     def iter_lines(self):
+    ...         return [b'0', b'{"error": "ValueError: no more", '
+    ...                 b'"x-extrude-stream-error": true}']
+    >>> items = iter_response_items(Response())
+    >>> next(items)
+    0
+    >>> next(items)
+    Traceback (most recent call last):
+      ...
+    extrude.streaming.StreamError: ValueError: no more
+    """
+    with response:
+        for line in response.iter_lines():
+            if line:
+                item = json.loads(line)
+                if isinstance(item, dict) and item.get(STREAM_ERROR_KEY) is True:
+                    raise StreamError(item.get('error'))
+                yield item
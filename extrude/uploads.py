@@ -0,0 +1,230 @@
+"""Streaming uploads of large files into the file-backed stores of a Mall.
+
+A file is uploaded in chunks: each chunk is the raw body of a ``PUT`` request, written
+to a partial file as it is read, so that memory use doesn't depend on the size of the
+file. Once the last chunk is written, the partial file is moved into the store, where
+its key can be used as the value of crudified parameters. An interrupted upload resumes
+from the size of the partial file, which a ``GET`` request tells.
+"""
+
+import os
+import threading
+from typing import Mapping, Optional
+
+from extrude.middleware import json_response, query_params
+
+UPLOAD_PATH = '/upload'
+DFLT_READ_SIZE = 1024 * 1024
+DFLT_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+class UploadError(ValueError):
+    """Raised when an upload request can't be served. ``status`` is its HTTP status."""
+
+    def __init__(self, message: str, status: str = '400 Bad Request'):
+        super().__init__(message)
+        self.status = status
+
+
+def store_rootdir(store) -> Optional[str]:
+    """The directory holding the files of a file-backed store (a ``dol.Files``, say),
+    or None if ``store`` isn't file-backed."""
+    rootdir = getattr(store, 'rootdir', None)
+    return rootdir if isinstance(rootdir, str) and os.path.isdir(rootdir) else None
+
+
+def _safe_relpath(key: str) -> str:
+    """Checks that ``key`` is a relative path staying inside its store.
+
+    >>> _safe_relpath('sensors/run_1.wav')
+    'sensors/run_1.wav'
+    >>> _safe_relpath('../etc/passwd')
+    Traceback (most recent call last):
+      ...
+    extrude.uploads.UploadError: Invalid key: ../etc/passwd
+    """
+    relpath = os.path.normpath(key or '')
+    if not key or os.path.isabs(relpath) or relpath.split(os.sep)[0] in ('..', '.'):
+        raise UploadError(f'Invalid key: {key}')
+    return relpath
+
+
+def iter_body_chunks(environ, read_size: int = DFLT_READ_SIZE):
+    """Reads the body of a request piece by piece. Bodies without a ``Content-Length``
+    (chunked transfer encoding) are read until their end if the server tells where it
+    is (``wsgi.input_terminated``)."""
+    stream = environ['wsgi.input']
+    if environ.get('CONTENT_LENGTH'):
+        remaining = int(environ['CONTENT_LENGTH'])
+        while remaining > 0:
+            chunk = stream.read(min(read_size, remaining))
+            if not chunk:
+                raise UploadError('The body is shorter than its Content-Length')
+            remaining -= len(chunk)
+            yield chunk
+    elif environ.get('wsgi.input_terminated'):
+        yield from iter(lambda: stream.read(read_size), b'')
+    elif environ.get('HTTP_TRANSFER_ENCODING', '').lower() == 'chunked':
+        raise UploadError(
+            'This server can not read chunked bodies: send a Content-Length',
+            status='411 Length Required',
+        )
+
+
+class Uploads:
+    """Handles the uploads into the file-backed stores of ``mall``.
+
+    :param mall: The mall.
+    :param upload_dir: (Optional) Where partial files are kept, in a subdirectory per
+        store. Defaults to a ``<store root>.uploads`` directory next to the directory of
+        each store, so that partial files don't show in the store and are moved into it
+        without a copy.
+    :param read_size: The size of the pieces request bodies are read in.
+
+    >>> import tempfile, io
+    >>> class Files(dict):  # stands for a dol.Files store
+    ...     rootdir = tempfile.mkdtemp()
+    >>> uploads = Uploads({'blobs': Files()})
+    >>> uploads.write('blobs', 'a.bin', io.BytesIO(b'hello'), length=5, offset=0)
+    {'key': 'a.bin', 'offset': 5, 'complete': False}
+    >>> uploads.status('blobs', 'a.bin')
+    {'key': 'a.bin', 'offset': 5, 'complete': False}
+    >>> uploads.write('blobs', 'a.bin', io.BytesIO(b' world'), length=6, offset=5,
+    ...               complete=True)
+    {'key': 'a.bin', 'offset': 11, 'complete': True}
+    >>> with open(os.path.join(Files.rootdir, 'a.bin'), 'rb') as fp:
+    ...     fp.read()
+    b'hello world'
+    >>> query = 'store_name_=blobs&key=a.bin&offset=x'
+    >>> environ = {'REQUEST_METHOD': 'PUT', 'QUERY_STRING': query}
+    >>> uploads(environ, lambda status, headers: print(status))
+    400 Bad Request
+    [b'{"error": "Invalid offset: x"}']
+    """
+
+    def __init__(
+        self,
+        mall: Mapping,
+        upload_dir: Optional[str] = None,
+        *,
+        read_size: int = DFLT_READ_SIZE,
+    ):
+        self.mall = mall
+        self.upload_dir = upload_dir
+        self.read_size = read_size
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def paths(self, store_name: str, key: str):
+        """The paths of the partial and of the final file of an upload."""
+        if store_name not in self.mall:
+            raise UploadError(f'No store named "{store_name}"', '404 Not Found')
+        rootdir = store_rootdir(self.mall[store_name])
+        if rootdir is None:
+            raise UploadError(f'The "{store_name}" store is not file-backed')
+        relpath = _safe_relpath(key)
+        if self.upload_dir is None:
+            partial_dir = rootdir.rstrip(os.sep) + '.uploads'
+        else:
+            partial_dir = os.path.join(self.upload_dir, store_name)
+        return (
+            os.path.join(partial_dir, relpath + '.part'),
+            os.path.join(rootdir, relpath),
+        )
+
+    def _lock(self, partial_path):
+        with self._locks_lock:
+            return self._locks.setdefault(partial_path, threading.Lock())
+
+    def status(self, store_name: str, key: str) -> dict:
+        """Tells where to resume an upload from (``offset``), and whether it's done."""
+        partial_path, final_path = self.paths(store_name, key)
+        if os.path.exists(partial_path):
+            offset, complete = os.path.getsize(partial_path), False
+        elif os.path.exists(final_path):
+            offset, complete = os.path.getsize(final_path), True
+        else:
+            offset, complete = 0, False
+        return dict(key=key, offset=offset, complete=complete)
+
+    def write(
+        self,
+        store_name: str,
+        key: str,
+        stream,
+        *,
+        length: Optional[int] = None,
+        offset: int = 0,
+        complete: bool = False,
+    ) -> dict:
+        """Writes a chunk, read from the file-like ``stream``, at ``offset`` in the
+        partial file of an upload, and moves the file into the store if ``complete``.
+        The offset must be the current size of the partial file: chunks are written in
+        order, once. Without a ``length``, ``stream`` is read to its end.
+        """
+        environ = {
+            'wsgi.input': stream,
+            'CONTENT_LENGTH': length,
+            'wsgi.input_terminated': length is None,
+        }
+        return self._write(store_name, key, environ, offset, complete)
+
+    def _write(self, store_name, key, environ, offset, complete):
+        partial_path, final_path = self.paths(store_name, key)
+        with self._lock(partial_path):
+            current_offset = (
+                os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+            )
+            if offset != current_offset:
+                raise UploadError(
+                    f'Upload of "{key}" is at offset {current_offset}, not {offset}',
+                    '409 Conflict',
+                )
+            os.makedirs(os.path.dirname(partial_path), exist_ok=True)
+            with open(partial_path, 'ab') as fp:
+                for chunk in iter_body_chunks(environ, self.read_size):
+                    fp.write(chunk)
+                offset = fp.tell()
+            if complete:
+                os.makedirs(os.path.dirname(final_path), exist_ok=True)
+                os.replace(partial_path, final_path)
+        return dict(key=key, offset=offset, complete=complete)
+
+    def __call__(self, environ, start_response):
+        """The WSGI app of the uploads: ``GET`` gives the status of an upload, and
+        ``PUT`` writes a chunk, given by the ``store_name_``, ``key``, ``offset`` and
+        ``complete`` query parameters."""
+        params = query_params(environ)
+        method = environ.get('REQUEST_METHOD', 'GET').upper()
+        try:
+            missing = [name for name in ('store_name_', 'key') if not params.get(name)]
+            if missing:
+                raise UploadError(f'Missing query parameters: {", ".join(missing)}')
+            if method in ('GET', 'HEAD'):
+                result = self.status(params['store_name_'], params['key'])
+            elif method in ('PUT', 'POST'):
+                try:
+                    offset = int(params.get('offset', 0))
+                except ValueError:
+                    raise UploadError(f'Invalid offset: {params["offset"]}')
+                result = self._write(
+                    params['store_name_'],
+                    params['key'],
+                    environ,
+                    offset=offset,
+                    complete=params.get('complete', '').lower() in ('1', 'true'),
+                )
+            else:
+                raise UploadError(
+                    f'Unsupported method: {method}', '405 Method Not Allowed'
+                )
+        except UploadError as error:
+            body = dict(error=str(error))
+            if error.status.startswith('409'):
+                body.update(self.status(params.get('store_name_'), params.get('key')))
+            return json_response(start_response, body, status=error.status)
+        except OSError as error:
+            return json_response(
+                start_response, dict(error=str(error)), '500 Internal Server Error'
+            )
+        return json_response(start_response, result)
@@ -1,13 +1,110 @@
-from typing import Iterable, Mapping, Union
-from meshed import DAG
+import ast
+import hashlib
+import json
+import pickle
+import subprocess
+import sys
+from typing import TYPE_CHECKING, Callable, Iterable, Mapping, Union
+from i2 import Sig, name_of_obj
+
+if TYPE_CHECKING:
+    from meshed import DAG
 
 SubDagSpec = Mapping[str, Iterable[Union[Iterable[str], str]]]
 
 
-def split_dag(dag: DAG, sub_dag_spec: SubDagSpec):
+def split_dag(dag: 'DAG', sub_dag_spec: SubDagSpec):
     sub_dags = []
     for func_name, spec in sub_dag_spec.items():
         sub_dag = dag[spec]
         sub_dag.__name__ == func_name
         sub_dags.append(sub_dag)
     return sub_dags
+
+
+def imported_modules(code: str) -> set:
+    """The names of the top level packages (and modules) imported by running ``code``
+    in a fresh python process, which tells what importing something costs.
+
+    >>> 'json' in imported_modules('import json')
+    True
+    """
+    script = f'import sys\n{code}\nprint(repr(sorted(sys.modules)))'
+    output = subprocess.run(
+        [sys.executable, '-c', script], capture_output=True, text=True, check=True
+    ).stdout
+    modules = ast.literal_eval(output.strip().splitlines()[-1])
+    return {name.split('.')[0] for name in modules}
+
+
+def funcs_fingerprint(funcs: Iterable[Callable], **extra) -> str:
+    """A hash of the names and signatures of ``funcs`` (and of the json-serializable
+    ``extra`` info), which changes whenever the interface of an API exposing them does.
+
+    >>> def foo(a, b: int = 1): ...
+    >>> def bar(x): ...
+    >>> funcs_fingerprint([foo, bar]) == funcs_fingerprint([foo, bar])
+    True
+    >>> funcs_fingerprint([foo, bar]) == funcs_fingerprint([foo])
+    False
+    """
+    interface = [(name_of_obj(func), str(Sig(func))) for func in funcs]
+    description = json.dumps([interface, extra], sort_keys=True, default=str)
+    return hashlib.sha256(description.encode()).hexdigest()
+
+
+def stable_hash(obj) -> str:
+    """A hash of ``obj`` which, unlike ``hash``, is the same across processes and runs,
+    and handles unhashable containers, numpy arrays and pandas objects (without
+    importing numpy or pandas). Mappings and sets are hashed regardless of their order.
+
+    >>> stable_hash({'a': [1, 2.0], 'b': None}) == stable_hash({'b': None, 'a': [1, 2]})
+    False
+    >>> stable_hash({'a': [1, 2], 'b': None}) == stable_hash({'b': None, 'a': [1, 2]})
+    True
+    >>> stable_hash([1, 2]) == stable_hash((1, 2))
+    False
+    >>> stable_hash('1') == stable_hash(1)
+    False
+    """
+    hasher = hashlib.sha256()
+    _update_hash(hasher, obj)
+    return hasher.hexdigest()
+
+
+def _update_hash(hasher, obj):
+    def update(tag, data: bytes = b''):
+        hasher.update(f'{tag}:{len(data)}:'.encode())
+        hasher.update(data)
+
+    if obj is None or isinstance(obj, (bool, int, float, complex)):
+        update(type(obj).__name__, repr(obj).encode())
+    elif isinstance(obj, str):
+        update('str', obj.encode())
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        update('bytes', bytes(obj))
+    elif isinstance(obj, Mapping):
+        update('mapping', str(len(obj)).encode())
+        items = sorted((stable_hash(k), stable_hash(v)) for k, v in obj.items())
+        for item_hashes in items:
+            update('item', ''.join(item_hashes).encode())
+    elif isinstance(obj, (list, tuple)):
+        update(type(obj).__name__, str(len(obj)).encode())
+        for item in obj:
+            _update_hash(hasher, item)
+    elif isinstance(obj, (set, frozenset)):
+        update('set', ''.join(sorted(map(stable_hash, obj))).encode())
+    elif type(obj).__module__.startswith('pandas'):
+        from pandas.util import hash_pandas_object
+
+        update(type(obj).__name__, hash_pandas_object(obj).to_numpy().tobytes())
+        _update_hash(hasher, [str(getattr(obj, 'name', None))])
+        _update_hash(hasher, list(map(str, getattr(obj, 'columns', []))))
+    elif all(hasattr(obj, attr) for attr in ('dtype', 'shape', 'tobytes')):
+        update('array', f'{obj.dtype.str}{obj.shape}'.encode())
+        if obj.dtype.hasobject:
+            _update_hash(hasher, obj.tolist())
+        else:
+            update('data', obj.tobytes())
+    else:
+        update('pickle', pickle.dumps(obj, protocol=4))
@@ -0,0 +1,282 @@
+"""A binary, array-aware wire format for extrude APIs: msgpack, with numpy arrays
+carried as raw buffers.
+
+Clients opt in through content negotiation (``Content-Type`` and ``Accept`` headers),
+and json remains the fallback. ``msgpack`` (and ``numpy``, for arrays) are optional
+dependencies: without msgpack, APIs and clients just keep to json.
+"""
+
+import io
+import json
+from inspect import signature
+from typing import Callable, Mapping, Optional
+
+from extrude.middleware import read_body
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_CONTENT_TYPE = 'application/json'
+MSGPACK_CONTENT_TYPE = 'application/x-msgpack'
+WIRE_FORMATS_SPEC_KEY = 'x-extrude-wire-formats'
+NUMPY_EXT_CODE = 42
+
+
+def msgpack_available() -> bool:
+    return msgpack is not None
+
+
+def _encode_ext(obj):
+    if type(obj).__module__ == 'numpy':
+        if hasattr(obj, 'shape') and hasattr(obj, 'tobytes'):
+            if obj.shape == ():  # a numpy scalar
+                return obj.item()
+            if not obj.dtype.hasobject:
+                header = msgpack.packb([obj.dtype.str, list(obj.shape)])
+                return msgpack.ExtType(NUMPY_EXT_CODE, header + obj.tobytes())
+            return obj.tolist()
+    if type(obj).__module__.startswith('pandas') and hasattr(obj, 'to_dict'):
+        return obj.to_dict()
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    raise TypeError(f'Can not encode {type(obj)} objects')
+
+
+def _decode_ext(code, data):
+    if code != NUMPY_EXT_CODE:
+        return msgpack.ExtType(code, data)
+    import numpy as np
+
+    unpacker = msgpack.Unpacker(use_list=True)
+    unpacker.feed(data)
+    dtype, shape = unpacker.unpack()
+    buffer = memoryview(data)[unpacker.tell() :]
+    return np.frombuffer(buffer, dtype=dtype).reshape(shape)
+
+
+def encode(obj, content_type: str = MSGPACK_CONTENT_TYPE) -> bytes:
+    """Encodes ``obj`` in the wire format of ``content_type``.
+
+    >>> decode(encode({'a': [1, 2]}, JSON_CONTENT_TYPE), JSON_CONTENT_TYPE)
+    {'a': [1, 2]}
+    """
+    if content_type == MSGPACK_CONTENT_TYPE:
+        return msgpack.packb(obj, default=_encode_ext, use_bin_type=True)
+    return json.dumps(obj).encode()
+
+
+def decode(data: bytes, content_type: str = MSGPACK_CONTENT_TYPE):
+    """Decodes ``data`` from the wire format of ``content_type``. Numpy arrays are
+    views on ``data``: they aren't copied (and are read-only)."""
+    if content_type == MSGPACK_CONTENT_TYPE:
+        return msgpack.unpackb(data, ext_hook=_decode_ext, raw=False)
+    return json.loads(data) if data else None
+
+
+def accepts_msgpack(environ) -> bool:
+    return MSGPACK_CONTENT_TYPE in environ.get('HTTP_ACCEPT', '')
+
+
+def sends_msgpack(environ) -> bool:
+    return environ.get('CONTENT_TYPE', '').startswith(MSGPACK_CONTENT_TYPE)
+
+
+BAD_REQUEST = '400 Bad Request'
+# The py2http configs of the functions whose requests and responses it maps its own way
+PY2HTTP_MAPPING_CONFIGS = ('input_mapper', 'output_mapper', 'header_inputs')
+
+
+class WireInputError(ValueError):
+    """Raised when the body of a call can't be decoded, or doesn't fit the parameters of
+    the function called."""
+
+
+def _py2http_config(func, name: str, configs: Mapping, key: str):
+    # Like py2http: the attribute of the function, else its entry in the configs
+    value = getattr(func, key, configs.get(key))
+    if isinstance(value, Mapping):
+        value = value.get(name, value.get('$else'))
+    return value
+
+
+def _has_own_mapping(func, name: str, configs: Mapping) -> bool:
+    return any(
+        _py2http_config(func, name, configs, key) for key in PY2HTTP_MAPPING_CONFIGS
+    )
+
+
+def _decode_kwargs(data: bytes, content_type: str) -> dict:
+    try:
+        kwargs = decode(data, content_type)
+    except Exception as error:  # msgpack and json raise different errors
+        raise WireInputError(
+            f'The body is not valid {content_type}: {type(error).__name__} {error}'
+        )
+    if kwargs is None:
+        return {}
+    if not isinstance(kwargs, Mapping):
+        raise WireInputError(
+            f'The body should be a mapping of arguments, not a {type(kwargs).__name__}'
+        )
+    return dict(kwargs)
+
+
+def bind_kwargs(func: Callable, kwargs: Mapping):
+    """The ``(args, kwargs)`` to call ``func`` with, given the ``kwargs`` of a request,
+    passing the ones of positional-only parameters positionally, as py2http does.
+    Raises a WireInputError if they don't fit the signature of ``func``.
+
+    >>> def f(a, /, b, c=3):
+    ...     pass
+    >>> bind_kwargs(f, {'a': 1, 'b': 2})
+    ((1, 2, 3), {})
+    >>> bind_kwargs(f, {'a': 1, 'd': 4})
+    Traceback (most recent call last):
+      ...
+    extrude.wire.WireInputError: Bad arguments for f: missing a required argument: 'b'
+    """
+    try:
+        sig = signature(func)
+    except (TypeError, ValueError):  # no signature to check the arguments against
+        return (), dict(kwargs)
+    kwargs = dict(kwargs)
+    args = []
+    for param in sig.parameters.values():
+        if param.kind != param.POSITIONAL_ONLY or param.name not in kwargs:
+            break
+        args.append(kwargs.pop(param.name))
+    try:
+        bound = sig.bind(*args, **kwargs)
+    except TypeError as error:
+        name = getattr(func, '__name__', func)
+        raise WireInputError(f'Bad arguments for {name}: {error}')
+    bound.apply_defaults()
+    return bound.args, bound.kwargs
+
+
+def _error_response(start_response, error, status, content_type):
+    body = encode(dict(error=f'{type(error).__name__}: {error}'), content_type)
+    start_response(
+        status, [('Content-Type', content_type), ('Content-Length', str(len(body)))]
+    )
+    return [body]
+
+
+def mk_wire_format_middleware(
+    funcs: Mapping[str, Callable], configs: Optional[Mapping] = None
+):
+    """Returns a middleware serving the calls of ``funcs`` (a ``{name: func}`` mapping,
+    served at ``/name``) that send or accept msgpack. The other requests, which use
+    json, go to the wrapped app.
+
+    The arguments are checked against the signature of the function, and passed to it
+    as py2http does (see ``bind_kwargs``): bodies that can't be decoded, or that don't
+    fit the signature, get a ``400`` response. The functions given their own
+    ``input_mapper``, ``output_mapper`` or ``header_inputs`` in ``configs`` (the ones
+    of the py2http app) or as attributes are left to the app: their msgpack requests
+    and responses are converted from and to json.
+    """
+    configs = configs or {}
+    own_mapping = {
+        name for name, func in funcs.items() if _has_own_mapping(func, name, configs)
+    }
+
+    def middleware(wsgi):
+        def convert_for_app(environ, start_response, in_type, out_type):
+            if in_type == MSGPACK_CONTENT_TYPE:
+                try:
+                    body = encode(
+                        _decode_kwargs(read_body(environ), in_type), JSON_CONTENT_TYPE
+                    )
+                except (WireInputError, TypeError, ValueError) as error:
+                    return _error_response(start_response, error, BAD_REQUEST, out_type)
+                environ['wsgi.input'] = io.BytesIO(body)
+                environ['CONTENT_LENGTH'] = str(len(body))
+                environ['CONTENT_TYPE'] = JSON_CONTENT_TYPE
+            if out_type != MSGPACK_CONTENT_TYPE:
+                return wsgi(environ, start_response)
+            environ['HTTP_ACCEPT'] = JSON_CONTENT_TYPE
+            captured = {}
+
+            def capture_start_response(status, headers, *args):
+                captured.update(status=status, headers=headers)
+                return lambda data: None  # the body is only sent once converted
+
+            body = b''.join(wsgi(environ, capture_start_response))
+            headers = [
+                (k, v)
+                for k, v in captured['headers']
+                if k.lower() not in ('content-length', 'content-type')
+            ]
+            content_type = next(
+                (v for k, v in captured['headers'] if k.lower() == 'content-type'), ''
+            )
+            if content_type.startswith(JSON_CONTENT_TYPE):
+                body = encode(decode(body, JSON_CONTENT_TYPE), MSGPACK_CONTENT_TYPE)
+                content_type = MSGPACK_CONTENT_TYPE
+            headers += [
+                ('Content-Type', content_type),
+                ('Content-Length', str(len(body))),
+            ]
+            start_response(captured['status'], headers)
+            return [body]
+
+        def wire_format_wsgi(environ, start_response):
+            func_name = environ.get('PATH_INFO', '').strip('/')
+            func = funcs.get(func_name)
+            if func is None or not (sends_msgpack(environ) or accepts_msgpack(environ)):
+                return wsgi(environ, start_response)
+            in_type, out_type = (
+                MSGPACK_CONTENT_TYPE if is_msgpack else JSON_CONTENT_TYPE
+                for is_msgpack in (sends_msgpack(environ), accepts_msgpack(environ))
+            )
+            if func_name in own_mapping:
+                return convert_for_app(environ, start_response, in_type, out_type)
+            try:
+                kwargs = _decode_kwargs(read_body(environ), in_type)
+                args, kwargs = bind_kwargs(func, kwargs)
+            except WireInputError as error:
+                return _error_response(start_response, error, BAD_REQUEST, out_type)
+            try:
+                body = encode(func(*args, **kwargs), out_type)
+            except Exception as error:
+                return _error_response(
+                    start_response, error, '500 Internal Server Error', out_type
+                )
+            start_response(
+                '200 OK',
+                [('Content-Type', out_type), ('Content-Length', str(len(body)))],
+            )
+            return [body]
+
+        return wire_format_wsgi
+
+    return middleware
+
+
+def advertise_wire_formats(spec: dict) -> dict:
+    """Patches an OpenAPI spec to tell that its operations also take and return
+    msgpack (see ``extrude.middleware.mk_openapi_patch_middleware``).
+
+    >>> spec = {'paths': {'/foo': {'post': {'requestBody': {'content': {
+    ...     'application/json': {'schema': {'type': 'object'}}}}}}}}
+    >>> spec = advertise_wire_formats(spec)
+    >>> spec['x-extrude-wire-formats']
+    ['application/x-msgpack', 'application/json']
+    >>> sorted(spec['paths']['/foo']['post']['requestBody']['content'])
+    ['application/json', 'application/x-msgpack']
+    """
+    spec = dict(spec)
+    spec[WIRE_FORMATS_SPEC_KEY] = [MSGPACK_CONTENT_TYPE, JSON_CONTENT_TYPE]
+    for path_spec in spec.get('paths', {}).values():
+        for operation_spec in path_spec.values():
+            for section in (
+                [operation_spec.get('requestBody', {})]
+                + list(operation_spec.get('responses', {}).values())
+            ):
+                content = section.get('content', {})
+                if JSON_CONTENT_TYPE in content:
+                    content.setdefault(MSGPACK_CONTENT_TYPE, content[JSON_CONTENT_TYPE])
+    return spec